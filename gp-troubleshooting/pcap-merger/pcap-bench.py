@@ -0,0 +1,556 @@
+#!/usr/bin/env python3
+"""
+PCAP Merger Benchmark Harness
+Generates synthetic pcap/pcapng captures and benchmarks the pcap-merger steps
+(merge, dedup, summary and the streamed split path) on them.  Results are
+appended to a JSON Lines file so runs can be compared for regressions.
+Requirements: mergecap, editcap, and tshark (Wireshark tools) must be installed
+for the run subcommand.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_RESULTS = 'bench-results.jsonl'
+
+
+def load_merger():
+    """Import pcap-merger.py (its file name is not a valid module name)."""
+    path = Path(__file__).resolve().parent / 'pcap-merger.py'
+    spec = importlib.util.spec_from_file_location('pcap_merger', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# ---------------------------------------------------------------------------
+# Synthetic capture generation
+# ---------------------------------------------------------------------------
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+
+def build_packet(rng, flow, seq, payload_size):
+    """Build an Ethernet/IPv4/UDP frame for a flow."""
+    src_ip, dst_ip, src_port, dst_port = flow
+    payload = seq.to_bytes(4, 'big') + rng.randbytes(max(0, payload_size - 4))
+    udp = struct.pack('!HHHH', src_port, dst_port, 8 + len(payload), 0) + payload
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(udp), seq & 0xffff, 0,
+                     64, 17, 0, src_ip, dst_ip)
+    ip = ip[:10] + struct.pack('!H', _checksum(ip)) + ip[12:]
+    eth = b'\x00\x1b\x17\x00\x00\x01' + b'\x00\x1b\x17\x00\x00\x02' + b'\x08\x00'
+    return eth + ip + udp
+
+
+class PcapWriter:
+    """Minimal pcap (microsecond) writer."""
+
+    def __init__(self, f):
+        self.f = f
+        f.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 262144, 1))
+
+    def write(self, ts, data):
+        sec = int(ts)
+        usec = int(round((ts - sec) * 1e6))
+        self.f.write(struct.pack('<IIII', sec, usec, len(data), len(data)))
+        self.f.write(data)
+
+
+class PcapngWriter:
+    """Minimal pcapng writer: one section, one Ethernet interface."""
+
+    def __init__(self, f):
+        self.f = f
+        self._block(0x0A0D0D0A, struct.pack('<IHHq', 0x1A2B3C4D, 1, 0, -1))
+        self._block(1, struct.pack('<HHI', 1, 0, 262144))
+
+    def _block(self, block_type, body):
+        body += b'\0' * (-len(body) % 4)
+        length = 12 + len(body)
+        self.f.write(struct.pack('<II', block_type, length) + body +
+                     struct.pack('<I', length))
+
+    def write(self, ts, data):
+        usec = int(round(ts * 1e6))
+        self._block(6, struct.pack('<IIIII', 0, usec >> 32, usec & 0xffffffff,
+                                   len(data), len(data)) + data)
+
+
+def generate(out_dir, files, packets, overlap, dup_rate, payload_size, fmt, flows, seed):
+    """Write synthetic captures and return a description of the dataset.
+
+    Each file covers packets * 1ms of traffic.  File i starts (1 - overlap)
+    of a file duration after file i - 1, so overlap=0 gives back-to-back
+    captures and overlap=1 gives fully concurrent ones.  dup_rate is the
+    fraction of packets immediately repeated (editcap -d removes these).
+    """
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    gap = 0.001
+    duration = packets * gap
+    base = 1700000000.0
+    flow_table = [(bytes([10, 0, rng.randrange(256), rng.randrange(1, 255)]),
+                   bytes([192, 168, rng.randrange(256), rng.randrange(1, 255)]),
+                   rng.randrange(1024, 65536), rng.choice([53, 443, 4501]))
+                  for _ in range(flows)]
+    writer_class = PcapngWriter if fmt == 'pcapng' else PcapWriter
+
+    written = []
+    total_packets = 0
+    total_dups = 0
+    for i in range(files):
+        path = os.path.join(out_dir, f"capture-{i + 1:03d}.{fmt}")
+        start = base + i * duration * (1 - overlap)
+        with open(path, 'wb') as f:
+            writer = writer_class(f)
+            for n in range(packets):
+                ts = start + n * gap + rng.random() * gap / 2
+                data = build_packet(rng, rng.choice(flow_table), i * packets + n, payload_size)
+                writer.write(ts, data)
+                total_packets += 1
+                if rng.random() < dup_rate:
+                    writer.write(ts + 1e-6, data)
+                    total_packets += 1
+                    total_dups += 1
+        written.append(path)
+
+    return {
+        'files': written,
+        'packets': total_packets,
+        'duplicates': total_dups,
+        'bytes': sum(os.path.getsize(x) for x in written),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Measurement
+# ---------------------------------------------------------------------------
+
+def count_packets(path):
+    """Count packet records in a pcap or pcapng file."""
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+        if magic == b'\x0a\x0d\x0d\x0a':
+            f.seek(0)
+            count = 0
+            endian = '<'
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    return count
+                if header[:4] == b'\x0a\x0d\x0d\x0a':
+                    bom = f.read(4)
+                    endian = '<' if bom == b'\x4d\x3c\x2b\x1a' else '>'
+                    f.seek(-4, os.SEEK_CUR)
+                block_type, length = struct.unpack(endian + 'II', header)
+                if block_type in (2, 3, 6):
+                    count += 1
+                f.seek(length - 8, os.SEEK_CUR)
+
+        f.seek(0)
+        header = f.read(24)
+        endian = '<' if header[:4] in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1') else '>'
+        count = 0
+        while True:
+            rec = f.read(16)
+            if len(rec) < 16:
+                return count
+            incl_len = struct.unpack(endian + 'IIII', rec)[2]
+            f.seek(incl_len, os.SEEK_CUR)
+            count += 1
+
+
+def _maxrss_mb(ru_maxrss):
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    if sys.platform == 'darwin':
+        return ru_maxrss / (1024 * 1024)
+    return ru_maxrss / 1024
+
+
+def run_step(cmd, stdout_path=None):
+    """Run an external step; return (wall seconds, peak RSS MB or None)."""
+    with tempfile.TemporaryFile() as err:
+        out = open(stdout_path, 'wb') if stdout_path else subprocess.DEVNULL
+        try:
+            start = time.perf_counter()
+            proc = subprocess.Popen(cmd, stdout=out, stderr=err)
+            if hasattr(os, 'wait4'):
+                _, status, usage = os.wait4(proc.pid, 0)
+                proc.returncode = os.waitstatus_to_exitcode(status)
+                rss = _maxrss_mb(usage.ru_maxrss)
+            else:
+                proc.wait()
+                rss = None
+            wall = time.perf_counter() - start
+        finally:
+            if stdout_path:
+                out.close()
+        if proc.returncode != 0:
+            err.seek(0)
+            raise RuntimeError(f"{' '.join(cmd)}: {err.read().decode(errors='replace').strip()}")
+    return wall, rss
+
+
+def _vmhwm_mb():
+    # peak RSS of this process's address space; unlike ru_maxrss it is
+    # reset by exec, so it excludes the harness's pages
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def run_split(tool_paths, files, base, split_interval, split_size):
+    """Run the streamed split step; return (wall seconds, max RSS MB or None, slices).
+
+    The step runs in a new interpreter (the split-step subcommand), which
+    measures itself: ru_maxrss survives fork and exec, so a measurement taken
+    here with wait4 would include the harness's resident pages.  The figure is
+    the RSS of the largest single process among the splitter and the mergecap
+    and editcap it runs, not the total of the concurrent pipeline, so it is
+    recorded as max_process_rss_mb.  It is None where it cannot be measured.
+    """
+    spec = {
+        'tool_paths': tool_paths,
+        'files': files,
+        'base': base,
+        'split_interval': split_interval,
+        'split_size': split_size,
+    }
+    cmd = [sys.executable, os.path.abspath(__file__), 'split-step', json.dumps(spec)]
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    wall = time.perf_counter() - start
+    try:
+        result = json.loads(proc.stdout)
+    except ValueError:
+        result = {'error': proc.stderr.decode(errors='replace').strip() or
+                  f"exit status {proc.returncode}"}
+    if result['error']:
+        raise RuntimeError(f"split: {result['error']}")
+    return wall, result['max_process_rss_mb'], result['slices']
+
+
+def _rates(wall, packets, size):
+    return {
+        'wall': wall,
+        'packets_per_s': packets / wall if wall else None,
+        'mb_per_s': size / (1024 * 1024) / wall if wall else None,
+    }
+
+
+def benchmark(tool_paths, files, work_dir, split_interval=None, split_size=None):
+    """Benchmark each pcap-merger step on files; return per-step results."""
+    in_bytes = sum(os.path.getsize(x) for x in files)
+    in_packets = sum(count_packets(x) for x in files)
+    merged = os.path.join(work_dir, 'bench.pcap')
+    dedup = os.path.join(work_dir, 'bench-d.pcap')
+    summary = os.path.join(work_dir, 'bench-d.txt')
+    steps = {}
+
+    print("  merge...", flush=True)
+    wall, rss = run_step([tool_paths['mergecap'], '-w', merged] + files)
+    steps['merge'] = dict(_rates(wall, in_packets, in_bytes), peak_rss_mb=rss)
+
+    merged_packets = count_packets(merged)
+    merged_bytes = os.path.getsize(merged)
+    print("  dedup...", flush=True)
+    wall, rss = run_step([tool_paths['editcap'], '-d', merged, dedup])
+    steps['dedup'] = dict(_rates(wall, merged_packets, merged_bytes), peak_rss_mb=rss)
+
+    dedup_packets = count_packets(dedup)
+    dedup_bytes = os.path.getsize(dedup)
+    print("  summary...", flush=True)
+    wall, rss = run_step([tool_paths['tshark'], '-r', dedup], stdout_path=summary)
+    steps['summary'] = dict(_rates(wall, dedup_packets, dedup_bytes), peak_rss_mb=rss)
+
+    if split_interval or split_size:
+        # mergecap | editcap -d | native splitter, as used by --split-*
+        print("  split...", flush=True)
+        wall, rss, slices = run_split(tool_paths, files,
+                                      os.path.join(work_dir, 'bench-split'),
+                                      split_interval, split_size)
+        steps['split'] = dict(_rates(wall, in_packets, in_bytes),
+                              max_process_rss_mb=rss, slices=slices)
+
+    dataset = {
+        'files': len(files),
+        'bytes': in_bytes,
+        'packets': in_packets,
+        'merged_packets': merged_packets,
+        'dedup_packets': dedup_packets,
+    }
+    return dataset, steps
+
+
+def format_rate(x, fmt):
+    return '-' if x is None else format(x, fmt)
+
+
+def _rss_key(step):
+    # the split step records the largest single process of its pipeline
+    return 'peak_rss_mb' if 'peak_rss_mb' in step else 'max_process_rss_mb'
+
+
+def print_result(result):
+    d = result['dataset']
+    print(f"\nDataset: {d['files']} files, {d['packets']} packets, "
+          f"{d['bytes'] / (1024 * 1024):.2f} MB "
+          f"({d['merged_packets'] - d['dedup_packets']} duplicates removed)")
+    print(f"{'Step':<8}  {'Wall s':>8}  {'Packets/s':>11}  {'MB/s':>8}  {'Peak RSS MB':>11}")
+    for name, x in result['steps'].items():
+        key = _rss_key(x)
+        note = '*' if key == 'max_process_rss_mb' else ''
+        print(f"{name:<8}  {x['wall']:>8.3f}  {format_rate(x['packets_per_s'], '.0f'):>11}  "
+              f"{format_rate(x['mb_per_s'], '.2f'):>8}  "
+              f"{format_rate(x.get(key), '.1f'):>11}{note}")
+    if any(_rss_key(x) == 'max_process_rss_mb' for x in result['steps'].values()):
+        print("* largest single process of the pipeline, not the pipeline total")
+
+
+# ---------------------------------------------------------------------------
+# Subcommands
+# ---------------------------------------------------------------------------
+
+def cmd_generate(args):
+    dataset = generate(args.out_dir, args.files, args.packets, args.overlap,
+                       args.dup_rate, args.payload_size, args.format, args.flows,
+                       args.seed)
+    print(f"✓ Wrote {len(dataset['files'])} {args.format} files to {args.out_dir}: "
+          f"{dataset['packets']} packets ({dataset['duplicates']} duplicates), "
+          f"{dataset['bytes'] / (1024 * 1024):.2f} MB")
+    return 0
+
+
+def cmd_run(args):
+    merger = load_merger()
+    files = []
+    for x in args.inputs:
+        if os.path.isdir(x):
+            files.extend(sorted(str(p) for p in Path(x).iterdir()
+                                if p.suffix.lower() in ('.pcap', '.pcapng', '.cap')))
+        else:
+            files.append(x)
+    if not files:
+        print("Error: no capture files to benchmark")
+        return 1
+
+    tool_paths = merger.check_tools()
+    split_size = int(args.split_size * 1024 * 1024) if args.split_size else None
+    runs = []
+    with tempfile.TemporaryDirectory(prefix='pcap-bench-') as work_dir:
+        for i in range(args.repeat):
+            print(f"Run {i + 1}/{args.repeat}:")
+            try:
+                runs.append(benchmark(tool_paths, files, work_dir,
+                                      args.split_interval, split_size))
+            except RuntimeError as e:
+                print(f"✗ {e}")
+                return 1
+
+    # Keep the fastest wall time per step across repeats
+    dataset, steps = runs[0]
+    for _, other in runs[1:]:
+        for name, x in other.items():
+            if x['wall'] < steps[name]['wall']:
+                steps[name] = x
+
+    result = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'label': args.label,
+        'host': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+        },
+        'repeat': args.repeat,
+        'dataset': dataset,
+        'steps': steps,
+    }
+    print_result(result)
+
+    try:
+        with open(args.results, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+    except OSError as e:
+        print(f"✗ Error writing results: {e}")
+        return 1
+    print(f"\nResults appended to {args.results}")
+    return 0
+
+
+def load_results(path):
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def cmd_compare(args):
+    try:
+        results = load_results(args.results)
+    except (OSError, ValueError) as e:
+        print(f"Error: {args.results}: {e}")
+        return 1
+    if len(results) < 2:
+        print("Need at least two results to compare.")
+        return 1
+
+    current = results[-1]
+    if args.baseline:
+        matches = [x for x in results[:-1] if x.get('label') == args.baseline]
+        if not matches:
+            print(f"No result labelled '{args.baseline}'")
+            return 1
+        baseline = matches[-1]
+    else:
+        baseline = results[-2]
+
+    print(f"Baseline: {baseline.get('label') or '-'} ({baseline['timestamp']})")
+    print(f"Current:  {current.get('label') or '-'} ({current['timestamp']})")
+    if baseline['dataset'] != current['dataset']:
+        print("⚠ Warning: datasets differ; comparison may not be meaningful")
+
+    print(f"\n{'Step':<8}  {'Base s':>8}  {'Curr s':>8}  {'Change':>8}  {'RSS change':>10}")
+    regressions = []
+    for name, cur in current['steps'].items():
+        base = baseline['steps'].get(name)
+        if base is None:
+            print(f"{name:<8}  {'-':>8}  {cur['wall']:>8.3f}  {'new':>8}  {'-':>10}")
+            continue
+        change = (cur['wall'] - base['wall']) / base['wall'] * 100 if base['wall'] else 0.0
+        # only compare RSS figures measured the same way
+        key = _rss_key(cur)
+        rss = '-'
+        if base.get(key) and cur.get(key) is not None:
+            rss = f"{(cur[key] - base[key]) / base[key] * 100:+.1f}%"
+        flag = ''
+        if change > args.threshold:
+            flag = '  ✗ regression'
+            regressions.append(name)
+        print(f"{name:<8}  {base['wall']:>8.3f}  {cur['wall']:>8.3f}  {change:>+7.1f}%  {rss:>10}{flag}")
+
+    if regressions:
+        print(f"\n✗ {len(regressions)} step(s) slower than {args.threshold:.0f}% threshold: "
+              f"{', '.join(regressions)}")
+        return 1
+    print(f"\n✓ No step slower than {args.threshold:.0f}% threshold")
+    return 0
+
+
+def cmd_split_step(args):
+    # run by run_split in a new interpreter; the result is written to stdout
+    spec = json.loads(args.spec)
+    merger = load_merger()
+    try:
+        slices, error = merger.merge_dedup_split(spec['tool_paths'], spec['files'], spec['base'],
+                                                 spec['split_interval'], spec['split_size'])
+    except Exception as e:
+        slices, error = None, f"{type(e).__name__}: {e}"
+
+    rss = None
+    if resource is not None:
+        # mergecap and editcap are forked from this small process, so
+        # their ru_maxrss is their own
+        rss = _maxrss_mb(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        own = _vmhwm_mb()
+        if own is None and sys.platform != 'linux':
+            own = _maxrss_mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+        rss = None if own is None else max(rss, own)
+    print(json.dumps({'slices': len(slices or []), 'error': error,
+                      'max_process_rss_mb': rss}))
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark pcap-merger on synthetic captures')
+    sub = parser.add_subparsers(dest='command', required=True,
+                                metavar='{generate,run,compare}')
+
+    gen = sub.add_parser('generate', help='Write synthetic capture files')
+    gen.add_argument('out_dir', help='Output directory')
+    gen.add_argument('--files', type=int, default=4, help='Number of files (default: 4)')
+    gen.add_argument('--packets', type=int, default=100000,
+                     help='Packets per file before duplicates (default: 100000)')
+    gen.add_argument('--overlap', type=float, default=0.5,
+                     help='Time overlap between consecutive files, 0-1 (default: 0.5)')
+    gen.add_argument('--dup-rate', type=float, default=0.05,
+                     help='Fraction of packets duplicated, 0-1 (default: 0.05)')
+    gen.add_argument('--payload-size', type=int, default=200,
+                     help='UDP payload bytes per packet (default: 200)')
+    gen.add_argument('--flows', type=int, default=64, help='Number of flows (default: 64)')
+    gen.add_argument('--format', choices=['pcap', 'pcapng'], default='pcap',
+                     help='Output format (default: pcap)')
+    gen.add_argument('--seed', type=int, default=1, help='Random seed (default: 1)')
+    gen.set_defaults(func=cmd_generate)
+
+    run = sub.add_parser('run', help='Benchmark merge, dedup and summary')
+    run.add_argument('inputs', nargs='+', help='Capture files or directories')
+    run.add_argument('--label', help='Label stored with the result')
+    run.add_argument('--repeat', type=int, default=1,
+                     help='Repeat and keep the fastest time per step (default: 1)')
+    run.add_argument('--split-interval', type=int, metavar='SECONDS',
+                     help='Also benchmark the streamed split path with this interval')
+    run.add_argument('--split-size', type=float, metavar='MB',
+                     help='Also benchmark the streamed split path with this slice size')
+    run.add_argument('--results', default=DEFAULT_RESULTS,
+                     help=f'JSON Lines results file (default: {DEFAULT_RESULTS})')
+    run.set_defaults(func=cmd_run)
+
+    cmp_ = sub.add_parser('compare', help='Compare the latest result against a baseline')
+    cmp_.add_argument('--results', default=DEFAULT_RESULTS,
+                      help=f'JSON Lines results file (default: {DEFAULT_RESULTS})')
+    cmp_.add_argument('--baseline', metavar='LABEL',
+                      help='Baseline label (default: the previous result)')
+    cmp_.add_argument('--threshold', type=float, default=10.0,
+                      help='Percent slowdown reported as a regression (default: 10)')
+    cmp_.set_defaults(func=cmd_compare)
+
+    # internal: the split step measured by run_split
+    step = sub.add_parser('split-step')
+    step.add_argument('spec', help='JSON split parameters')
+    step.set_defaults(func=cmd_split_step)
+
+    args = parser.parse_args()
+    if args.command == 'generate':
+        if not 0 <= args.overlap <= 1 or not 0 <= args.dup_rate < 1:
+            parser.error('--overlap must be 0-1 and --dup-rate must be 0-<1')
+        if args.files < 1 or args.packets < 1 or args.flows < 1:
+            parser.error('--files, --packets and --flows must be at least 1')
+    if args.command == 'run' and args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        sys.exit(args.func(args))
+    except KeyboardInterrupt:
+        print("\n\nBenchmark interrupted by user.")
+        sys.exit(1)
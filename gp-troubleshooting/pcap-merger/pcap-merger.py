@@ -2,12 +2,24 @@
 """
 PCAP File Merge and Processing Script
 This script merges multiple PCAP files, removes duplicates, and creates a summary text file.
+With --batch it processes many capture sets from a JSON manifest concurrently.
+With --split-interval/--split-size the deduplicated output is written as rotating
+slices plus a JSON manifest instead of one large file.
 Requirements: mergecap, editcap, and tshark (Wireshark tools) must be installed.
 """
 
+import argparse
+import json
 import os
+import re
+import struct
 import subprocess
 import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import Manager
 from pathlib import Path
 
 
@@ -192,7 +204,27 @@ def get_pcap_files():
     return pcap_files
 
 
-def get_output_filename():
+def split_output_files(base_filename):
+    """Return the existing split outputs of base_filename.
+
+    These are the <base>-d-NNNN.pcap|pcapng slices, their .txt summaries
+    and the <base>-d.json manifest.
+    """
+    slice_base = f"{base_filename}-d"
+    directory = os.path.dirname(slice_base)
+    pattern = re.compile(re.escape(os.path.basename(slice_base)) +
+                         r'-\d{4,}\.(pcap|pcapng|txt)$')
+    try:
+        files = [os.path.join(directory, x)
+                 for x in os.listdir(directory or '.') if pattern.match(x)]
+    except OSError:
+        files = []
+    if os.path.exists(f"{slice_base}.json"):
+        files.append(f"{slice_base}.json")
+    return sorted(files)
+
+
+def get_output_filename(split=False):
     """Prompt user for the merged output filename."""
     while True:
         filename = input("\nEnter the name for the merged PCAP file (without extension): ").strip()
@@ -204,8 +236,15 @@ def get_output_filename():
         # Remove extension if user provided one
         filename = os.path.splitext(filename)[0]
         
-        # Check if file already exists
-        if os.path.exists(f"{filename}.pcap"):
+        # Check if the output already exists
+        if split:
+            existing = split_output_files(filename)
+            if existing:
+                overwrite = input(f"{len(existing)} split output files for '{filename}-d' already exist "
+                                  f"(e.g. '{existing[0]}'). Overwrite? (y/n): ").lower()
+                if overwrite != 'y':
+                    continue
+        elif os.path.exists(f"{filename}.pcap"):
             overwrite = input(f"File '{filename}.pcap' already exists. Overwrite? (y/n): ").lower()
             if overwrite != 'y':
                 continue
@@ -213,92 +252,723 @@ def get_output_filename():
         return filename
 
 
-def run_command(cmd, description):
-    """Run a shell command and handle errors."""
-    print(f"\n{description}...")
-    print(f"Running: {' '.join(cmd)}")
+def run_command(cmd, description, verbose=True, stdout_path=None):
+    """Run a shell command and handle errors.
+
+    Returns a (success, error) tuple.  When stdout_path is set the command
+    output is written to that file instead of being captured.
+    """
+    if verbose:
+        print(f"\n{description}...")
+        if stdout_path:
+            print(f"Running: {' '.join(cmd)} > {stdout_path}")
+        else:
+            print(f"Running: {' '.join(cmd)}")
     
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        if result.stdout:
-            print(result.stdout)
-        print(f"✓ {description} completed successfully.")
-        return True
+        if stdout_path:
+            with open(stdout_path, 'w') as f:
+                subprocess.run(cmd, stdout=f, stderr=subprocess.PIPE, text=True, check=True)
+        else:
+            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+            if verbose and result.stdout:
+                print(result.stdout)
+        if verbose:
+            print(f"✓ {description} completed successfully.")
+        return True, None
     except subprocess.CalledProcessError as e:
+        error = (e.stderr or '').strip() or f"exit status {e.returncode}"
+    except OSError as e:
+        error = str(e)
+    
+    if verbose:
         print(f"✗ Error during {description.lower()}:")
-        print(f"  {e.stderr}")
-        return False
+        print(f"  {error}")
+    return False, error
 
 
-def main():
-    """Main function to orchestrate the PCAP processing workflow."""
-    print("=" * 60)
-    print("PCAP File Merge and Processing Tool")
-    print("=" * 60)
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1e-6),  # little-endian, microseconds
+    b'\xa1\xb2\xc3\xd4': ('>', 1e-6),  # big-endian, microseconds
+    b'\x4d\x3c\xb2\xa1': ('<', 1e-9),  # little-endian, nanoseconds
+    b'\xa1\xb2\x3c\x4d': ('>', 1e-9),  # big-endian, nanoseconds
+}
+
+# pcapng block types
+PCAPNG_SHB = b'\x0a\x0d\x0d\x0a'  # section header, same in both byte orders
+PCAPNG_BYTE_ORDER = {
+    b'\x4d\x3c\x2b\x1a': '<',
+    b'\x1a\x2b\x3c\x4d': '>',
+}
+PCAPNG_IDB = 1  # interface description
+PCAPNG_PB = 2   # packet (obsolete)
+PCAPNG_SPB = 3  # simple packet, no timestamp
+PCAPNG_ISB = 5  # interface statistics
+PCAPNG_EPB = 6  # enhanced packet
+
+
+def _read_exact(stream, size):
+    """Read exactly size bytes, or return fewer at end of stream."""
+    data = stream.read(size)
+    while data and len(data) < size:
+        more = stream.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+
+def _format_time(ts):
+    if ts is None:
+        return None
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+def _pcap_records(stream, header):
+    """Yield (kind, data, timestamp) records of a pcap stream.
+
+    kind is 'section' for the file header and 'packet' for each packet
+    record.
+    """
+    header += _read_exact(stream, 20)
+    if len(header) < 24:
+        raise ValueError('truncated pcap header')
+    endian, resolution = PCAP_MAGIC[header[:4]]
+    record_header = struct.Struct(endian + 'IIII')
+    yield 'section', header, None
     
-    # Check if required tools are installed and get their paths
-    tool_paths = check_tools()
+    while True:
+        rec = _read_exact(stream, 16)
+        if len(rec) < 16:
+            break
+        ts_sec, ts_frac, incl_len, _ = record_header.unpack(rec)
+        data = _read_exact(stream, incl_len)
+        if len(data) < incl_len:
+            raise ValueError('truncated packet record')
+        yield 'packet', rec + data, ts_sec + ts_frac * resolution
+
+
+def _pcapng_interface(endian, block):
+    """Return (resolution, offset) of an interface description block."""
+    resolution, offset = 1e-6, 0
+    pos, end = 16, len(block) - 4
+    while pos + 4 <= end:
+        code, length = struct.unpack_from(endian + 'HH', block, pos)
+        value = block[pos + 4:pos + 4 + length]
+        if code == 0:
+            break
+        if code == 9 and length >= 1:  # if_tsresol
+            x = value[0]
+            resolution = 2.0 ** -(x & 0x7f) if x & 0x80 else 10.0 ** -x
+        elif code == 14 and length >= 8:  # if_tsoffset
+            offset, = struct.unpack(endian + 'q', value[:8])
+        pos += 4 + (length + 3) // 4 * 4
+    return resolution, offset
+
+
+def _pcapng_records(stream, block_type):
+    """Yield (kind, data, timestamp) records of a pcapng stream.
+
+    Blocks are passed through unchanged.  kind is 'section' for a section
+    header, 'meta' for blocks every later slice needs (interfaces, name
+    resolution, decryption secrets), 'stats' for interface statistics and
+    'packet' for packet blocks.  A simple packet block has no timestamp and
+    uses the previous packet's.
+    """
+    endian = None
+    interfaces = []
+    last_ts = None
     
-    # Get input files
-    pcap_files = get_pcap_files()
-    print(f"\nSelected {len(pcap_files)} files for merging.")
+    while True:
+        if block_type is None:
+            block_type = _read_exact(stream, 4)
+            if not block_type:
+                break
+        if block_type == PCAPNG_SHB:
+            head = _read_exact(stream, 8)
+            if len(head) < 8 or head[4:8] not in PCAPNG_BYTE_ORDER:
+                raise ValueError('invalid pcapng section header')
+            endian = PCAPNG_BYTE_ORDER[head[4:8]]
+            interfaces = []
+        elif endian is None:
+            raise ValueError('input is not a pcap or pcapng stream')
+        else:
+            head = _read_exact(stream, 4)
+            if len(head) < 4:
+                raise ValueError('truncated pcapng block')
+        
+        length, = struct.unpack(endian + 'I', head[:4])
+        if length < 12 or length % 4 or length < 4 + len(head) + 4:
+            raise ValueError(f'invalid pcapng block length {length}')
+        rest = _read_exact(stream, length - 4 - len(head))
+        if len(rest) < length - 4 - len(head):
+            raise ValueError('truncated pcapng block')
+        block = block_type + head + rest
+        kind, = struct.unpack(endian + 'I', block_type)
+        block_type = None
+        
+        if block[:4] == PCAPNG_SHB:
+            yield 'section', block, None
+        elif kind == PCAPNG_IDB:
+            interfaces.append(_pcapng_interface(endian, block))
+            yield 'meta', block, None
+        elif kind in (PCAPNG_EPB, PCAPNG_PB):
+            if kind == PCAPNG_EPB:
+                interface, ts_high, ts_low = struct.unpack_from(endian + 'III', block, 8)
+            else:
+                interface, _, ts_high, ts_low = struct.unpack_from(endian + 'HHII', block, 8)
+            if interface >= len(interfaces):
+                raise ValueError(f'packet for undefined interface {interface}')
+            resolution, offset = interfaces[interface]
+            last_ts = ((ts_high << 32) | ts_low) * resolution + offset
+            yield 'packet', block, last_ts
+        elif kind == PCAPNG_SPB:
+            yield 'packet', block, last_ts
+        elif kind == PCAPNG_ISB:
+            yield 'stats', block, None
+        else:
+            yield 'meta', block, None
+
+
+def split_pcap_stream(stream, base_filename, interval=None, max_bytes=None):
+    """Write a pcap or pcapng stream as rotating slice files.
+
+    A new slice starts when a packet falls outside the current interval
+    window (windows are aligned to multiples of interval seconds) or when
+    the slice would exceed max_bytes.  Slices keep the input format; each
+    pcapng slice starts with the section header and every interface and
+    other metadata block seen so far, so interfaces, link types and comments
+    are preserved.  Returns a list of dicts describing each slice: file
+    name, packet count, size and time range.
+    """
+    magic = _read_exact(stream, 4)
+    if magic in PCAP_MAGIC:
+        records = _pcap_records(stream, magic)
+        extension = 'pcap'
+    elif magic == PCAPNG_SHB:
+        records = _pcapng_records(stream, magic)
+        extension = 'pcapng'
+    else:
+        raise ValueError('input is not a pcap or pcapng stream')
     
-    # Get output filename
-    base_filename = get_output_filename()
+    slices = []
+    out = None
+    current = None
+    window_end = None
+    preamble = []
+    
+    def close_slice():
+        if out is not None:
+            out.close()
+            slices.append(current)
+    
+    try:
+        for kind, data, ts in records:
+            if kind != 'packet':
+                if kind == 'section':
+                    preamble = [data]
+                elif kind == 'meta':
+                    preamble.append(data)
+                if out is not None:
+                    out.write(data)
+                    current['bytes'] += len(data)
+                continue
+            
+            size = len(data)
+            rotate = out is None
+            if (not rotate and window_end is not None and ts is not None and
+                    ts >= window_end):
+                rotate = True
+            if (not rotate and max_bytes is not None and
+                    current['bytes'] + size > max_bytes):
+                rotate = True
+            
+            if rotate:
+                close_slice()
+                file_name = f"{base_filename}-{len(slices) + 1:04d}.{extension}"
+                out = open(file_name, 'wb')
+                header = b''.join(preamble)
+                out.write(header)
+                current = {
+                    'file': file_name,
+                    'packets': 0,
+                    'bytes': len(header),
+                    'start': None,
+                    'end': None,
+                }
+                window_end = None
+            
+            if interval is not None and window_end is None and ts is not None:
+                window_end = (int(ts) // interval + 1) * interval
+            
+            out.write(data)
+            current['packets'] += 1
+            current['bytes'] += size
+            if ts is not None:
+                if current['start'] is None or ts < current['start']:
+                    current['start'] = ts
+                if current['end'] is None or ts > current['end']:
+                    current['end'] = ts
+        
+        close_slice()
+        out = None
+    finally:
+        if out is not None:
+            out.close()
+    
+    for x in slices:
+        x['start_time'] = _format_time(x['start'])
+        x['end_time'] = _format_time(x['end'])
+    
+    return slices
+
+
+def merge_dedup_split(tool_paths, pcap_files, base_filename, interval=None, max_bytes=None):
+    """Merge and deduplicate into rotating slices without a monolithic file.
+
+    mergecap and editcap write pcapng to their stdout and the stream is
+    split as it is read.  Returns (slices, error).
+    """
+    merge_cmd = [tool_paths['mergecap'], '-w', '-'] + list(pcap_files)
+    dedup_cmd = [tool_paths['editcap'], '-d', '-', '-']
+    
+    with tempfile.TemporaryFile(mode='w+') as merge_err, \
+            tempfile.TemporaryFile(mode='w+') as dedup_err:
+        try:
+            merge = subprocess.Popen(merge_cmd, stdout=subprocess.PIPE, stderr=merge_err)
+        except OSError as e:
+            return None, str(e)
+        try:
+            dedup = subprocess.Popen(dedup_cmd, stdin=merge.stdout,
+                                     stdout=subprocess.PIPE, stderr=dedup_err)
+        except OSError as e:
+            merge.kill()
+            merge.wait()
+            return None, str(e)
+        merge.stdout.close()  # editcap owns the pipe now
+        
+        slices, error = None, None
+        try:
+            slices = split_pcap_stream(dedup.stdout, base_filename, interval, max_bytes)
+        except (ValueError, OSError) as e:
+            error = str(e)
+            dedup.kill()
+            merge.kill()
+        finally:
+            dedup.stdout.close()
+            dedup.wait()
+            merge.wait()
+        
+        for proc, err in ((merge, merge_err), (dedup, dedup_err)):
+            if proc.returncode != 0 and not (error and proc.returncode < 0):
+                err.seek(0)
+                message = err.read().strip() or f"exit status {proc.returncode}"
+                return None, f"{os.path.basename(proc.args[0])}: {message}"
+    
+    return slices, error
+
+
+def write_slice_manifest(path, slices, interval=None, max_bytes=None):
+    """Write the JSON manifest describing the slices of a split capture."""
+    manifest = {
+        'split_interval': interval,
+        'split_size': max_bytes,
+        'total_packets': sum(x['packets'] for x in slices),
+        'slices': [{
+            'file': os.path.basename(x['file']),
+            'packets': x['packets'],
+            'bytes': x['bytes'],
+            'start_time': x['start_time'],
+            'end_time': x['end_time'],
+            'start_epoch': x['start'],
+            'end_epoch': x['end'],
+        } for x in slices],
+    }
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+class StepError(Exception):
+    """A processing step failed."""
+    
+    def __init__(self, step, message):
+        super().__init__(f"{step}: {message}")
+        self.step = step
+
+
+def process_capture_set(tool_paths, pcap_files, base_filename, verbose=True,
+                        progress=None, disk_slots=None, split_interval=None,
+                        split_size=None):
+    """Merge, deduplicate and summarise one capture set.
+
+    Returns a result dict with the output files, sizes, packet count and the
+    wall time of each step.  Raises StepError when a step fails.
+
+    progress is called as progress(step, state) when a step starts and ends.
+    disk_slots, if given, is a semaphore bounding how many disk-heavy steps
+    (merge and dedup) run at the same time across processes.
+
+    With split_interval (seconds) and/or split_size (bytes) the merged and
+    deduplicated stream is written as rotating slices with a JSON manifest;
+    see split_capture_set().
+    """
+    if split_interval or split_size:
+        return split_capture_set(tool_paths, pcap_files, base_filename, verbose,
+                                 progress, disk_slots, split_interval, split_size)
     
-    # Define output filenames
     merged_file = f"{base_filename}.pcap"
     dedup_file = f"{base_filename}-d.pcap"
     summary_file = f"{base_filename}-d.txt"
     
-    print("\n" + "=" * 60)
-    print("Processing Steps:")
-    print(f"1. Merge files → {merged_file}")
-    print(f"2. Remove duplicates → {dedup_file}")
-    print(f"3. Create summary → {summary_file}")
-    print("=" * 60)
+    result = {
+        'merged_file': merged_file,
+        'dedup_file': dedup_file,
+        'summary_file': summary_file,
+        'timings': {},
+    }
+    
+    def step(name, cmd, description, stdout_path=None, disk_bound=False):
+        if progress:
+            progress(name, 'started')
+        if disk_bound and disk_slots is not None:
+            disk_slots.acquire()
+        start = time.perf_counter()
+        try:
+            ok, error = run_command(cmd, description, verbose, stdout_path)
+        finally:
+            result['timings'][name] = time.perf_counter() - start
+            if disk_bound and disk_slots is not None:
+                disk_slots.release()
+        if progress:
+            progress(name, 'done' if ok else 'failed')
+        if not ok:
+            raise StepError(name, error)
     
     # Step 1: Merge PCAP files
-    merge_cmd = [tool_paths['mergecap'], '-w', merged_file] + pcap_files
-    if not run_command(merge_cmd, "Step 1: Merging PCAP files"):
-        print("\nProcess aborted due to merge error.")
-        return
+    merge_cmd = [tool_paths['mergecap'], '-w', merged_file] + list(pcap_files)
+    step('merge', merge_cmd, "Step 1: Merging PCAP files", disk_bound=True)
     
     # Get file size for merged file
     merged_size = os.path.getsize(merged_file) / (1024 * 1024)  # Convert to MB
-    print(f"  Merged file size: {merged_size:.2f} MB")
+    result['merged_mb'] = merged_size
+    if verbose:
+        print(f"  Merged file size: {merged_size:.2f} MB")
     
     # Step 2: Remove duplicates with editcap
     dedup_cmd = [tool_paths['editcap'], '-d', merged_file, dedup_file]
-    if not run_command(dedup_cmd, "Step 2: Removing duplicates"):
-        print("\nProcess aborted due to deduplication error.")
-        return
+    step('dedup', dedup_cmd, "Step 2: Removing duplicates", disk_bound=True)
     
     # Get file size for deduplicated file
     dedup_size = os.path.getsize(dedup_file) / (1024 * 1024)  # Convert to MB
-    print(f"  Deduplicated file size: {dedup_size:.2f} MB")
-    print(f"  Size reduction: {merged_size - dedup_size:.2f} MB ({((merged_size - dedup_size) / merged_size * 100):.1f}%)")
+    result['dedup_mb'] = dedup_size
+    if verbose:
+        print(f"  Deduplicated file size: {dedup_size:.2f} MB")
+        reduction = (merged_size - dedup_size) / merged_size * 100 if merged_size else 0.0
+        print(f"  Size reduction: {merged_size - dedup_size:.2f} MB ({reduction:.1f}%)")
     
     # Step 3: Create summary with tshark
     summary_cmd = [tool_paths['tshark'], '-r', dedup_file]
-    print(f"\nStep 3: Creating summary file...")
-    print(f"Running: {' '.join(summary_cmd)} > {summary_file}")
+    step('summary', summary_cmd, "Step 3: Creating summary file", stdout_path=summary_file)
+    
+    # Get line count for summary file
+    with open(summary_file, 'r') as f:
+        line_count = sum(1 for _ in f)
+    result['packets'] = line_count
+    if verbose:
+        print(f"  Summary contains {line_count} packets")
+    
+    return result
+
+
+def split_capture_set(tool_paths, pcap_files, base_filename, verbose=True,
+                      progress=None, disk_slots=None, split_interval=None,
+                      split_size=None):
+    """Merge and deduplicate one capture set into slices, then summarise each.
+
+    Slices are pcapng files named <base>-d-NNNN.pcapng with a <base>-d.json
+    manifest and a <base>-d-NNNN.txt summary per slice.
+    """
+    slice_base = f"{base_filename}-d"
+    manifest_file = f"{slice_base}.json"
+    result = {
+        'merged_file': None,
+        'dedup_file': None,
+        'summary_file': None,
+        'slice_manifest': manifest_file,
+        'merged_mb': None,
+        'timings': {},
+    }
     
+    # Remove the outputs of an earlier run, so no stale higher-numbered
+    # slices are left beside the new set
+    for x in split_output_files(base_filename):
+        os.remove(x)
+    
+    # Step 1: Merge, deduplicate and split in one pipeline
+    if verbose:
+        print("\nStep 1: Merging, deduplicating and splitting PCAP files...")
+    if progress:
+        progress('split', 'started')
+    if disk_slots is not None:
+        disk_slots.acquire()
+    start = time.perf_counter()
     try:
-        with open(summary_file, 'w') as f:
-            result = subprocess.run(summary_cmd, stdout=f, stderr=subprocess.PIPE, text=True)
-            if result.returncode != 0:
-                print(f"✗ Error creating summary:")
-                print(f"  {result.stderr}")
-                return
-        print(f"✓ Step 3: Creating summary file completed successfully.")
+        slices, error = merge_dedup_split(tool_paths, pcap_files, slice_base,
+                                          split_interval, split_size)
+    finally:
+        result['timings']['split'] = time.perf_counter() - start
+        if disk_slots is not None:
+            disk_slots.release()
+    if progress:
+        progress('split', 'failed' if error else 'done')
+    if error:
+        if verbose:
+            print(f"✗ Error during merging, deduplicating and splitting:")
+            print(f"  {error}")
+        raise StepError('split', error)
+    
+    write_slice_manifest(manifest_file, slices, split_interval, split_size)
+    result['slices'] = len(slices)
+    result['packets'] = sum(x['packets'] for x in slices)
+    result['dedup_mb'] = sum(x['bytes'] for x in slices) / (1024 * 1024)
+    if verbose:
+        print(f"✓ Wrote {len(slices)} slices ({result['dedup_mb']:.2f} MB), "
+              f"manifest: {manifest_file}")
+        for x in slices:
+            print(f"  {x['file']}: {x['packets']} packets, "
+                  f"{x['start_time']} → {x['end_time']}")
+    
+    # Step 2: Create a summary per slice with tshark
+    if progress:
+        progress('summary', 'started')
+    start = time.perf_counter()
+    error = None
+    for x in slices:
+        summary_file = os.path.splitext(x['file'])[0] + '.txt'
+        ok, error = run_command([tool_paths['tshark'], '-r', x['file']],
+                                f"Step 2: Creating summary for {x['file']}",
+                                verbose=False, stdout_path=summary_file)
+        if not ok:
+            break
+    result['timings']['summary'] = time.perf_counter() - start
+    if progress:
+        progress('summary', 'failed' if error else 'done')
+    if error:
+        if verbose:
+            print(f"✗ Error creating summary:")
+            print(f"  {error}")
+        raise StepError('summary', error)
+    if verbose:
+        print(f"✓ Step 2: Created {len(slices)} slice summaries.")
+    
+    return result
+
+
+def load_manifest(path):
+    """Load a batch manifest of capture sets.
+
+    The manifest is a JSON object of the form:
+      {"capture_sets": [{"name": "user1", "files": ["a.pcap", "b.pcapng"],
+                         "output": "out/user1"}, ...]}
+    "output" is optional and defaults to the name.  Relative paths are
+    resolved against the manifest directory.
+    """
+    base_dir = Path(path).resolve().parent
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    
+    entries = manifest.get('capture_sets') if isinstance(manifest, dict) else None
+    if not isinstance(entries, list) or not entries:
+        raise ValueError('manifest must contain a non-empty "capture_sets" list')
+    
+    capture_sets = []
+    names = set()
+    for i, entry in enumerate(entries, 1):
+        name = entry.get('name') if isinstance(entry, dict) else None
+        if not name:
+            raise ValueError(f'capture set {i}: missing "name"')
+        if name in names:
+            raise ValueError(f'capture set {i}: duplicate name "{name}"')
+        names.add(name)
         
-        # Get line count for summary file
-        with open(summary_file, 'r') as f:
-            line_count = sum(1 for _ in f)
-        print(f"  Summary contains {line_count} packets")
+        files = entry.get('files')
+        if not isinstance(files, list) or not files:
+            raise ValueError(f'capture set "{name}": "files" must be a non-empty list')
+        files = [str(base_dir / os.path.expanduser(x)) for x in files]
+        for x in files:
+            if not os.path.isfile(x):
+                raise ValueError(f'capture set "{name}": file not found: {x}')
         
+        output = os.path.splitext(entry.get('output') or name)[0]
+        capture_sets.append({
+            'name': name,
+            'files': files,
+            'output': str(base_dir / os.path.expanduser(output)),
+        })
+    
+    return capture_sets
+
+
+def _batch_worker(tool_paths, capture_set, events, disk_slots, split):
+    """Process one manifest entry in a worker process."""
+    name = capture_set['name']
+    
+    def progress(step, state):
+        events.put((name, step, state))
+    
+    start = time.perf_counter()
+    try:
+        output_dir = os.path.dirname(capture_set['output'])
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        result = process_capture_set(tool_paths, capture_set['files'],
+                                     capture_set['output'], verbose=False,
+                                     progress=progress, disk_slots=disk_slots,
+                                     **split)
+        result['error'] = None
+    except (StepError, OSError) as e:
+        result = {'error': str(e)}
     except Exception as e:
+        # e.g. a malformed capture; fail this set, not the batch
+        result = {'error': f"{type(e).__name__}: {e}"}
+    result['name'] = name
+    result['files'] = len(capture_set['files'])
+    result['elapsed'] = time.perf_counter() - start
+    
+    return result
+
+
+def print_batch_report(results):
+    """Print a consolidated table for a batch run."""
+    width = max([len(r['name']) for r in results] + [len('Capture set')])
+    print("\n" + "=" * 60)
+    print("Batch Report:")
+    print("=" * 60)
+    print(f"{'Capture set':<{width}}  {'Status':<6}  {'Files':>5}  {'Packets':>9}  "
+          f"{'Merged MB':>9}  {'Dedup MB':>9}  {'Time s':>7}")
+    def mb(x):
+        return '-' if x is None else f"{x:.2f}"
+    
+    for r in results:
+        if r['error']:
+            print(f"{r['name']:<{width}}  {'FAILED':<6}  {r['files']:>5}  {'-':>9}  "
+                  f"{'-':>9}  {'-':>9}  {r['elapsed']:>7.1f}")
+        else:
+            print(f"{r['name']:<{width}}  {'OK':<6}  {r['files']:>5}  {r['packets']:>9}  "
+                  f"{mb(r['merged_mb']):>9}  {mb(r['dedup_mb']):>9}  {r['elapsed']:>7.1f}")
+    
+    failed = [r for r in results if r['error']]
+    for r in failed:
+        print(f"\n✗ {r['name']}: {r['error']}")
+    print("=" * 60)
+    print(f"{len(results) - len(failed)} of {len(results)} capture sets processed successfully.")
+
+
+def run_batch(manifest_path, jobs, disk_jobs, report_path=None, split=None):
+    """Process all capture sets of a manifest in a process pool."""
+    split = split or {}
+    try:
+        capture_sets = load_manifest(manifest_path)
+    except (OSError, ValueError) as e:
+        print(f"Error: {manifest_path}: {e}")
+        return 1
+    
+    tool_paths = check_tools()
+    total = len(capture_sets)
+    jobs = max(1, min(jobs, total))
+    print(f"Processing {total} capture sets with {jobs} workers "
+          f"({disk_jobs} concurrent merge/dedup steps)...\n")
+    
+    results = {}
+    batch_start = time.perf_counter()
+    with Manager() as manager:
+        events = manager.Queue()
+        disk_slots = manager.BoundedSemaphore(disk_jobs)
+        
+        def drain_events():
+            while not events.empty():
+                name, step, state = events.get()
+                print(f"  [{name}] {step} {state}")
+        
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            pending = {pool.submit(_batch_worker, tool_paths, x, events, disk_slots, split): x
+                       for x in capture_sets}
+            capture_set = dict(pending)
+            while pending:
+                done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                drain_events()
+                for future in done:
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        # the worker died or its result could not be pickled
+                        x = capture_set[future]
+                        result = {
+                            'name': x['name'],
+                            'files': len(x['files']),
+                            'elapsed': 0.0,
+                            'error': f"{type(e).__name__}: {e}",
+                        }
+                    results[result['name']] = result
+                    status = '✗' if result['error'] else '✓'
+                    print(f"[{len(results)}/{total}] {status} {result['name']} "
+                          f"({result['elapsed']:.1f}s)")
+            drain_events()
+    
+    # Report in manifest order
+    ordered = [results[x['name']] for x in capture_sets]
+    print_batch_report(ordered)
+    print(f"Total elapsed: {time.perf_counter() - batch_start:.1f}s")
+    
+    if report_path:
+        try:
+            with open(report_path, 'w') as f:
+                json.dump({'capture_sets': ordered}, f, indent=2)
+            print(f"Report written to {report_path}")
+        except OSError as e:
+            print(f"✗ Error writing report: {e}")
+            return 1
+    
+    return 1 if any(r['error'] for r in ordered) else 0
+
+
+def main(split=None):
+    """Main function to orchestrate the PCAP processing workflow."""
+    split = split or {}
+    print("=" * 60)
+    print("PCAP File Merge and Processing Tool")
+    print("=" * 60)
+    
+    # Check if required tools are installed and get their paths
+    tool_paths = check_tools()
+    
+    # Get input files
+    pcap_files = get_pcap_files()
+    print(f"\nSelected {len(pcap_files)} files for merging.")
+    
+    # Get output filename
+    base_filename = get_output_filename(bool(split))
+    
+    print("\n" + "=" * 60)
+    print("Processing Steps:")
+    if split:
+        print(f"1. Merge, remove duplicates and split → {base_filename}-d-NNNN.pcapng")
+        print(f"   Slice manifest → {base_filename}-d.json")
+        print(f"2. Create summaries → {base_filename}-d-NNNN.txt")
+    else:
+        print(f"1. Merge files → {base_filename}.pcap")
+        print(f"2. Remove duplicates → {base_filename}-d.pcap")
+        print(f"3. Create summary → {base_filename}-d.txt")
+    print("=" * 60)
+    
+    try:
+        result = process_capture_set(tool_paths, pcap_files, base_filename, **split)
+    except StepError as e:
+        if e.step != 'summary':
+            step = 'deduplication' if e.step == 'dedup' else e.step
+            print(f"\nProcess aborted due to {step} error.")
+        return
+    except OSError as e:
         print(f"✗ Error writing summary file: {e}")
         return
     
@@ -306,18 +976,65 @@ def main():
     print("\n" + "=" * 60)
     print("✓ Process completed successfully!")
     print(f"\nOutput files created:")
-    print(f"  1. Merged PCAP: {merged_file} ({merged_size:.2f} MB)")
-    print(f"  2. Deduplicated PCAP: {dedup_file} ({dedup_size:.2f} MB)")
-    print(f"  3. Summary text: {summary_file} ({line_count} packets)")
+    if split:
+        print(f"  1. {result['slices']} deduplicated PCAP slices ({result['dedup_mb']:.2f} MB)")
+        print(f"  2. Slice manifest: {result['slice_manifest']} ({result['packets']} packets)")
+        print("=" * 60)
+        return
+    print(f"  1. Merged PCAP: {result['merged_file']} ({result['merged_mb']:.2f} MB)")
+    print(f"  2. Deduplicated PCAP: {result['dedup_file']} ({result['dedup_mb']:.2f} MB)")
+    print(f"  3. Summary text: {result['summary_file']} ({result['packets']} packets)")
     print("=" * 60)
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Merge, deduplicate and summarise PCAP files '
+                    '(interactive when no options are given)',
+        epilog='Split slices are pcapng and each repeats the interface and '
+               'other metadata blocks, so mixed link types and packet comments '
+               'are kept.  Simple packet blocks have no timestamp and stay in '
+               "the previous packet's time slice.")
+    parser.add_argument('--batch', metavar='MANIFEST',
+                        help='Process the capture sets listed in a JSON manifest')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='Maximum capture sets processed concurrently (default: CPU count)')
+    parser.add_argument('--disk-jobs', type=int, default=2,
+                        help='Maximum concurrent merge/dedup steps (default: 2)')
+    parser.add_argument('--report', metavar='PATH',
+                        help='Write the batch report as JSON to PATH')
+    parser.add_argument('--split-interval', type=int, metavar='SECONDS',
+                        help='Split the deduplicated output into slices of SECONDS each')
+    parser.add_argument('--split-size', type=float, metavar='MB',
+                        help='Split the deduplicated output into slices of at most MB each')
+    
+    args = parser.parse_args()
+    if args.jobs < 1 or args.disk_jobs < 1:
+        parser.error('--jobs and --disk-jobs must be at least 1')
+    if args.split_interval is not None and args.split_interval < 1:
+        parser.error('--split-interval must be at least 1')
+    if args.split_size is not None and args.split_size <= 0:
+        parser.error('--split-size must be greater than 0')
+    
+    args.split = {}
+    if args.split_interval or args.split_size:
+        args.split = {
+            'split_interval': args.split_interval,
+            'split_size': int(args.split_size * 1024 * 1024) if args.split_size else None,
+        }
+    
+    return args
+
+
 if __name__ == "__main__":
+    args = parse_args()
     try:
-        main()
+        if args.batch:
+            sys.exit(run_batch(args.batch, args.jobs, args.disk_jobs, args.report, args.split))
+        main(args.split)
     except KeyboardInterrupt:
         print("\n\nProcess interrupted by user.")
         sys.exit(0)
     except Exception as e:
         print(f"\nUnexpected error: {e}")
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
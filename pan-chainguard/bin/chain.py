@@ -19,17 +19,18 @@
 import argparse
 import asyncio
 from collections import defaultdict
-import csv
 import json
 import os
 import sys
-from treelib import Node, Tree
 
 libpath = os.path.dirname(os.path.abspath(__file__))
 sys.path[:0] = [os.path.join(libpath, os.pardir)]
 
 from pan_chainguard import title, __version__
 from pan_chainguard.ccadb import *
+from pan_chainguard.ccadb import (CcadbCertificateRecords, CcadbError,
+                                  CcadbRecord)
+from pan_chainguard.forest import Forest, ROOT
 from pan_chainguard.mozilla import MozillaOneCrl, MozillaError
 import pan_chainguard.util
 
@@ -58,14 +59,14 @@ async def main_loop():
 
     tree = get_tree(certs, invalid)
     if args.debug > 2:
-        x = tree.show(stdout=False)
+        x = tree.show()
         print(x, file=sys.stderr, end='')
 
     total_invalid, newtree, intermediates = get_intermediates(
         tree, invalid, warning)
 
     if args.debug:
-        x = newtree.show(stdout=False)
+        x = newtree.show()
         print(x, file=sys.stderr, end='')
 
     write_fingerprints(intermediates)
@@ -81,104 +82,98 @@ def get_certs(onecrl):
     duplicates = defaultdict(list)
 
     try:
-        with open(args.ccadb, 'r', newline='') as csvfile:
-            reader = csv.DictReader(csvfile,
-                                    dialect='unix')
-            for row in reader:
-                sha256 = row['SHA-256 Fingerprint']
-                name = row['Certificate Name']
-                cert_type = row['Certificate Record Type']
-                parent_sha256 = row['Parent SHA-256 Fingerprint']
-
-                ret, err = revoked(row)
-                if ret:
-                    x = '%s %s %s' % (err, sha256, name)
-                    if args.debug > 2:
-                        print(x, file=sys.stderr)
-                    invalid[sha256] = x
-                    continue
+        records = CcadbCertificateRecords(path=args.ccadb,
+                                          cache_dir=args.cache,
+                                          debug=args.debug > 1)
+    except CcadbError as e:
+        print('%s: %s' % (args.ccadb, e), file=sys.stderr)
+        sys.exit(1)
+
+    bits = records.bits()
+    server_authentication = TrustBits.SERVER_AUTHENTICATION.value
 
-                ret, err = valid_from_to(row)
-                if not ret:
-                    x = '%s %s %s' % (err, sha256, name)
-                    if args.debug > 2:
+    for i, row in enumerate(records):
+        sha256 = row['SHA-256 Fingerprint']
+        name = row['Certificate Name']
+        cert_type = row['Certificate Record Type']
+        parent_sha256 = row['Parent SHA-256 Fingerprint']
+
+        if bits.validity[i]:
+            err = validity_message(row, ValidityBits(bits.validity[i]))
+            x = '%s %s %s' % (err, sha256, name)
+            if args.debug > 2:
+                print(x, file=sys.stderr)
+            invalid[sha256] = x
+            continue
+
+        # For duplicate certificate fingerprints in CCADB,
+        # retain a root certificate, or intermediate when no
+        # root.
+        if sha256 in certs:
+            if sha256 not in duplicates:
+                duplicates[sha256].append(certs[sha256])
+            duplicates[sha256].append(row)
+
+            if (certs[sha256]['Certificate Record Type'] ==
+               'Root Certificate'):
+                if args.debug > 1:
+                    print('Retain duplicate %s %s' % (
+                          certs[sha256]['Certificate Record Type'],
+                          sha256), file=sys.stderr)
+                continue
+            elif cert_type == 'Root Certificate':
+                if args.debug > 1:
+                    print('Replace duplicate %s'
+                          ' with %s %s' % (
+                              certs[sha256]['Certificate Record Type'],
+                              cert_type, sha256), file=sys.stderr)
+            else:
+                if args.debug > 1:
+                    print('Skip duplicate %s, retain %s %s' % (
+                        cert_type,
+                        certs[sha256]['Certificate Record Type'],
+                        sha256), file=sys.stderr)
+                continue
+
+        if cert_type == 'Root Certificate':
+            if parent_sha256:
+                x = 'Root with parent: %s' % sha256
+                if args.debug > 1:
+                    print(x, file=sys.stderr)
+                invalid[sha256] = x
+                continue
+
+        if cert_type == 'Intermediate Certificate':
+            if onecrl:
+                r = onecrl.get(sha256=sha256)
+                if r is not None:
+                    x = 'In OneCRL %s "%s" "%s"' % (
+                        sha256, name, r['Revocation Status'])
+                    if r['Comments']:
+                        x += ' "%s"' % (
+                            r['Comments'].replace('\r\n', ' '))
+                    if args.debug > 1:
                         print(x, file=sys.stderr)
                     invalid[sha256] = x
                     continue
 
-                # For duplicate certificate fingerprints in CCADB,
-                # retain a root certificate, or intermediate when no
-                # root.
-                if sha256 in certs:
-                    if sha256 not in duplicates:
-                        duplicates[sha256].append(certs[sha256])
-                    duplicates[sha256].append(row)
-
-                    if (certs[sha256]['Certificate Record Type'] ==
-                       'Root Certificate'):
-                        if args.debug > 1:
-                            print('Retain duplicate %s %s' % (
-                                  certs[sha256]['Certificate Record Type'],
-                                  sha256), file=sys.stderr)
-                        continue
-                    elif cert_type == 'Root Certificate':
-                        if args.debug > 1:
-                            print('Replace duplicate %s'
-                                  ' with %s %s' % (
-                                      certs[sha256]['Certificate Record Type'],
-                                      cert_type, sha256), file=sys.stderr)
-                    else:
-                        if args.debug > 1:
-                            print('Skip duplicate %s, retain %s %s' % (
-                                cert_type,
-                                certs[sha256]['Certificate Record Type'],
-                                sha256), file=sys.stderr)
-                        continue
-
-                if cert_type == 'Root Certificate':
-                    if parent_sha256:
-                        x = 'Root with parent: %s' % sha256
-                        if args.debug > 1:
-                            print(x, file=sys.stderr)
-                        invalid[sha256] = x
-                        continue
-
-                if cert_type == 'Intermediate Certificate':
-                    if onecrl:
-                        r = onecrl.get(sha256=sha256)
-                        if r is not None:
-                            x = 'In OneCRL %s "%s" "%s"' % (
-                                sha256, name, r['Revocation Status'])
-                            if r['Comments']:
-                                x += ' "%s"' % (
-                                    r['Comments'].replace('\r\n', ' '))
-                            if args.debug > 1:
-                                print(x, file=sys.stderr)
-                            invalid[sha256] = x
-                            continue
-
-                    if not parent_sha256:
-                        x = 'Intermediate with no parent: %s' % sha256
-                        if args.debug > 1:
-                            print(x, file=sys.stderr)
-                        invalid[sha256] = x
-                        continue
-
-                    trust_bits = derived_trust_bits(row)
-                    if TrustBits.SERVER_AUTHENTICATION not in trust_bits:
-                        x = 'Missing %s in %s %s' % (
-                            TrustBits.SERVER_AUTHENTICATION.name,
-                            trust_bits, sha256)
-                        if args.debug > 1:
-                            print(x, file=sys.stderr)
-                        invalid[sha256] = x
-                        continue
-
-                certs[sha256] = row
-
-    except OSError as e:
-        print('%s: %s' % (args.ccadb, e), file=sys.stderr)
-        sys.exit(1)
+            if not parent_sha256:
+                x = 'Intermediate with no parent: %s' % sha256
+                if args.debug > 1:
+                    print(x, file=sys.stderr)
+                invalid[sha256] = x
+                continue
+
+            if not bits.trust_bits[i] & server_authentication:
+                x = 'Missing %s in %s %s' % (
+                    TrustBits.SERVER_AUTHENTICATION.name,
+                    TrustBits(bits.trust_bits[i]), sha256)
+                if args.debug > 1:
+                    print(x, file=sys.stderr)
+                invalid[sha256] = x
+                continue
+
+        certs[sha256] = row
 
     if args.debug > 1:
         for sha256 in duplicates:
@@ -193,9 +188,19 @@ def get_certs(onecrl):
 
 
 def get_tree(certs, invalid):
-    nodes = {}
+    children = defaultdict(list)
+    roots = []
 
     for row in certs.values():
+        sha256 = row['SHA-256 Fingerprint']
+        parent_sha256 = row['Parent SHA-256 Fingerprint']
+
+        if not parent_sha256:
+            roots.append(sha256)
+        else:
+            children[parent_sha256].append(sha256)
+
+    def tag(row):
         sha256 = row['SHA-256 Fingerprint']
         name = row['Certificate Name']
         cert_type = row['Certificate Record Type']
@@ -206,31 +211,22 @@ def get_tree(certs, invalid):
             tag += f' CA-Owner: "{parent_name}"'
         else:
             tag += f' Issuer: "{parent_name}"'
-        nodes[sha256] = Node(tag=tag, identifier=sha256, data=row)
+        return tag
 
-    waiting_nodes = defaultdict(list)
+    tree = Forest()
 
-    tree = Tree()
-    tree.add_node(Node(tag='Root', identifier=0))
+    # add nodes reachable from a root, parent before child
+    stack = [(x, ROOT) for x in reversed(roots)]
+    while stack:
+        sha256, parent = stack.pop()
+        row = certs[sha256]
+        tree.add(sha256, tag=tag(row), data=row, parent=parent)
+        stack.extend((x, sha256) for x in reversed(children[sha256]))
 
-    for node in nodes.values():
-        row = node.data
-        sha256 = row['SHA-256 Fingerprint']
-        parent_sha256 = row['Parent SHA-256 Fingerprint']
-
-        if not parent_sha256:
-            tree.add_node(nodes[sha256], parent=0)
-        else:
-            if tree.contains(parent_sha256):
-                tree.add_node(nodes[sha256], parent=nodes[parent_sha256])
-                # is node a parent for any waiting nodes
-                if sha256 in waiting_nodes:
-                    for x in waiting_nodes[sha256]:
-                        tree.add_node(nodes[x], parent=nodes[sha256])
-                    del waiting_nodes[sha256]
-            elif parent_sha256 not in invalid:
-                # node's parent not in tree, add node to waiting list
-                waiting_nodes[parent_sha256].append(sha256)
+    waiting_nodes = {}
+    for parent_sha256, x in children.items():
+        if parent_sha256 not in tree and parent_sha256 not in invalid:
+            waiting_nodes[parent_sha256] = x
 
     if args.debug > 1 and waiting_nodes:
         print('Warning: nodes with no parent', file=sys.stderr)
@@ -255,8 +251,7 @@ def get_intermediates(tree, invalid, warning):
         print('%s: %s' % (args.root_fingerprints, e), file=sys.stderr)
         sys.exit(1)
 
-    newtree = Tree()
-    newtree.add_node(Node(tag='Root', identifier=0))
+    newtree = Forest()
 
     for row in data:
         sha256 = row['sha256']
@@ -271,14 +266,14 @@ def get_intermediates(tree, invalid, warning):
             total_invalid += 1
             continue
 
-        if not tree.contains(sha256):
+        if sha256 not in tree:
             print('Not found in CCADB: %s' % (
                 sha256), file=sys.stderr)
             total_invalid += 1
             continue
 
-        node = tree.get_node(sha256)
-        status_root = node.data['Status of Root Cert']
+        i = tree.index(sha256)
+        status_root = tree.data[i]['Status of Root Cert']
         statuses = status_root.split(';')
         included = [': Included' in x for x in statuses]
         if not any(included):
@@ -289,22 +284,22 @@ def get_intermediates(tree, invalid, warning):
         if sha256 in EXCLUDE_INTERMEDIATES:
             print('Skip intermediates for root: %s' % (
                 sha256), file=sys.stderr)
-            newtree.add_node(node=node, parent=0)
+            newtree.add(sha256, tag=tree.tags[i], data=tree.data[i])
             continue
 
-        subtree = tree.subtree(sha256)
-        nodes = subtree.all_nodes()
-        for node in nodes[1:]:
-            intermediates.append(node.identifier)
-        for node in nodes:
-            parent = subtree.parent(node.identifier)
-            newtree.add_node(
-                node=node,
-                parent=0 if parent is None else parent.identifier)
+        nodes = list(tree.subtree(sha256))
+        for x in nodes[1:]:
+            intermediates.append(tree.identifiers[x])
+        for x in nodes:
+            parent = ROOT if x == i else tree.identifiers[tree.parents[x]]
+            newtree.add(tree.identifiers[x],
+                        tag=tree.tags[x],
+                        data=tree.data[x],
+                        parent=parent)
 
         if args.debug > 1:
-            print(subtree, end='', file=sys.stderr)
-            nodes_ = [x.identifier for x in nodes]
+            print(tree.show(sha256), end='', file=sys.stderr)
+            nodes_ = [tree.identifiers[x] for x in nodes]
             print(len(nodes_), nodes_, file=sys.stderr)
 
     return total_invalid, newtree, intermediates
@@ -338,11 +333,19 @@ def write_tree(tree):
     if not args.tree:
         return
 
-    data = pan_chainguard.util.tree_to_dict(tree=tree)
+    def record(x):
+        if isinstance(x, CcadbRecord):
+            return x.to_dict()
+        raise TypeError('Object of type %s is not JSON serializable' % (
+            x.__class__.__name__))
 
     try:
         with open(args.tree, 'w') as f:
-            json.dump(data, f, separators=(',', ':'))
+            if args.tree_format == 'compact':
+                tree.dump_compact(f, default=record)
+            else:
+                json.dump(tree.to_dict(), f, separators=(',', ':'),
+                          default=record)
     except (OSError, TypeError) as e:
         print('%s: %s' % (args.tree, e), file=sys.stderr)
         sys.exit(1)
@@ -371,6 +374,16 @@ def parse_args():
     parser.add_argument('--tree',
                         metavar='PATH',
                         help='save certificate tree as JSON to path')
+    parser.add_argument('--tree-format',
+                        choices=['json', 'compact'],
+                        default='json',
+                        help='certificate tree format (default %(default)s)')
+    parser.add_argument('--cache',
+                        nargs='?',
+                        const=pan_chainguard.util.default_cache_dir(),
+                        metavar='DIR',
+                        help='cache parsed CCADB snapshot in directory'
+                        ' (default %(const)s)')
     parser.add_argument('--verbose',
                         action='store_true',
                         help='enable verbosity')
@@ -18,7 +18,6 @@
 
 import argparse
 import asyncio
-from collections import defaultdict
 from datetime import datetime, timezone
 from html import escape
 import json
@@ -31,16 +30,17 @@ sys.path[:0] = [os.path.join(libpath, os.pardir)]
 
 from pan_chainguard import title, __version__
 from pan_chainguard.ccadb import root_status_bits_flag, root_status_bits
+from pan_chainguard.forest import Forest, ForestError
 import pan_chainguard.util
 
 args = None
 
 
-def root_status(node):
-    if not args.verbose or node.tag == 'Root':
+def root_status(tree, i):
+    if not args.verbose or tree.tags[i] == 'Root':
         return ''
 
-    data = node.data
+    data = tree.data[i]
     if data['Certificate Record Type'] == 'Root Certificate':
         bits = root_status_bits_flag(data)
         status = root_status_bits(bits, compact=True)
@@ -49,17 +49,20 @@ def root_status(node):
         return ''
 
 
-def tree_sort(node):
-    return str(node.data['Certificate Name'])
+def tree_sort(tree):
+    def key(i):
+        return str(tree.data[i]['Certificate Name'])
+
+    return key
 
 
 def format_text(tree):
-    txt = tree.show(stdout=None, key=tree_sort)
+    txt = tree.show(key=tree_sort(tree))
     print(txt, end='')
 
 
 def format_stats(tree):
-    stats = pan_chainguard.util.stats_from_tree(tree=tree)
+    stats = pan_chainguard.util.stats_from_forest(forest=tree)
 
     for k, v in stats.items():
         name = k.replace('_', ' ').title()
@@ -68,118 +71,106 @@ def format_stats(tree):
 
 
 def format_rst(tree):
-    def tree_to_rst(tree, node_id=None, level=-1):
-        if node_id is None:
-            node_id = tree.root
-
-        node = tree[node_id]
-        lines = []
+    key = tree_sort(tree)
+    out = sys.stdout
 
-        sha256 = str(node_id)
-        # skips root node
-        if len(sha256) == 64:
-            # XXX uncertain if we can monospace the anchor
-            lines.append(
-                f'{"  " * level}* '
-                f'`{sha256} <https://crt.sh/?sha256={sha256}>`_ '
-                f'{node.tag[64:]}'
-            )
-
-        for i, child in enumerate(sorted(tree.children(node_id),
-                                         key=tree_sort)):
-            if i == 0:
-                lines.append('')
-            lines.extend(tree_to_rst(tree, child.identifier, level + 1))
-
-        return lines
-
-    lines = tree_to_rst(tree)
-    rst = ''
     if args.title:
-        rst = f'{args.title}\n{"=" * len(args.title)}\n'
-    rst += '\n'.join(lines)
-    print(rst)
+        out.write(f'{args.title}\n{"=" * len(args.title)}\n')
 
+    lines = 0
+    stack = [(0, -1)]
+    while stack:
+        i, level = stack.pop()
 
-def format_html(tree):
-    def tree_to_html(tree, node_id=None):
-        if node_id is None:
-            node_id = tree.root
-
-        node = tree[node_id]
-        children = tree.children(node_id)
-        root_vendors = root_status(node)
-        if root_vendors:
-            root_vendors = f' <b>vendors:{root_vendors}</b> '
-        html = ''
-
-        sha256 = str(node_id)
+        sha256 = str(tree.identifiers[i])
         # skips root node
         if len(sha256) == 64:
-            if node.data['Certificate Record Type'] == 'Root Certificate':
-                try:
-                    tree_to_html.roots += 1
-                except AttributeError:
-                    tree_to_html.roots = 1
-            else:
-                try:
-                    tree_to_html.intermediates += 1
-                except AttributeError:
-                    tree_to_html.intermediates = 1
-
-            html += (f'<li><a href="https://crt.sh/?sha256={sha256}">'
-                     f'<code>{sha256}</code></a>'
-                     f'{root_vendors}'
-                     f'{escape(node.tag[64:])}</li>\n')
+            # XXX uncertain if we can monospace the anchor
+            out.write(f'{"  " * level}* '
+                      f'`{sha256} <https://crt.sh/?sha256={sha256}>`_ '
+                      f'{tree.tags[i][64:]}\n')
+            lines += 1
 
+        children = tree.sorted_children(i, key)
         if children:
-            html += '<ul>\n'
-            for child in sorted(children, key=tree_sort):
-                html += tree_to_html(tree, child.identifier)
-            html += '</ul>\n'
+            out.write('\n')
+            lines += 1
+            stack.extend((x, level + 1) for x in reversed(children))
+
+    if not lines:
+        out.write('\n')
 
-        return html
 
-    tree_html = tree_to_html(tree)
+def format_html(tree):
+    key = tree_sort(tree)
+    out = sys.stdout
 
-    html = ''
     if args.title:
-        html += f'<h1>{escape(args.title)}</h1>\n'
+        out.write(f'<h1>{escape(args.title)}</h1>\n')
 
     if args.verbose:
-        html += f'''<h2>Certificate Totals</h2>
+        roots = intermediates = 0
+        for i in range(1, len(tree)):
+            if tree.data[i]['Certificate Record Type'] == 'Root Certificate':
+                roots += 1
+            else:
+                intermediates += 1
+
+        out.write(f'''<h2>Certificate Totals</h2>
 <blockquote>
-Root Certificates: {tree_to_html.roots}<br>
-Intermediate Certificates: {tree_to_html.intermediates}<br>
+Root Certificates: {roots}<br>
+Intermediate Certificates: {intermediates}<br>
 </blockquote>
-'''
-    if args.verbose:
-        html += '<h2>Certificate Tree</h2>\n'
-    html += tree_html
+''')
+        out.write('<h2>Certificate Tree</h2>\n')
+
+    # None closes the list of the node's children
+    stack = [0]
+    while stack:
+        i = stack.pop()
+        if i is None:
+            out.write('</ul>\n')
+            continue
+
+        sha256 = str(tree.identifiers[i])
+        # skips root node
+        if len(sha256) == 64:
+            root_vendors = root_status(tree, i)
+            if root_vendors:
+                root_vendors = f' <b>vendors:{root_vendors}</b> '
+            out.write(f'<li><a href="https://crt.sh/?sha256={sha256}">'
+                      f'<code>{sha256}</code></a>'
+                      f'{root_vendors}'
+                      f'{escape(tree.tags[i][64:])}</li>\n')
+
+        children = tree.sorted_children(i, key)
+        if children:
+            out.write('<ul>\n')
+            stack.append(None)
+            stack.extend(reversed(children))
+
     if args.verbose:
-        stats = pan_chainguard.util.stats_from_tree(tree=tree)
+        stats = pan_chainguard.util.stats_from_forest(forest=tree)
         stats_ = ''
         for k, v in stats.items():
             name = k.replace('_', ' ').title()
             value = '%.4f' % v if isinstance(v, float) else '%d' % v
             stats_ += '%s: %s<br>\n' % (name, value)
-        html += f'''<h2>Certificate Tree Statistics</h2>
+        out.write(f'''<h2>Certificate Tree Statistics</h2>
 <blockquote>
 {stats_}</blockquote>
-'''
+''')
 
         now_utc = datetime.now(timezone.utc)
         date_str = now_utc.strftime('%Y-%m-%d %H:%M:%S UTC')
-        html += f'''<footer>
+        out.write(f'''<footer>
 <p><em>Generated: {date_str}</em></p>
 </footer>
-'''
-
-    print(html, end='')
+''')
 
 
 def format_json(tree):
-    data = pan_chainguard.util.tree_to_dict(tree=tree)
+    data = tree.to_dict()
     json_data = json.dumps(data, indent=4)
     print(json_data)
 
@@ -205,8 +196,12 @@ def main():
 async def main_loop():
     tree = read_tree()
 
+    index = None
+    if args.test_collisions or args.fingerprint:
+        index = pan_chainguard.util.FingerprintIndex(tree.identifiers)
+
     if args.test_collisions:
-        if not test_collisions(tree):
+        if not test_collisions(index):
             return 1
 
     if args.format:
@@ -215,7 +210,7 @@ async def main_loop():
 
     if args.fingerprint:
         for x in args.fingerprint:
-            lookup(tree, x)
+            lookup(tree, index, x)
 
     return 0
 
@@ -223,15 +218,8 @@ async def main_loop():
 def read_tree():
     try:
         with open(args.tree, 'r') as f:
-            json_data = f.read()
-        data = json.loads(json_data)
-    except (OSError, ValueError) as e:
-        print('%s: %s' % (args.tree, e), file=sys.stderr)
-        sys.exit(1)
-
-    try:
-        tree = pan_chainguard.util.dict_to_tree(data=data)
-    except pan_chainguard.util.UtilError as e:
+            tree = Forest.load(f)
+    except (OSError, ForestError) as e:
         print('%s: %s' % (args.tree, e), file=sys.stderr)
         sys.exit(1)
 
@@ -240,18 +228,8 @@ def read_tree():
 
 # The first 26 characters of the SHA-256 fingerprint (length 64) are
 # used for the PAN-OS certificate name; test name for collisions.
-def test_collisions(tree):
-    data = pan_chainguard.util.tree_to_dict(tree=tree)
-
-    names = defaultdict(list)
-    for node in data['nodes']:
-        ident = node.get('identifier')
-        if ident:
-            name = pan_chainguard.util.hash_to_name(sha256=ident)
-            names[name].append(ident)
-
-    # keep only names that map to >1 identifiers
-    collisions = {name: ids for name, ids in names.items() if len(ids) > 1}
+def test_collisions(index):
+    collisions = index.collisions()
 
     if collisions:
         print(f'{len(collisions)} certificate name collisions',
@@ -265,30 +243,25 @@ def test_collisions(tree):
         return True
 
 
-def lookup(tree, sha256):
+def lookup(tree, index, sha256):
     nodes = []
 
+    s = sha256
     if len(sha256) == 64:
-        node = tree.get_node(sha256)
-        if node is not None:
-            nodes.append(node)
+        if sha256 in tree:
+            nodes.append(tree.index(sha256))
     else:
-        s = sha256
         if s.startswith(pan_chainguard.util.NAME_PREFIX):
             s = s[len(pan_chainguard.util.NAME_PREFIX):]
         s = s.upper()
-        matches = tree.filter_nodes(
-            lambda n: (isinstance(n.identifier, str) and
-                       s in n.identifier)
-        )
-        nodes.extend(matches)
+        nodes.extend(sorted(tree.index(x) for x in index.search(s)))
 
     if not nodes:
         print('Not found: %s' % s, file=sys.stderr)
         return
 
-    for node in nodes:
-        data = node.data
+    for i in nodes:
+        data = tree.data[i]
         filtered_data = {k: v for k, v in data.items() if v != ''}
         print(pprint.pformat(filtered_data))
 
@@ -301,7 +274,7 @@ def parse_args():
     parser.add_argument('--tree',
                         required=True,
                         metavar='PATH',
-                        help='JSON certificate tree path')
+                        help='JSON or compact certificate tree path')
     parser.add_argument('-f', '--format',
                         action='append',
                         choices=formats.keys(),
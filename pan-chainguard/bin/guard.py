@@ -19,13 +19,17 @@
 import argparse
 import asyncio
 from collections import defaultdict
+import concurrent.futures
+import csv
+import json
 import logging
 import os
 import pprint
 import re
 import sys
+import tempfile
+import threading
 import time
-from treelib import Node, Tree
 import xml.etree.ElementTree as etree
 
 try:
@@ -39,13 +43,68 @@ libpath = os.path.dirname(os.path.abspath(__file__))
 sys.path[:0] = [os.path.join(libpath, os.pardir)]
 
 from pan_chainguard import title, __version__
+from pan_chainguard.forest import Forest, ROOT
 import pan_chainguard.util
 
 # XXX keep compatible with sequence based naming for now
 NAME_RE = pan_chainguard.util.NAME_RE_COMPAT
 
+MULTI_CONFIG_MAX = 200  # actions per multi-config request
+API_TRIES = 3  # tries for intermittent status code 7
+API_RETRY_DELAY = 2.0
+FLEET_ERROR_MAX = 80  # error message length in --fleet table
+
 args = None
 
+# serialise device snapshot updates for --fleet threads sharing a device
+_snapshot_locks = defaultdict(threading.Lock)
+_snapshot_locks_lock = threading.Lock()
+
+
+class AddCertError(Exception):
+    pass
+
+
+class DeviceStderr():
+    """sys.stderr proxy for --fleet worker threads.
+
+    Lines written by a thread with a device set are prefixed with the
+    device, and the last one is kept as the device error message.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def start(self, device):
+        self.local.device = device
+        self.local.line = ''
+        self.local.last = None
+
+    def stop(self):
+        if self.local.line:
+            self.write('\n')
+        self.local.device = None
+        return self.local.last
+
+    def write(self, s):
+        device = getattr(self.local, 'device', None)
+        if device is None:
+            return self.stream.write(s)
+
+        *lines, self.local.line = (self.local.line + s).split('\n')
+        for x in lines:
+            if x.strip():
+                self.local.last = x.strip()
+            self.stream.write('%s: %s\n' % (device, x))
+        return len(s)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
 
 class Xpath():
     def __init__(self, *,
@@ -195,11 +254,61 @@ def main():
 
 
 async def main_loop():
-    xapi = None
+    if args.update:
+        if args.certs is None:
+            print('--certs argument required', file=sys.stderr)
+            sys.exit(1)
+        if args.type is None:
+            print('--type argument required', file=sys.stderr)
+            sys.exit(1)
+        if args.workers < 1:
+            print('--workers must be >= 1', file=sys.stderr)
+            sys.exit(1)
+
+    if args.fleet is not None:
+        fleet()
+        return
+
+    if args.tag is None:
+        print('--tag or --fleet argument required', file=sys.stderr)
+        sys.exit(1)
+
+    xapi, panorama, serial = connect(args.tag)
+    xpath = get_xpath(panorama, args.template, args.vsys)
+    inventory = DeviceCertificates(xapi, xpath, serial, args.cache)
+
+    if args.show:
+        show(xapi, xpath, inventory)
+    if args.show_tree:
+        show_tree(xapi, xpath, inventory)
+
+    # experimental
+    if args.enable_trusted:
+        enable_trusted(xapi, xpath)
+
+    # experimental
+    if args.disable_trusted:
+        disable_trusted(xapi, xpath)
+
+    if args.update_trusted:
+        update_trusted_root_cas(xapi, xpath, inventory, quiet=False)
+
+    if args.delete:
+        delete_certs(xapi, xpath, inventory)
+
+    if args.update:
+        update_certs(xapi, xpath, inventory, read_certs())
+
+    if args.commit:
+        commit(xapi, xpath)
+
+
+def connect(tag):
+    '''Return (xapi, panorama, serial); serial is None if unknown.'''
     panorama = False
 
     try:
-        xapi = pan.xapi.PanXapi(tag=args.tag,
+        xapi = pan.xapi.PanXapi(tag=tag,
                                 debug=args.xdebug)
         xapi.ad_hoc(modify_qs=True,
                     qs={'type': 'version'})
@@ -209,14 +318,19 @@ async def main_loop():
                 panorama = True
         else:
             print("Can't get model", file=sys.stderr)
+        serial = xapi.element_root.findtext('./result/serial')
     except pan.xapi.PanXapiError as e:
         print('pan.xapi.PanXapi:', e, file=sys.stderr)
         sys.exit(1)
 
+    return xapi, panorama, serial
+
+
+def get_xpath(panorama, template, vsys):
     try:
         xpath = Xpath(panorama=panorama,
-                      vsys=args.vsys,
-                      template=args.template)
+                      vsys=vsys,
+                      template=template)
     except ValueError as e:
         print(e, file=sys.stderr)
         sys.exit(1)
@@ -227,37 +341,142 @@ async def main_loop():
         print(xpath.trusted_root_ca(), file=sys.stderr)
         print(xpath.root_ca_exclude_list(), file=sys.stderr)
 
-    if args.show:
-        show(xapi, xpath)
-    if args.show_tree:
-        show_tree(xapi, xpath)
+    return xpath
 
-    # experimental
-    if args.enable_trusted:
-        enable_trusted(xapi, xpath)
 
-    # experimental
-    if args.disable_trusted:
-        disable_trusted(xapi, xpath)
+def read_fleet(path):
+    fields = ['tag', 'template', 'vsys', 'commit']
 
-    if args.update_trusted:
-        update_trusted_root_cas(xapi, xpath, quiet=False)
+    try:
+        with open(path, 'r', newline='') as f:
+            reader = csv.DictReader(f, dialect='unix')
+            if reader.fieldnames is None or 'tag' not in reader.fieldnames:
+                print('%s: missing tag column' % path, file=sys.stderr)
+                sys.exit(1)
+            devices = []
+            for row in reader:
+                x = {k: row.get(k) or None for k in fields}
+                if x['tag'] is None:
+                    print('%s: line %d: missing tag' % (
+                        path, reader.line_num), file=sys.stderr)
+                    sys.exit(1)
+                if x['vsys'] is not None:
+                    x['vsys'] = check_vsys(x['vsys'])
+                if x['commit'] is None:
+                    x['commit'] = args.commit
+                elif x['commit'] in ['yes', 'no']:
+                    x['commit'] = x['commit'] == 'yes'
+                else:
+                    print('%s: line %d: commit not yes or no: %s' % (
+                        path, reader.line_num, x['commit']),
+                        file=sys.stderr)
+                    sys.exit(1)
+                devices.append(x)
+    except (OSError, csv.Error) as e:
+        print('%s: %s' % (path, e), file=sys.stderr)
+        sys.exit(1)
 
-    if args.delete:
-        delete_certs(xapi, xpath)
+    return devices
 
-    if args.update:
-        if args.certs is None:
-            print('--certs argument required', file=sys.stderr)
-            sys.exit(1)
-        if args.type is None:
-            print('--type argument required', file=sys.stderr)
-            sys.exit(1)
 
-        update_certs(xapi, xpath)
+def fleet():
+    if not args.update and not args.commit:
+        print('--fleet requires --update and/or --commit', file=sys.stderr)
+        sys.exit(1)
+    if args.fleet_workers < 1:
+        print('--fleet-workers must be >= 1', file=sys.stderr)
+        sys.exit(1)
 
-    if args.commit:
-        commit(xapi, panorama)
+    devices = read_fleet(args.fleet)
+    # the archive is read once for all devices
+    new = read_certs() if args.update else None
+
+    stderr = DeviceStderr(sys.stderr)
+
+    def run(device, func, *x):
+        # record an error and continue with the other devices;
+        # functions print the error and exit
+        stderr.start(' '.join(device[k] for k in ['tag', 'template', 'vsys']
+                              if device[k]))
+        try:
+            return 'success', func(*x)
+        except SystemExit:
+            pass
+        except Exception as e:
+            print('%s: %s' % (type(e).__name__, e), file=sys.stderr)
+        finally:
+            error = stderr.stop()
+
+        return 'error', error or 'error'
+
+    def update(device):
+        xapi, panorama, serial = connect(device['tag'])
+        xpath = get_xpath(panorama, device['template'], device['vsys'])
+        inventory = DeviceCertificates(xapi, xpath, serial, args.cache)
+        counts = None
+        if args.update:
+            counts = update_certs(xapi, xpath, inventory, new, quiet=True)
+        return xapi, xpath, counts
+
+    sys.stderr = stderr
+    try:
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=args.fleet_workers) as executor:
+            results = list(executor.map(lambda x: run(x, update, x),
+                                        devices))
+
+            # commit after all devices are updated
+            commits = [None] * len(devices)
+            futures = {}
+            for i, device in enumerate(devices):
+                status, x = results[i]
+                if status == 'success' and device['commit']:
+                    xapi, xpath, _ = x
+                    futures[i] = executor.submit(run, device, commit,
+                                                 xapi, xpath, True)
+            for i, future in futures.items():
+                commits[i] = future.result()
+    finally:
+        sys.stderr = stderr.stream
+
+    def error(x):
+        # the full message is on stderr prefixed with the device
+        x = x if len(x) <= FLEET_ERROR_MAX else x[:FLEET_ERROR_MAX] + '...'
+        return 'error: %s' % x
+
+    rows = [('tag', 'template', 'vsys', 'delete', 'add', 'commit',
+             'status')]
+    errors = 0
+    for i, device in enumerate(devices):
+        status, x = results[i]
+        counts = x[2] if status == 'success' and x[2] is not None else None
+        commit_ = ''
+        if status != 'success':
+            status = error(x)
+        elif commits[i] is not None:
+            commit_ = commits[i][1] or ''
+            if commits[i][0] != 'success':
+                commit_ = 'error'
+                status = error(commits[i][1])
+        if status != 'success':
+            errors += 1
+        rows.append((device['tag'],
+                     device['template'] or '',
+                     device['vsys'] or '',
+                     '%d' % counts[0] if counts else '',
+                     '%d' % counts[1] if counts else '',
+                     commit_,
+                     status))
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print('  '.join(x.ljust(widths[i])
+                        for i, x in enumerate(row)).rstrip())
+
+    if errors:
+        print('%d of %d devices failed' % (errors, len(devices)),
+              file=sys.stderr)
+        sys.exit(1)
 
 
 def exclude_cert(sha256):
@@ -360,14 +579,161 @@ def disable_trusted(xapi, xpath):
     print('%d default trusted root CAs disabled' % len(members))
 
 
-def get_certs(xapi, xpath):
-    certificates = xpath.certificates()
-    kwargs = {'xpath': certificates}
+class DeviceCertificates():
+    """pan-chainguard managed device certificates and trusted root CAs.
+
+    The config is fetched once and reused until changed() is called.
+    With a snapshot directory the config is saved by device serial
+    number and reused while the device has no uncommitted changes
+    and no new commit.
+    """
+
+    CONFIG = ['certificates', 'trusted-root-CA']
+
+    def __init__(self, xapi, xpath, serial, snapshot_dir=None):
+        self.xapi = xapi
+        self.xpath = xpath
+        self.serial = serial
+        self.snapshot_dir = snapshot_dir
+        self._config = None
+        self._certs = None
+        self._trusted = None
+        self._version = None
+
+    def certs(self):
+        if self._certs is None:
+            self._certs = parse_certs(self._get('certificates'))
+        return self._certs
+
+    def trusted_root_cas(self):
+        if self._trusted is None:
+            self._trusted = parse_trusted_root_cas(
+                self._get('trusted-root-CA'))
+        return self._trusted
+
+    def changed(self):
+        self._config = {}
+        self._certs = None
+        self._trusted = None
+        # uncommitted changes now; don't save snapshot
+        self._version = None
+
+    def _get(self, name):
+        if self._config is None:
+            self._config = self._load_snapshot()
+
+        if name not in self._config:
+            xpath = (self.xpath.certificates() if name == 'certificates'
+                     else self.xpath.trusted_root_ca())
+            self._config[name] = get_config(self.xapi, xpath)
+            self._save_snapshot()
+
+        x = self._config[name]
+        return None if x is None else etree.fromstring(x)
+
+    def _snapshot_path(self):
+        return os.path.join(self.snapshot_dir, 'devices',
+                            self._version[0] + '.json')
+
+    def _load_snapshot(self):
+        if self.snapshot_dir is None:
+            return {}
+
+        self._version = config_version(self.xapi, self.serial)
+        if self._version is None:
+            return {}
+
+        try:
+            with open(self._snapshot_path(), 'r') as f:
+                x = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        if x.get('version') != self._version[1]:
+            return {}
+        config = x.get('config', {}).get(str(self.xpath), {})
+        if args.debug:
+            print('snapshot %s: %s' % (self._snapshot_path(),
+                                       ', '.join(sorted(config))),
+                  file=sys.stderr)
+
+        return {k: v for k, v in config.items() if k in self.CONFIG}
+
+    def _save_snapshot(self):
+        if self.snapshot_dir is None or self._version is None:
+            return
+
+        with _snapshot_locks_lock:
+            lock = _snapshot_locks[self._version[0]]
+        with lock:
+            self._update_snapshot()
+
+    def _update_snapshot(self):
+        path = self._snapshot_path()
+        try:
+            with open(path, 'r') as f:
+                x = json.load(f)
+            if x.get('version') != self._version[1]:
+                raise ValueError
+        except (OSError, ValueError):
+            x = {'version': self._version[1], 'config': {}}
+
+        x['config'][str(self.xpath)] = self._config
+        tmp = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path),
+                                       suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(x, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            print('%s: %s' % (path, e), file=sys.stderr)
+            if tmp is not None and os.path.exists(tmp):
+                os.unlink(tmp)
+
+
+def config_version(xapi, serial):
+    """Return (serial, last commit job ID), or None when unknown or
+    there are uncommitted changes.
+
+    serial is from the type=version response connect() already
+    fetched, so this costs two op requests.
+    """
+    if serial is None or not re.search(r'^\w+$', serial):
+        return None
+
+    kwargs = {'cmd': '<check><pending-changes></pending-changes></check>'}
+    api_request(xapi, xapi.op, kwargs, 'success')
+    if xapi.element_root.findtext('./result') != 'no':
+        return None
+
+    kwargs = {'cmd': '<show><jobs><all></all></jobs></show>'}
+    api_request(xapi, xapi.op, kwargs, 'success')
+    commits = [0]
+    for job in xapi.element_root.findall('./result/job'):
+        if (job.findtext('type') == 'Commit' and
+           job.findtext('id', '').isdigit()):
+            commits.append(int(job.findtext('id')))
+
+    return serial, '%d' % max(commits)
+
+
+def get_config(xapi, xpath):
+    """Return the config result as XML, or None if not present."""
+    kwargs = {'xpath': xpath}
     api_request(xapi, xapi.get, kwargs, 'success', ['7', '19'])
     if xapi.status_code == '7':
+        return None
+
+    return etree.tostring(xapi.element_root.find('./result')).decode()
+
+
+def parse_certs(result):
+    if result is None:
         return []
 
-    entries = xapi.element_root.findall('./result/certificate/entry')
+    entries = result.findall('./certificate/entry')
 
     data = {}
     prog = re.compile(NAME_RE)
@@ -411,45 +777,81 @@ def get_certs(xapi, xpath):
     return data
 
 
-def delete_certs(xapi, xpath):
-    data = get_certs(xapi, xpath)
+def delete_certs(xapi, xpath, inventory):
+    data = inventory.certs()
 
     if args.dry_run:
         print('delete dry-run: %d to delete' % len(data))
         return
 
-    for name in data:
-        delete_cert(xapi, xpath, name)
+    delete_certs_multi(xapi, xpath, inventory, list(data))
 
     print('%d certificates deleted' % len(data))
 
 
-def delete_cert(xapi, xpath, name):
-    rootca = xpath.trusted_root_ca()
-    member = "/member[text()='%s']" % name
-    kwargs = {'xpath': rootca + member}
-    api_request(xapi, xapi.delete, kwargs, 'success', ['7', '20'])
+def delete_certs_multi(xapi, xpath, inventory, names):
+    if not names:
+        return
 
+    # only delete existing trusted root CA members so each action
+    # succeeds and the requests can be strict-transactional
+    trusted = set(inventory.trusted_root_cas())
+    rootca = xpath.trusted_root_ca()
     certificates = xpath.certificates()
-    entry = "/entry[@name='%s']" % name
-    kwargs = {'xpath': certificates + entry}
-    # XXX can return status_code 7 intermittently; workaround is
-    # to re-run
-    api_request(xapi, xapi.delete, kwargs, 'success', '20')
+
+    # members must be deleted before the certificates they reference
+    actions = []
+    for name in names:
+        if name in trusted:
+            actions.append(('delete',
+                            rootca + "/member[text()='%s']" % name))
+    for name in names:
+        actions.append(('delete',
+                        certificates + "/entry[@name='%s']" % name))
+
+    multi_config(xapi, actions)
+    inventory.changed()
+
     if args.verbose:
-        print('deleted', name, file=sys.stderr)
+        for name in names:
+            print('deleted', name, file=sys.stderr)
 
 
-def get_trusted_root_cas(xapi, xpath):
-    trusted_root_ca = xpath.trusted_root_ca()
-    kwargs = {'xpath': trusted_root_ca}
-    api_request(xapi, xapi.get, kwargs, 'success', ['7', '19'])
+def multi_config(xapi, actions):
+    '''Perform (operation, xpath) actions using multi-config requests.'''
+    requests = 0
 
+    for i in range(0, len(actions), MULTI_CONFIG_MAX):
+        root = etree.Element('multi-configure-request')
+        for j, (op, x) in enumerate(actions[i:i + MULTI_CONFIG_MAX],
+                                    start=i + 1):
+            etree.SubElement(root, op, id=str(j), xpath=x)
+
+        kwargs = {
+            'element': etree.tostring(root).decode(),
+            'strict': True,
+        }
+        api_request(xapi, xapi.multi_config, kwargs, 'success')
+        requests += 1
+
+        for x in xapi.element_root.iterfind('.//response[@id]'):
+            if x.get('status') != 'success':
+                print('multi_config: id %s status %s: %s' % (
+                    x.get('id'), x.get('status'),
+                    etree.tostring(x).decode()), file=sys.stderr)
+                sys.exit(1)
+
+    if args.verbose:
+        print('multi-config: %d actions in %d requests, '
+              '%d requests saved' % (len(actions), requests,
+                                     len(actions) - requests))
+
+
+def parse_trusted_root_cas(result):
     prog = re.compile(NAME_RE)
     data = []
-    if xapi.status_code == '19':
-        entries = xapi.element_root.findall(
-            './result/trusted-root-CA/member')
+    if result is not None:
+        entries = result.findall('./trusted-root-CA/member')
         for entry in entries:
             name = entry.text
             if prog.search(name):
@@ -458,12 +860,12 @@ def get_trusted_root_cas(xapi, xpath):
     return data
 
 
-def update_trusted_root_cas(xapi, xpath, quiet=True):
-    cert_names = get_certs(xapi, xpath)
+def update_trusted_root_cas(xapi, xpath, inventory, quiet=True):
+    cert_names = inventory.certs()
     add = []
 
     if cert_names:
-        data = get_trusted_root_cas(xapi, xpath)
+        data = inventory.trusted_root_cas()
         if data:
             for name in cert_names:
                 if name not in data:
@@ -478,6 +880,7 @@ def update_trusted_root_cas(xapi, xpath, quiet=True):
 
     if add:
         add_trusted_root_cas(xapi, xpath, add)
+        inventory.changed()
 
     if not quiet:
         print('%d certificates enabled as trusted root CA' % len(add))
@@ -500,25 +903,26 @@ def add_trusted_root_cas(xapi, xpath, cert_names):
     api_request(xapi, xapi.set, kwargs, 'success', '20')
 
 
-def update_certs(xapi, xpath):
-    old = get_certs(xapi, xpath)
-
+def read_certs():
     new = {}
     try:
-        data = pan_chainguard.util.read_cert_archive(
-            path=args.certs)
+        with pan_chainguard.util.CertArchive(path=args.certs) as archive:
+            # only certificates of the requested types are read
+            for sha256 in archive.fingerprints(cert_type=args.type):
+                if exclude_cert(sha256):
+                    continue
+                cert_name = pan_chainguard.util.hash_to_name(
+                    sha256=sha256)
+                new[cert_name] = archive.content(sha256=sha256)
     except pan_chainguard.util.UtilError as e:
         print(str(e), file=sys.stderr)
         sys.exit(1)
 
-    for sha256 in data:
-        if exclude_cert(sha256):
-            continue
-        cert_type, content = data[sha256]
-        if cert_type not in args.type:
-            continue
-        cert_name = pan_chainguard.util.hash_to_name(sha256=sha256)
-        new[cert_name] = content
+    return new
+
+
+def update_certs(xapi, xpath, inventory, new, quiet=False):
+    old = inventory.certs()
 
     old_set = set(old)
     new_set = set(new.keys())
@@ -535,23 +939,76 @@ def update_certs(xapi, xpath):
         print('update add', pprint.pformat(add), file=sys.stderr)
 
     if args.dry_run:
-        print('update dry-run: %d to delete, %d to add' % (
-            len(delete), len(add)))
-        return
+        if not quiet:
+            print('update dry-run: %d to delete, %d to add' % (
+                len(delete), len(add)))
+        return len(delete), len(add)
+
+    delete_certs_multi(xapi, xpath, inventory, delete)
+    if not quiet:
+        print('%d certificates deleted' % len(delete))
+
+    added = add_certs(xapi, xpath, add, new)
+    if added:
+        add_trusted_root_cas(xapi, xpath, added)
+        inventory.changed()
+
+    if not quiet:
+        print('%d certificates added' % len(added))
 
-    for name in delete:
-        delete_cert(xapi, xpath, name)
-    print('%d certificates deleted' % len(delete))
+    return len(delete), len(added)
 
-    total = 0
-    for name in add:
-        if add_cert(xapi, xpath, name, new[name]):
-            total += 1
 
-    if total:
-        add_trusted_root_cas(xapi, xpath, add_cert.cert_names)
+def add_certs(xapi, xpath, names, content):
+    '''Import certificates; return names imported, in names order.'''
+    if args.workers == 1:
+        try:
+            results = [add_cert(xapi, xpath, x, content[x]) for x in names]
+        except AddCertError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        return [x for x, ok in zip(names, results) if ok]
+
+    # PanXapi is not thread safe; use one per worker thread
+    local = threading.local()
+
+    def worker(name):
+        if not hasattr(local, 'xapi'):
+            try:
+                local.xapi = pan.xapi.PanXapi(tag=xapi.tag,
+                                              api_key=xapi.api_key,
+                                              debug=args.xdebug)
+            except pan.xapi.PanXapiError as e:
+                raise AddCertError('pan.xapi.PanXapi: %s' % e)
+        return add_cert(local.xapi, xpath, name, content[name])
+
+    results = [False] * len(names)
+    errors = []
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=args.workers) as executor:
+        futures = [executor.submit(worker, x) for x in names]
+        try:
+            for i, future in enumerate(futures):
+                if future.cancelled():
+                    continue
+                try:
+                    results[i] = future.result()
+                except AddCertError as e:
+                    # stop starting new imports; let the running
+                    # ones finish
+                    errors.append(e)
+                    for x in futures:
+                        x.cancel()
+        except BaseException:
+            executor.shutdown(cancel_futures=True)
+            raise
+
+    if errors:
+        for x in errors:
+            print(x, file=sys.stderr)
+        sys.exit(1)
 
-    print('%d certificates added' % total)
+    return [x for x, ok in zip(names, results) if ok]
 
 
 def add_cert(xapi, xpath, cert_name, content):
@@ -565,39 +1022,35 @@ def add_cert(xapi, xpath, cert_name, content):
     }
 
     if xpath.panorama:
-        if args.template is not None:
-            kwargs['extra_qs']['target-tpl'] = args.template
-        if args.vsys is not None:
+        if xpath.template is not None:
+            kwargs['extra_qs']['target-tpl'] = xpath.template
+        if xpath.vsys is not None:
             # XXX does not work; PAN-257229
-            kwargs['extra_qs']['target-tpl-vsys'] = args.vsys
-    elif args.vsys is not None:
-        kwargs['vsys'] = args.vsys
+            kwargs['extra_qs']['target-tpl-vsys'] = xpath.vsys
+    elif xpath.vsys is not None:
+        kwargs['vsys'] = xpath.vsys
 
     SKIP_ERRORS = [
         'Certificate is expired',
         'Unsupported digest or keys used in FIPS-CC mode',
     ]
 
-    try:
-        xapi.import_file(**kwargs)
-    except pan.xapi.PanXapiError as e:
-        for error in SKIP_ERRORS:
-            if error in str(e):
-                if args.verbose:
-                    print('%s skipped: %s' % (cert_name, e),
-                          file=sys.stderr)
-                return False
-
-        print('%s: %s: %s' % (xapi.import_file.__name__, kwargs, e),
-              file=sys.stderr)
-        sys.exit(1)
-
-    # Use function attribute to cache certificate names so we can use
-    # a single API request to enable them as trusted root CAs.
-    try:
-        add_cert.cert_names.append(cert_name)
-    except AttributeError:
-        add_cert.cert_names = [cert_name]
+    for tries in range(1, API_TRIES + 1):
+        try:
+            xapi.import_file(**kwargs)
+        except pan.xapi.PanXapiError as e:
+            for error in SKIP_ERRORS:
+                if error in str(e):
+                    if args.verbose:
+                        print('%s skipped: %s' % (cert_name, e),
+                              file=sys.stderr)
+                    return False
+
+            if retry(xapi, tries, xapi.import_file, cert_name):
+                continue
+            raise AddCertError('%s: %s: %s' % (
+                xapi.import_file.__name__, kwargs, e))
+        break
 
     if args.verbose:
         print('added %s' % cert_name, file=sys.stderr)
@@ -605,8 +1058,8 @@ def add_cert(xapi, xpath, cert_name, content):
     return True
 
 
-def show(xapi, xpath):
-    data = get_certs(xapi, xpath)
+def show(xapi, xpath, inventory):
+    data = inventory.certs()
     out = []
     num_expired = 0
 
@@ -635,7 +1088,7 @@ def show(xapi, xpath):
         print('\n'.join(out))
 
     if out:
-        data = get_trusted_root_cas(xapi, xpath)
+        data = inventory.trusted_root_cas()
         num = len(data)
         print('%d Trusted Root CA Certificates' % num)
         if num < len(out):
@@ -645,40 +1098,39 @@ def show(xapi, xpath):
     show_disabled_trusted(xapi, xpath)
 
 
-def duplicates_in_path(tree: Tree) -> list[dict]:
-    def dfs(nid: str, seen: set[str], out: list[dict]) -> None:
-        new_seen = set(seen)
-        node = tree.get_node(nid)
-        if node.tag != 'Root':
-            key = node.data['subject-hash']
+def duplicates_in_path(forest: Forest) -> list[dict]:
+    # depth-first with one set of subject hashes in the current path;
+    # a (node, True) stack item removes the node's hash on return
+    duplicates = []
+    seen = set()
+    stack = [(ROOT, False)]
+
+    while stack:
+        i, leave = stack.pop()
+        if leave:
+            seen.remove(forest.data[i]['subject-hash'])
+            continue
 
+        if i != ROOT:
+            key = forest.data[i]['subject-hash']
             if key in seen:
-                out.append({
-                    'node-id': nid,
-                    'tag': str(node.tag),
+                duplicates.append({
+                    'node-id': forest.identifiers[i],
+                    'tag': str(forest.tags[i]),
                     'key': key,
-                    'node-data': node.data,
+                    'node-data': forest.data[i],
                 })
-                return  # stop this root-to-leaf path here
+                continue  # stop this root-to-leaf path here
+            seen.add(key)
+            stack.append((i, True))
 
-            else:
-                new_seen.add(key)
-
-        children = tree.children(nid)
-        if not children:
-            return  # leaf reached, no dup on this path
-
-        for child in children:
-            dfs(child.identifier, new_seen, out)
-
-    duplicates = []
-    dfs(tree.root, set(), duplicates)
+        stack.extend((x, False) for x in reversed(forest.children[i]))
 
     return duplicates
 
 
-def show_tree(xapi, xpath):
-    data = get_certs(xapi, xpath)
+def show_tree(xapi, xpath, inventory):
+    data = inventory.certs()
     issuers = defaultdict(list)
     subjects = defaultdict(list)
     roots = []
@@ -701,32 +1153,36 @@ def show_tree(xapi, xpath):
         print('roots', pprint.pformat(roots), file=sys.stderr)
         print('orphans', pprint.pformat(orphans), file=sys.stderr)
 
-    tree = Tree()
-    tree.add_node(Node(tag='Root', identifier=0))
+    forest = Forest()
 
-    def build_node(x):
+    def add_node(x, parent):
         subject = x['subject-cn'] if x['subject-cn'] else x['subject']
         issuer = x['issuer-cn'] if x['issuer-cn'] else x['issuer']
         tag = (f"{x['cert-name']} "
                f'Subject: "{subject}" '
                f'Issuer: "{issuer}"')
 
-        node = Node(tag=tag, identifier=x['cert-name'], data=x)
-
-        return node
+        forest.add(x['cert-name'], tag=tag, data=x, parent=parent)
 
     def add_children(parent, issuer):
-        if issuer in issuers:
-            for x in issuers[issuer]:
-                if (tree.contains(x['cert-name']) or
-                   x['subject-hash'] == x['issuer-hash']):
-                    continue
-
-                tree.add_node(build_node(x), parent=parent)
-                add_children(x['cert-name'], x['subject-hash'])
-
-    def format_stats(tree):
-        stats = pan_chainguard.util.stats_from_tree(tree=tree)
+        # depth-first using a stack of issued certificate iterators
+        stack = [(parent, iter(issuers.get(issuer, [])))]
+        while stack:
+            parent, children = stack[-1]
+            x = next(children, None)
+            if x is None:
+                stack.pop()
+                continue
+            if (x['cert-name'] in forest or
+               x['subject-hash'] == x['issuer-hash']):
+                continue
+
+            add_node(x, parent)
+            stack.append((x['cert-name'],
+                          iter(issuers.get(x['subject-hash'], []))))
+
+    def format_stats(forest):
+        stats = pan_chainguard.util.stats_from_forest(forest=forest)
 
         for k, v in stats.items():
             name = k.replace('_', ' ').title()
@@ -734,21 +1190,21 @@ def show_tree(xapi, xpath):
             print('%s: %s' % (name, value))
 
     for x in roots + orphans:
-        tree.add_node(build_node(x), parent=0)
+        add_node(x, ROOT)
         add_children(x['cert-name'], x['subject-hash'])
 
-    print(tree.show(stdout=False), end='')
+    print(forest.show(), end='')
 
     if args.verbose:
-        format_stats(tree)
+        format_stats(forest)
 
-    duplicates = duplicates_in_path(tree)
+    duplicates = duplicates_in_path(forest)
     if args.verbose and duplicates:
         print(f'Info: {len(duplicates)} duplicate subject in tree path')
         for x in duplicates:
             print(f"{x['key']} {x['tag']}")
 
-    treelen = len(tree) - 1  # don't count root node
+    treelen = len(forest) - 1  # don't count root node
     sublen = 0
     for x in subjects:
         sublen += len(subjects[x])
@@ -767,7 +1223,7 @@ def show_tree(xapi, xpath):
         print('\n'.join(duplicates))
 
 
-def commit(xapi, panorama):
+def commit(xapi, xpath, quiet=False):
     root = etree.Element('commit')
     partial = etree.SubElement(root, 'partial')
     desc = etree.SubElement(partial, 'description')
@@ -784,23 +1240,23 @@ def commit(xapi, panorama):
     shared_object = etree.Element('shared-object')
     shared_object.text = 'excluded'
 
-    if panorama:
-        if args.template:
+    if xpath.panorama:
+        if xpath.template:
             # commit scope: template
             # no template vsys scope
             template = etree.SubElement(partial, 'template')
             template_member = etree.SubElement(template, 'member')
-            template_member.text = args.template
+            template_member.text = xpath.template
         else:
             # commit scope: device-and-network
             partial.append(shared_object)
     else:
         # firewall
-        if args.vsys:
+        if xpath.vsys:
             # commit scope: vsys
             vsys = etree.SubElement(partial, 'vsys')
             vsys_member = etree.SubElement(vsys, 'member')
-            vsys_member.text = args.vsys
+            vsys_member.text = xpath.vsys
             partial.append(device_and_network)
             partial.append(shared_object)
         else:
@@ -818,15 +1274,18 @@ def commit(xapi, panorama):
     }
 
     if args.dry_run:
-        return
+        return None
 
-    if args.verbose:
+    if args.verbose and not quiet:
         print('commit config for admin %s' % args.admin)
 
     api_request(xapi, xapi.commit, kwargs, 'success')
     if args.debug:
         print(xapi.xml_root(), file=sys.stderr)
 
+    if quiet:
+        return xapi.status
+
     if xapi.status_code is not None:
         code = ' [code=\"%s\"]' % xapi.status_code
     else:
@@ -837,14 +1296,43 @@ def commit(xapi, panorama):
         print(': "%s"' % xapi.status_detail.rstrip(), end='')
     print()
 
+    return xapi.status
 
-def api_request(xapi, func, kwargs, status=None, status_code=None):
-    try:
-        func(**kwargs)
-    except pan.xapi.PanXapiError as e:
-        print('%s: %s: %s' % (func.__name__, kwargs, e),
+
+def retry(xapi, tries, func, msg, status_code=None):
+    # XXX status_code 7 can be returned intermittently
+    if (tries < API_TRIES and xapi.status_code == '7' and
+       (status_code is None or
+            not pan_chainguard.util.s1_in_s2('7', status_code))):
+        delay = API_RETRY_DELAY * tries
+        print('%s: retry after try %d status_code 7 %s, '
+              'sleeping %.2fs' % (func.__name__, tries, msg, delay),
               file=sys.stderr)
-        sys.exit(1)
+        time.sleep(delay)
+        return True
+
+    return False
+
+
+def api_request(xapi, func, kwargs, status=None, status_code=None):
+    for tries in range(1, API_TRIES + 1):
+        try:
+            func(**kwargs)
+        except pan.xapi.PanXapiError as e:
+            if retry(xapi, tries, func, kwargs.get('xpath', ''),
+                     status_code):
+                continue
+            print('%s: %s: %s' % (func.__name__, kwargs, e),
+                  file=sys.stderr)
+            sys.exit(1)
+
+        if (status_code is not None and
+           not pan_chainguard.util.s1_in_s2(xapi.status_code,
+                                            status_code) and
+           retry(xapi, tries, func, kwargs.get('xpath', ''),
+                 status_code)):
+            continue
+        break
 
     status_detail = (' "%s"' % xapi.status_detail
                      if xapi.status_detail is not None
@@ -866,17 +1354,17 @@ def api_request(xapi, func, kwargs, status=None, status_code=None):
         sys.exit(1)
 
 
-def parse_args():
-    def check_vsys(x):
-        if x.isdigit():
-            x = 'vsys' + x
-        return x
+def check_vsys(x):
+    if x.isdigit():
+        x = 'vsys' + x
+    return x
+
 
+def parse_args():
     parser = argparse.ArgumentParser(
         usage='%(prog)s [options]',
         description='update PAN-OS trusted CAs')
     parser.add_argument('--tag', '-t',
-                        required=True,
                         help='.panrc tagname')
     parser.add_argument('--vsys',
                         type=check_vsys,
@@ -924,6 +1412,27 @@ def parse_args():
                         action='store_true',
                         help='show %s managed certificates in tree format' %
                         title)
+    parser.add_argument('--workers',
+                        type=int,
+                        default=1,
+                        metavar='N',
+                        help='concurrent certificate imports'
+                        ' (default %(default)s)')
+    parser.add_argument('--fleet',
+                        metavar='PATH',
+                        help='update devices in inventory CSV path')
+    parser.add_argument('--fleet-workers',
+                        type=int,
+                        default=4,
+                        metavar='N',
+                        help='concurrent device updates'
+                        ' (default %(default)s)')
+    parser.add_argument('--cache',
+                        nargs='?',
+                        const=pan_chainguard.util.default_cache_dir(),
+                        metavar='DIR',
+                        help='cache device certificate config in directory'
+                        ' (default %(const)s)')
     parser.add_argument('--admin',
                         help='commit admin')
     parser.add_argument('--xdebug',
@@ -28,11 +28,13 @@ sys.path[:0] = [os.path.join(libpath, os.pardir)]
 
 from pan_chainguard import title, __version__
 from pan_chainguard.ccadb import *
-from pan_chainguard.crtsh import ArgsError, CrtShApi
+from pan_chainguard.crtsh import (ArgsError, CrtShApi, TokenBucket,
+                                  backoff, retry_after)
 import pan_chainguard.mozilla
 import pan_chainguard.util
 
 MAX_TASKS = 3  # concurrent crt.sh API requests
+CRT_SH_RATE = None  # crt.sh API requests per second; None, no limit
 CRT_SH_TIMEOUT = 60
 
 args = None
@@ -51,6 +53,17 @@ async def main_loop():
     if not pan_chainguard.util.is_writable(args.certs_new):
         print('%s: not writable' % args.certs_new, file=sys.stderr)
         sys.exit(1)
+    if (args.manifest and
+       not pan_chainguard.util.is_writable(args.manifest)):
+        print('%s: not writable' % args.manifest, file=sys.stderr)
+        sys.exit(1)
+
+    if args.crtsh_tasks < 1:
+        print('--crtsh-tasks must be >= 1', file=sys.stderr)
+        sys.exit(1)
+    if args.crtsh_rate is not None and args.crtsh_rate <= 0:
+        print('--crtsh-rate must be > 0', file=sys.stderr)
+        sys.exit(1)
 
     fingerprints = []
     for x in args.fingerprints:
@@ -74,13 +87,30 @@ async def main_loop():
     certs_old = {}
     if args.certs_old:
         try:
-            certs_old = pan_chainguard.util.read_cert_archive(
+            certs_old = pan_chainguard.util.CertArchive(
                 path=args.certs_old)
         except pan_chainguard.util.UtilError as e:
             print(str(e), file=sys.stderr)
             sys.exit(1)
 
-    errors, certs = await get_certs(fingerprints, mozilla, certs_old)
+    cache = None
+    if args.cache:
+        try:
+            cache = pan_chainguard.util.CertificateCache(
+                path=os.path.join(args.cache, 'certs'))
+        except pan_chainguard.util.UtilError as e:
+            print('%s: %s' % (args.cache, e), file=sys.stderr)
+            sys.exit(1)
+
+    try:
+        errors, certs = await get_certs(fingerprints, mozilla, certs_old,
+                                        cache)
+    except pan_chainguard.util.UtilError as e:
+        print('%s: %s' % (args.certs_old, e), file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if args.certs_old:
+            certs_old.close()
 
     try:
         pan_chainguard.util.write_cert_archive(
@@ -89,16 +119,52 @@ async def main_loop():
         print(str(e), file=sys.stderr)
         sys.exit(1)
 
+    manifest = pan_chainguard.util.cert_archive_manifest(certs)
+    if args.manifest:
+        try:
+            with open(args.manifest, 'w') as f:
+                f.write('%s\n' % manifest)
+        except OSError as e:
+            print('%s: %s' % (args.manifest, e), file=sys.stderr)
+            sys.exit(1)
+
     if args.verbose:
         print('Total certs-new: %d' % len(certs))
+        if args.certs_old:
+            added, removed = pan_chainguard.util.cert_archive_diff(
+                certs_old, certs)
+            print('certs-new added: %d' % len(added))
+            print('certs-new removed: %d' % len(removed))
+            if args.debug > 1:
+                for x in added:
+                    print('added %s' % x, file=sys.stderr)
+                for x in removed:
+                    print('removed %s' % x, file=sys.stderr)
+        print('certs-new manifest: %s' % manifest)
 
     return 2 if errors else 0
 
 
-async def get_certs(fingerprints, mozilla, certs_old):
+def cache_put(cache, sha256, pem):
+    if cache is None:
+        return 0
+
+    try:
+        if cache.put(sha256=sha256, pem=pem):
+            return 1
+        print('cache: fingerprint mismatch %s' % sha256, file=sys.stderr)
+    except pan_chainguard.util.UtilError as e:
+        print('cache: %s' % e, file=sys.stderr)
+
+    return 0
+
+
+async def get_certs(fingerprints, mozilla, certs_old, cache=None):
     certs = {}
     crtsh_download = {}
     total_certs_old = 0
+    total_cache = 0
+    total_cached = 0
     total_mozilla = {
         'MozillaIntermediateCerts': 0,
         'PublicAllIntermediateCerts': 0,
@@ -116,14 +182,27 @@ async def get_certs(fingerprints, mozilla, certs_old):
         if sha256 in certs_old:
             total_certs_old += 1
             certs[sha256] = certs_old[sha256]
+            total_cached += cache_put(cache, sha256, certs[sha256][1])
             continue
 
+        if cache is not None:
+            try:
+                pem = cache.get(sha256=sha256)
+            except pan_chainguard.util.UtilError as e:
+                print('cache: %s' % e, file=sys.stderr)
+                pem = None
+            if pem is not None:
+                total_cache += 1
+                certs[sha256] = (cert_type, pem)
+                continue
+
         if cert_type == 'intermediate':
             for mozilla_certs in mozilla:
                 pem = mozilla_certs.get_cert_pem(sha256=sha256)
                 if pem is not None:
                     total_mozilla[mozilla_certs.name] += 1
                     certs[sha256] = (cert_type, pem)
+                    total_cached += cache_put(cache, sha256, pem)
                     break
             if sha256 in certs:
                 continue
@@ -134,12 +213,17 @@ async def get_certs(fingerprints, mozilla, certs_old):
     for sha256 in certificates:
         total_crtsh += 1
         certs[sha256] = (crtsh_download[sha256], certificates[sha256])
+        total_cached += cache_put(cache, sha256, certificates[sha256])
 
     if args.verbose:
         print('certs-old: %d' % total_certs_old)
+        if cache is not None:
+            print('cache: %d' % total_cache)
         for x in total_mozilla:
             print('%s: %d' % (x, total_mozilla[x]))
         print('crt.sh: %d' % total_crtsh)
+        if cache is not None:
+            print('cache added or present: %d' % total_cached)
 
     return errors, certs
 
@@ -147,7 +231,8 @@ async def get_certs(fingerprints, mozilla, certs_old):
 async def download(api, sha256):
     tries = 0
     MAX_TRIES = 5
-    RETRY_SLEEP = 5.0
+    RETRY_BASE = 2.0
+    RETRY_MAX = 60.0
 
     RETRY_STATUS = [
         429,  # Too Many Requests
@@ -158,30 +243,34 @@ async def download(api, sha256):
 
     while True:
         tries += 1
+        delay = backoff(tries, base=RETRY_BASE, cap=RETRY_MAX)
         try:
             if args.verbose and tries == 1:
                 print('Download using crt.sh API %s' % sha256)
 
             resp = await api.download(id=sha256)
 
-            if resp.status in RETRY_STATUS:
-                x = '%d %s %s' % (
-                    resp.status, resp.reason, sha256)
-                if tries == MAX_TRIES:
-                    print('no retry after try %d %s' % (tries, x),
-                          file=sys.stderr)
-                    x = 'download failed ' + x
+            try:
+                if resp.status in RETRY_STATUS:
+                    x = '%d %s %s' % (
+                        resp.status, resp.reason, sha256)
+                    wait = retry_after(resp)
+                    if wait is not None:
+                        delay = max(delay, min(wait, RETRY_MAX))
+                    if resp.status == 429 and api.limiter is not None:
+                        # slow down all workers, not just this one
+                        api.limiter.defer(delay)
+                    content = None
+                elif resp.status != 200:
+                    x = 'download failed %d %s %s' % (
+                        resp.status, resp.reason, sha256)
                     break
-                print('retry after try %d %s' % (tries, x),
-                      file=sys.stderr)
-                await asyncio.sleep(RETRY_SLEEP)
-            elif resp.status != 200:
-                x = 'download failed %d %s %s' % (
-                    resp.status, resp.reason, sha256)
-                break
-            else:
-                filename, content = await api.content(resp=resp)
+                else:
+                    filename, content = await api.content(resp=resp)
+            finally:
+                resp.release()
 
+            if content is not None:
                 start = '-----BEGIN CERTIFICATE-----'
                 end = '-----END CERTIFICATE-----\n'
                 if (content.startswith(start) and
@@ -191,33 +280,26 @@ async def download(api, sha256):
                     # XXX ephemeral?
                     x = 'content malformed %s %s' % (
                         sha256, content)
-                    if tries == MAX_TRIES:
-                        print('no retry after try %d %s' % (tries, x),
-                              file=sys.stderr)
-                        x = 'download failed ' + x
-                        break
-                    print('retry after try %d %s' % (tries, x),
-                          file=sys.stderr)
-                    await asyncio.sleep(RETRY_SLEEP)
 
         except (asyncio.TimeoutError,
                 asyncio.CancelledError,  # XXX
                 aiohttp.ClientError) as e:
             msg = e if str(e) else type(e).__name__
             x = 'CrtShApi: %s %s' % (msg, sha256)
-            if tries == MAX_TRIES:
-                print('no retry after try %d %s' % (tries, x),
-                      file=sys.stderr)
-                x = 'download failed ' + x
-                break
-            print('retry after try %d %s' % (tries, x),
-                  file=sys.stderr)
-            # no sleep
 
         except ArgsError as e:
             x = 'CrtShApi: %s' % e
             break
 
+        if tries == MAX_TRIES:
+            print('no retry after try %d %s' % (tries, x),
+                  file=sys.stderr)
+            x = 'download failed ' + x
+            break
+        print('retry after try %d %s, sleeping %.2fs' % (tries, x, delay),
+              file=sys.stderr)
+        await asyncio.sleep(delay)
+
     return None, x
 
 
@@ -225,8 +307,11 @@ async def get_cert_files(sha256):
     user_agent = '%s/%s' % (title, __version__)
     headers = {'user-agent': user_agent}
 
+    limiter = TokenBucket(rate=args.crtsh_rate, burst=args.crtsh_tasks)
+
     try:
-        api = CrtShApi(timeout=CRT_SH_TIMEOUT, headers=headers)
+        api = CrtShApi(timeout=CRT_SH_TIMEOUT, headers=headers,
+                       limiter=limiter)
     except ArgsError as e:
         print('CrtShApi: %s' % e, file=sys.stderr)
         sys.exit(1)
@@ -240,21 +325,43 @@ async def get_cert_files(sha256):
 
 async def download_certs(api, sha256):
     certificates = {}
-    tasks = []
     start = time.time()
-    total = 0
     errors = 0
 
+    queue = asyncio.Queue()
     for x in sha256:
-        total += 1
-        tasks.append(download(api, x))
+        queue.put_nowait(x)
+    total = queue.qsize()
+
+    # each worker takes the next fingerprint when its download is
+    # done; the limiter paces requests across all workers
+    async def worker():
+        nonlocal errors
 
-        if len(tasks) == MAX_TASKS:
-            errors += await run_tasks(tasks, certificates)
-            tasks = []
+        while True:
+            try:
+                x = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            content, result = await download(api, x)
+            if content is None:
+                # error
+                print(result, file=sys.stderr)
+                errors += 1
+            else:
+                certificates[result] = content
+
+            if args.debug > 1:
+                done = total - queue.qsize()
+                elapsed = time.time() - start
+                print('%d/%d tasks, elapsed %.2f seconds, '
+                      '%.2f tasks/sec' % (done, total, elapsed,
+                                          done / elapsed if elapsed else 0),
+                      file=sys.stderr)
 
-    if len(tasks):
-        errors += await run_tasks(tasks, certificates)
+    workers = min(args.crtsh_tasks, total)
+    await asyncio.gather(*[worker() for _ in range(workers)])
 
     if args.debug:
         end = time.time()
@@ -269,38 +376,6 @@ async def download_certs(api, sha256):
     return errors, certificates
 
 
-async def run_tasks(tasks, certificates):
-    INTERVAL_WAIT = 3.3  # random throttle sweet spot to avoid TimeoutError
-    errors = 0
-
-    if args.debug:
-        print('running %d tasks' % len(tasks),
-              file=sys.stderr)
-        start = time.time()
-
-    for coro in asyncio.as_completed(tasks):
-        content, sha256 = await coro
-        if content is None:
-            # error
-            print(sha256, file=sys.stderr)
-            errors += 1
-        else:
-            certificates[sha256] = content
-
-    if args.debug:
-        end = time.time()
-        elapsed = end - start
-        rate = len(tasks) / elapsed
-        rate2 = elapsed / len(tasks)
-        print('%d tasks complete, elapsed %.2f seconds, '
-              '%.2f tasks/sec, %.2f secs/task' %
-              (len(tasks), elapsed, rate, rate2), file=sys.stderr)
-        print('sleeping %.2fs' % INTERVAL_WAIT, file=sys.stderr)
-        await asyncio.sleep(INTERVAL_WAIT)
-
-    return errors
-
-
 def parse_args():
     parser = argparse.ArgumentParser(
         usage='%(prog)s [options]',
@@ -320,7 +395,30 @@ def parse_args():
     parser.add_argument('--certs-new',
                         required=True,
                         metavar='PATH',
-                        help='new certificate archive path')
+                        help='new certificate archive path'
+                        ' (.zip for zip format, else tar.gz)')
+    parser.add_argument('--manifest',
+                        metavar='PATH',
+                        help='write certs-new manifest digest to PATH')
+    parser.add_argument('--cache',
+                        nargs='?',
+                        const=pan_chainguard.util.default_cache_dir(),
+                        metavar='DIR',
+                        help='certificate cache directory'
+                        ' (default %(const)s)')
+    parser.add_argument('--crtsh-tasks',
+                        type=int,
+                        default=MAX_TASKS,
+                        metavar='N',
+                        help='concurrent crt.sh API requests'
+                        ' (default %(default)s)')
+    parser.add_argument('--crtsh-rate',
+                        type=float,
+                        default=CRT_SH_RATE,
+                        metavar='RATE',
+                        help='crt.sh API requests per second'
+                        ' (default no limit; a 429 response'
+                        ' delays all requests)')
     parser.add_argument('--verbose',
                         action='store_true',
                         help='enable verbosity')
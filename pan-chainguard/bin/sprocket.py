@@ -18,7 +18,7 @@
 
 import argparse
 import asyncio
-import csv
+from datetime import datetime, timezone
 import json
 import os
 import pprint
@@ -28,10 +28,13 @@ libpath = os.path.dirname(os.path.abspath(__file__))
 sys.path[:0] = [os.path.join(libpath, os.pardir)]
 
 from pan_chainguard import title, __version__
-from pan_chainguard.ccadb import (revoked, valid_from_to,
-                                  root_status_bits_flag, RootStatusBits,
-                                  root_trust_bits, TrustBits, TrustBitsMap2,
-                                  CcadbRootTrustSettings, CcadbError)
+from pan_chainguard.ccadb import (RootStatusBits, TrustBits, TrustBitsMap2,
+                                  ValidityBits, validity_message,
+                                  CcadbRootTrustSettings,
+                                  CcadbCertificateRecords, CcadbError)
+from pan_chainguard.policy import (SOURCES_MAP, Policy, PolicyColumns,
+                                   PolicyError, count, members,
+                                   sources_expression)
 import pan_chainguard.util
 
 
@@ -41,13 +44,9 @@ DEFAULT_POLICY = {
     'trust_bits': [],
 }
 
-SOURCES_MAP = {
-    'mozilla': RootStatusBits.MOZILLA,
-    'chrome': RootStatusBits.CHROME,
-    'google': RootStatusBits.CHROME,  # XXX deprecated
-    'apple': RootStatusBits.APPLE,
-    'microsoft': RootStatusBits.MICROSOFT,
-}
+SOURCES = [x for x in SOURCES_MAP if x != 'google']  # XXX deprecated
+ALL_SOURCES = (RootStatusBits.MOZILLA | RootStatusBits.CHROME |
+               RootStatusBits.APPLE | RootStatusBits.MICROSOFT).value
 
 args = None
 
@@ -64,7 +63,8 @@ def main():
 async def main_loop():
     certs = read_certs()
     root_trust_settings = get_trust_settings()
-    policy = get_policy()
+    policy = get_policy(args.policy)
+    compare = [get_policy(x) for x in args.compare]
 
     if args.debug > 1:
         print('total', len(certs), file=sys.stderr)
@@ -77,11 +77,14 @@ async def main_loop():
         stats(certs, root_trust_settings, policy)
         return
 
+    if compare:
+        compare_policies(certs, root_trust_settings, [policy] + compare)
+
     policy_certs = get_root_certs(certs, root_trust_settings, policy)
 
     if args.verbose:
         print("%s: %d total certificates" % (
-            ', '.join(policy['sources']), len(policy_certs)))
+            policy_name(policy), len(policy_certs)))
 
     if args.fingerprints is not None:
         write_fingerprints(policy_certs)
@@ -91,36 +94,35 @@ def read_certs():
     certs = {}
 
     try:
-        with open(args.ccadb, 'r', newline='') as csvfile:
-            reader = csv.DictReader(csvfile,
-                                    dialect='unix')
-            for row in reader:
-                if row['Certificate Record Type'] != 'Root Certificate':
-                    continue
-
-                sha256 = row['SHA-256 Fingerprint']
-                name = row['Certificate Name']
-
-                ret, err = revoked(row)
-                if ret:
-                    x = '%s %s %s' % (err, sha256, name)
-                    if args.debug > 2:
-                        print(x, file=sys.stderr)
-                    continue
-
-                ret, err = valid_from_to(row)
-                if not ret:
-                    x = '%s %s %s' % (err, sha256, name)
-                    if args.debug > 2:
-                        print(x, file=sys.stderr)
-                    continue
-
-                certs[sha256] = row
-
-    except OSError as e:
+        records = CcadbCertificateRecords(path=args.ccadb,
+                                          cache_dir=args.cache,
+                                          debug=args.debug > 1)
+    except CcadbError as e:
         print('%s: %s' % (args.ccadb, e), file=sys.stderr)
         sys.exit(1)
 
+    bits = records.bits()
+
+    for i, row in enumerate(records):
+        if row['Certificate Record Type'] != 'Root Certificate':
+            continue
+
+        sha256 = row['SHA-256 Fingerprint']
+        name = row['Certificate Name']
+
+        if bits.validity[i]:
+            err = validity_message(row, ValidityBits(bits.validity[i]))
+            x = '%s %s %s' % (err, sha256, name)
+            if args.debug > 2:
+                print(x, file=sys.stderr)
+            continue
+
+        certs[sha256] = (row,
+                         RootStatusBits(bits.root_status_bits[i]),
+                         TrustBits(bits.trust_bits[i]),
+                         bits.valid_from[i],
+                         bits.valid_to[i])
+
     return certs
 
 
@@ -138,53 +140,67 @@ def get_trust_settings():
     return settings
 
 
-def get_policy():
+def get_policy(arg):
     def isvalid(policy):
-        if not isinstance(policy['sources'], list):
-            x = '"sources" not list'
+        if 'expression' in policy:
+            if 'sources' in policy or 'operation' in policy:
+                return False, '"expression" with "sources" or "operation"'
+            if not isinstance(policy['expression'], str):
+                return False, '"expression" not string'
+        elif not isinstance(policy['sources'], list):
+            return False, '"sources" not list'
         elif not len(policy['sources']):
-            x = '"sources" empty'
+            return False, '"sources" empty'
         elif not all(item in SOURCES_MAP for item in policy['sources']):
-            x = 'Invalid "sources"'
+            return False, 'Invalid "sources"'
         elif policy['operation'] not in ['union', 'intersection']:
-            x = 'Invalid "operation"'
-        elif not all(item in TrustBitsMap2
-                     for item in policy['trust_bits']):
-            x = 'Invalid "trust_bits"'
-        else:
-            return True, None
+            return False, 'Invalid "operation"'
+
+        if not all(item in TrustBitsMap2
+                   for item in policy['trust_bits']):
+            return False, 'Invalid "trust_bits"'
+
+        try:
+            compile_policy(policy)
+        except PolicyError as e:
+            return False, str(e)
 
-        return False, x
+        return True, None
 
-    if args.policy is None:
+    if arg is None:
         return DEFAULT_POLICY
 
-    if os.path.isfile(args.policy):
+    if os.path.isfile(arg):
         try:
-            with open(args.policy, 'r') as f:
+            with open(arg, 'r') as f:
                 x = json.load(f)
         except (OSError, ValueError) as e:
-            print('%s: %s' % (args.policy, e), file=sys.stderr)
+            print('%s: %s' % (arg, e), file=sys.stderr)
             sys.exit(1)
 
     else:
         try:
-            x = json.loads(args.policy)
+            x = json.loads(arg)
         except ValueError as e:
-            print('%s: %s' % (e, args.policy), file=sys.stderr)
+            print('%s: %s' % (e, arg), file=sys.stderr)
             sys.exit(1)
 
-    if 'sources' not in x:
-        x['sources'] = DEFAULT_POLICY['sources']
-    if 'operation' not in x:
-        x['operation'] = DEFAULT_POLICY['operation']
+    if not isinstance(x, dict):
+        print('Policy not JSON object: %s' % arg, file=sys.stderr)
+        sys.exit(1)
+
+    if 'expression' not in x:
+        if 'sources' not in x:
+            x['sources'] = DEFAULT_POLICY['sources']
+        if 'operation' not in x:
+            x['operation'] = DEFAULT_POLICY['operation']
     if 'trust_bits' not in x:
         x['trust_bits'] = DEFAULT_POLICY['trust_bits']
 
     ret, e = isvalid(x)
 
     if not ret:
-        msg = '%s: ' % args.policy if os.path.isfile(args.policy) else ''
+        msg = '%s: ' % arg if os.path.isfile(arg) else ''
         msg += '%s: %s' % (e, x)
         print(msg, file=sys.stderr)
         sys.exit(1)
@@ -192,130 +208,162 @@ def get_policy():
     return x
 
 
-def get_certs(certs, root_trust_settings, policy):
-    certs_ = []
+def compile_policy(policy, root_trust_settings=None):
+    if 'expression' in policy:
+        return Policy(policy['expression'])
 
-    for row in certs.values():
-        sha256 = row['SHA-256 Fingerprint']
+    # with root trust settings, a source only includes the roots with
+    # server authentication trust in that source
+    trust_bits = ['SERVER_AUTHENTICATION'] if root_trust_settings else []
 
-        if policy_match(policy, root_trust_settings, row):
-            certs_.append(sha256)
+    return Policy(sources_expression(policy['sources'],
+                                     policy['operation'],
+                                     trust_bits))
 
-    return certs_
 
+def policy_name(policy):
+    if 'expression' in policy:
+        return policy['expression']
 
-def get_all_sources(certs, root_trust_settings, policy):
-    sources = {}
-    for x in SOURCES_MAP.keys():
-        if x == 'google':
-            # XXX deprecated
-            continue
-        policy_ = {
-            'sources': [x],
-            'trust_bits': policy['trust_bits'],
-            'operation': policy['operation'],
-        }
-        source_certs = get_certs(certs, root_trust_settings, policy_)
-        sources[x] = source_certs
+    return ', '.join(policy['sources'])
 
-    return sources
 
+def source_masks(certs, root_trust_settings, policy):
+    """Return {sha256: mask} of the sources matching each root.
 
-def stats(certs, root_trust_settings, policy):
-    sources = get_all_sources(certs, root_trust_settings, policy)
+    The mask is the RootStatusBits of the sources which include the
+    root with policy trust bits.  Per-source trust bits from root
+    trust settings are applied by the compiled policy.
+    """
+    want = TrustBits.NONE
+    for x in policy['trust_bits']:
+        want |= TrustBitsMap2[x]
+    want = want.value
 
-    sets = []
-    for x in sources.keys():
-        print("%s: %d total certificates" % (x, len(sources[x])))
-        sets.append(set(sources[x]))
+    masks = {}
+    for sha256, (row, status_bits, trust_bits, _, _) in certs.items():
+        if args.debug > 1:
+            print(row['Certificate Name'],
+                  'status_bits', status_bits,
+                  'trust_bits', trust_bits, file=sys.stderr)
 
-    x = ', '.join(sources.keys())
+        mask = status_bits.value & ALL_SOURCES
+        bits = trust_bits.value
+        if bits and bits & want != want:
+            mask = 0
 
-    intersection = set.intersection(*sets)
-    print('%s: %d total certificates in all (intersection)' % (
-        x, len(intersection)))
+        if mask and root_trust_settings and args.debug:
+            status_bits2 = root_trust_settings.root_status_bits_flag(
+                sha256=sha256)
+            if status_bits2 != status_bits:
+                print(f'AllCertificateRecords {status_bits} != '
+                      f'AllIncludedRootCerts {status_bits2} {sha256}',
+                      file=sys.stderr)
 
-    union = set.union(*sets)
-    print('%s: %d total certificates in any (union)' % (
-        x, len(union)))
+        if args.debug > 1 and not mask:
+            print('no match', row['Certificate Name'], sha256,
+                  file=sys.stderr)
 
+        masks[sha256] = mask
 
-def get_root_certs(certs, root_trust_settings, policy):
-    sources = get_all_sources(certs, root_trust_settings, policy)
+    return masks
 
-    sets = []
-    for x in policy['sources']:
-        k = 'chrome' if x == 'google' else x  # XXX deprecated
-        sets.append(set(sources[k]))
 
-    if policy['operation'] == 'union':
-        result = set.union(*sets)
-    elif policy['operation'] == 'intersection':
-        result = set.intersection(*sets)
-    else:
-        assert False, 'Invalid operation: %s' % policy['operation']
+def stats(certs, root_trust_settings, policy):
+    def sources_policy(sources, operation):
+        return {
+            'sources': sources,
+            'operation': operation,
+            'trust_bits': policy['trust_bits'],
+        }
 
-    return result
+    policies = [sources_policy([x], 'union') for x in SOURCES]
+    policies.append(sources_policy(SOURCES, 'intersection'))
+    policies.append(sources_policy(SOURCES, 'union'))
+    result = evaluate_policies(certs, root_trust_settings, policies)
 
+    for x, bits in zip(SOURCES, result):
+        print("%s: %d total certificates" % (x, count(bits)))
 
-def policy_match(policy, root_trust_settings, row):
-    def sources_match(status_bits, source):
-        if SOURCES_MAP[source] in status_bits:
-            return True
-        return False
+    x = ', '.join(SOURCES)
 
-    def trust_bits_match(bits_cert, bits_pol):
-        if bits_cert == TrustBits.NONE:
-            return True
+    print('%s: %d total certificates in all (intersection)' % (
+        x, count(result[-2])))
 
-        for x in bits_pol:
-            if TrustBitsMap2[x] not in bits_cert:
-                return False
-        return True
+    print('%s: %d total certificates in any (union)' % (
+        x, count(result[-1])))
+
+
+def policy_columns(certs, root_trust_settings, policy, trust_sources):
+    masks = source_masks(certs, root_trust_settings, policy)
+
+    valid_from = [x[3] for x in certs.values()]
+    valid_to = [x[4] for x in certs.values()]
+
+    trust_bits = {}
+    if root_trust_settings:
+        for x in trust_sources:
+            func = getattr(root_trust_settings, '%s_trust_bits' % x)
+            trust_bits[x] = []
+            for sha256 in certs:
+                bits = func(sha256=sha256)
+                trust_bits[x].append(0 if bits is None else bits.value)
+
+    return PolicyColumns(sources=list(masks.values()),
+                         valid_from=valid_from,
+                         valid_to=valid_to,
+                         today=datetime.now(timezone.utc).toordinal(),
+                         trust_bits=trust_bits)
+
+
+def evaluate_policies(certs, root_trust_settings, policies):
+    """Return the int bitset of the roots matching each policy.
+
+    Bit i is set for the ith root in certs; the columns are shared
+    by the policies with the same trust bits.
+    """
+    compiled = [compile_policy(x, root_trust_settings) for x in policies]
+    trust_sources = set()
+    for x in compiled:
+        trust_sources |= x.trust_sources
+
+    columns = {}
+    result = []
+    for policy, func in zip(policies, compiled):
+        key = tuple(sorted(policy['trust_bits']))
+        if key not in columns:
+            columns[key] = policy_columns(certs, root_trust_settings,
+                                          policy, trust_sources)
+        try:
+            result.append(func(columns[key]))
+        except PolicyError as e:
+            print('%s: %s' % (e, policy), file=sys.stderr)
+            sys.exit(1)
 
-    certificate_name = row['Certificate Name']
-    sha256 = row['SHA-256 Fingerprint']
+    return result
 
-    status_bits = root_status_bits_flag(row)
-    trust_bits = root_trust_bits(row)
 
-    if args.debug > 1:
-        print(certificate_name,
-              'status_bits', status_bits,
-              'trust_bits', trust_bits, file=sys.stderr)
-
-    assert len(policy["sources"]) == 1, (
-        f"Must be single source: {policy['sources']}"
-    )
-
-    if (sources_match(status_bits, policy['sources'][0]) and
-       trust_bits_match(trust_bits, policy['trust_bits'])):
-        if root_trust_settings:
-            MAP = {
-                'mozilla': root_trust_settings.mozilla_trust_bits,
-                'chrome': root_trust_settings.chrome_trust_bits,
-                'apple': root_trust_settings.apple_trust_bits,
-                'microsoft': root_trust_settings.microsoft_trust_bits,
-            }
-
-            if args.debug:
-                status_bits2 = root_trust_settings.root_status_bits_flag(
-                    sha256=sha256)
-                if status_bits2 != status_bits:
-                    print(f'AllCertificateRecords {status_bits} != '
-                          f'AllIncludedRootCerts {status_bits2} {sha256}',
-                          file=sys.stderr)
-
-            bits = MAP[policy['sources'][0]](sha256=sha256)
-            if TrustBits.SERVER_AUTHENTICATION in bits:
-                return True
-        else:
-            return True
+def get_root_certs(certs, root_trust_settings, policy):
+    bits, = evaluate_policies(certs, root_trust_settings, [policy])
+    sha256 = list(certs)
+
+    return [sha256[i] for i in members(bits)]
 
-    if args.debug > 1:
-        print('no match', certificate_name, sha256, file=sys.stderr)
 
-    return False
+def compare_policies(certs, root_trust_settings, policies):
+    result = evaluate_policies(certs, root_trust_settings, policies)
+    first = result[0]
+
+    print('%7s %7s %7s %7s  %s' % ('total', 'common', 'added', 'removed',
+                                   'policy'))
+    for i, (policy, bits) in enumerate(zip(policies, result)):
+        if i == 0:
+            x = ('',) * 3
+        else:
+            x = (count(bits & first), count(bits & ~first),
+                 count(first & ~bits))
+        x += (compile_policy(policy, root_trust_settings).expression,)
+        print('%7d %7s %7s %7s  %s' % ((count(bits),) + x))
 
 
 def write_fingerprints(policy_certs):
@@ -354,9 +402,21 @@ def parse_args():
     parser.add_argument('--policy',
                         metavar='JSON',
                         help='JSON policy object path or string')
+    parser.add_argument('--compare',
+                        action='append',
+                        default=[],
+                        metavar='JSON',
+                        help='compare policy with JSON policy object'
+                        ' path or string')
     parser.add_argument('--stats',
                         action='store_true',
                         help='print source stats')
+    parser.add_argument('--cache',
+                        nargs='?',
+                        const=pan_chainguard.util.default_cache_dir(),
+                        metavar='DIR',
+                        help='cache parsed CCADB snapshot in directory'
+                        ' (default %(const)s)')
     parser.add_argument('--verbose',
                         action='store_true',
                         help='enable verbosity')
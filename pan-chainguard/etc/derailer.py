@@ -41,12 +41,16 @@ libpath = os.path.dirname(os.path.abspath(__file__))
 sys.path[:0] = [os.path.join(libpath, os.pardir)]
 
 from pan_chainguard import title, __version__
-from pan_chainguard.ccadb import revoked, valid_from, valid_to
+from pan_chainguard.ccadb import (revoked, valid_from, valid_to,
+                                  CcadbCertificateRecords, CcadbError)
+from pan_chainguard.fetch import HttpCache, FetchError, OFFLINE
+import pan_chainguard.util
 
 DOWNLOAD_TIMEOUT = 5
 
 args = None
 downloads = {}
+sources = {}
 
 
 def main():
@@ -66,13 +70,34 @@ async def main_loop():
             for x in v:
                 print(k, x.__name__, x.url, file=sys.stderr)
 
+    if args.offline and not args.cache:
+        print('--offline requires --cache', file=sys.stderr)
+        sys.exit(1)
+
+    http_cache = None
+    if args.cache:
+        try:
+            http_cache = HttpCache(path=os.path.join(args.cache, 'http'))
+        except FetchError as e:
+            print('%s: %s' % (args.cache, e), file=sys.stderr)
+            sys.exit(1)
+
     vendors_ = set(args.vendor)
-    timeout = aiohttp.ClientTimeout(total=DOWNLOAD_TIMEOUT)
+    # a cached download streams the body; time out idle reads
+    timeout = (aiohttp.ClientTimeout(total=None,
+                                     sock_connect=DOWNLOAD_TIMEOUT,
+                                     sock_read=DOWNLOAD_TIMEOUT)
+               if http_cache is not None else
+               aiohttp.ClientTimeout(total=DOWNLOAD_TIMEOUT))
 
     async with aiohttp.ClientSession(timeout=timeout) as session:
         urls = set([x.url for vendor in vendors_
                     for x in vendors[vendor]])
-        tasks = [download(session, url) for url in urls]
+        if http_cache is not None:
+            tasks = [download_cache(session, http_cache, url)
+                     for url in urls]
+        else:
+            tasks = [download(session, url) for url in urls]
         await asyncio.gather(*tasks)
 
     if args.debug > 1:
@@ -137,6 +162,25 @@ async def download(session, url):
         downloads[url] = False, x
 
 
+async def download_cache(session, http_cache, url):
+    try:
+        path, status = await http_cache.fetch(session, url,
+                                              offline=args.offline)
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            content = f.read()
+    except (FetchError, OSError) as e:
+        downloads[url] = False, str(e)
+        return
+
+    if args.verbose:
+        x = {
+            OFFLINE: 'Using cached',
+            304: 'Not modified, using cached',
+        }.get(status, 'Downloaded')
+        print(f'{x} {len(content)} bytes from {url}')
+    downloads[url] = True, content
+
+
 def pem_cert_fingerprint(data: bytes) -> Optional[str]:
     try:
         with warnings.catch_warnings(record=True) as w:
@@ -161,20 +205,40 @@ def pem_cert_fingerprint(data: bytes) -> Optional[str]:
         return
 
 
+def pem_fingerprints(pems: list) -> list:
+    """SHA-256 fingerprints of PEM certificates, None on error.
+
+    The fingerprint is the hash of the decoded DER; the certificate is
+    only parsed to report cryptography warnings with --debug.
+    """
+    if args.debug:
+        return [pem_cert_fingerprint(x.encode()) for x in pems]
+
+    fingerprints = [pan_chainguard.util.pem_sha256(x) for x in pems]
+
+    for pem, sha256 in zip(pems, fingerprints):
+        if sha256 is None:
+            pem_sha256 = hashlib.sha256(pem.encode()).hexdigest().upper()
+            print('Failed to decode cert. PEM blob SHA256', pem_sha256,
+                  file=sys.stderr)
+
+    return fingerprints
+
+
 def load_ccadb(path):
-    ccadb = defaultdict(list)
     try:
-        with open(path, 'r', newline='') as csvfile:
-            reader = csv.DictReader(csvfile,
-                                    dialect='unix')
-            for row in reader:
-                sha256 = row['SHA-256 Fingerprint']
-                ccadb[sha256].append(row)
-
-    except OSError as e:
+        records = CcadbCertificateRecords(path=path,
+                                          cache_dir=args.cache,
+                                          debug=args.debug > 1)
+    except CcadbError as e:
         print('%s: %s' % (path, e), file=sys.stderr)
         sys.exit(1)
 
+    ccadb = defaultdict(list)
+    for row in records:
+        sha256 = row['SHA-256 Fingerprint']
+        ccadb[sha256].append(row)
+
     return ccadb
 
 
@@ -244,27 +308,92 @@ def save(path, fingerprints):
     return hashlib.sha256(data.encode()).hexdigest()
 
 
-def websites_trusted(vendor, row):
-    def mozilla(row):
-        ret = (row['Mozilla Status'] == 'Included' and
-               'Websites' in row['Mozilla Trust Bits'].split(';'))
-        return ret
+WEBSITES_TRUSTED = {
+    # vendor: (status column, trust bits column, trust bit)
+    'mozilla': ('Mozilla Status', 'Mozilla Trust Bits', 'Websites'),
+    'microsoft': ('Microsoft Status', 'Microsoft EKUs',
+                  'Server Authentication'),
+    'chrome': ('Google Chrome Status', None, None),
+    'apple': ('Apple Status', 'Apple Trust Bits', 'serverAuth'),
+}
 
-    def microsoft(row):
-        ret = (row['Microsoft Status'] == 'Included' and
-               'Server Authentication' in row['Microsoft EKUs'].split(';'))
-        return ret
 
-    def chrome(row):
-        ret = row['Google Chrome Status'] == 'Included'
-        return ret
+def csv_columns(data: str) -> dict:
+    reader = csv.reader(data.splitlines())
+    header = next(reader, [])
+    rows = list(reader)
 
-    def apple(row):
-        ret = (row['Apple Status'] == 'Included' and
-               'serverAuth' in row['Apple Trust Bits'].split(';'))
-        return ret
+    columns = {}
+    for i, name in enumerate(header):
+        columns[name] = [row[i] if i < len(row) else None
+                         for row in rows]
 
-    return locals()[vendor](row)
+    return columns
+
+
+def source(func) -> Optional[dict]:
+    """Downloaded CSV for func.url as columns, parsed once per URL."""
+    url = func.url
+    r, data = downloads[url]
+    if not r:
+        print(f'{func.__name__}: {data}', file=sys.stderr)
+        return
+
+    if url not in sources:
+        sources[url] = {'columns': csv_columns(data)}
+
+    return sources[url]['columns']
+
+
+def missing_columns(func, columns: dict, names: list) -> bool:
+    """Print an error for func if a CSV column is missing."""
+    missing = [x for x in names if x is not None and x not in columns]
+    if missing:
+        print(f'{func.__name__}: missing column '
+              f'{", ".join(repr(x) for x in missing)}', file=sys.stderr)
+        return True
+
+    return False
+
+
+def websites_trusted(func, vendor: str) -> Optional[list]:
+    """Websites trusted root fingerprints for vendor; the vendors in
+    WEBSITES_TRUSTED are evaluated in one pass over the CSV rows."""
+    columns = source(func)
+    if columns is None:
+        return
+
+    x = sources[func.url]
+    if 'websites_trusted' not in x:
+        trusted = {}
+        tests = []
+        sha256 = columns.get('SHA-256 Fingerprint', [])
+        for vendor_, (status, bits, bit) in WEBSITES_TRUSTED.items():
+            # not all CSV reports have columns for all vendors
+            if ('SHA-256 Fingerprint' not in columns or
+               status not in columns or
+               (bits is not None and bits not in columns)):
+                continue
+            trusted[vendor_] = []
+            tests.append((columns[status],
+                          columns[bits] if bits is not None else None,
+                          bit, trusted[vendor_]))
+
+        for i in range(len(sha256)):
+            for status, bits, bit, fingerprints in tests:
+                if (status[i] == 'Included' and
+                   (bits is None or bit in bits[i].split(';'))):
+                    fingerprints.append(sha256[i])
+
+        x['websites_trusted'] = trusted
+
+    fingerprints = x['websites_trusted'].get(vendor)
+    if fingerprints is None:
+        status, bits, _ = WEBSITES_TRUSTED[vendor]
+        missing_columns(func, columns,
+                        ['SHA-256 Fingerprint', status, bits])
+
+    return fingerprints
 
 
 def set_url(url):
@@ -277,40 +406,18 @@ def set_url(url):
 @set_url('https://ccadb.my.salesforce-sites.com/ccadb/'
          'AllIncludedRootCertsCSV')
 def mozilla_0() -> Optional[list]:
-    url = mozilla_0.url
-    r, data = downloads[url]
-    if not r:
-        print(f'{mozilla_0.__name__}: {data}', file=sys.stderr)
-        return
-
-    reader = csv.DictReader(data.splitlines())
-
-    fingerprints = []
-    for row in reader:
-        if websites_trusted('mozilla', row):
-            fingerprints.append(row['SHA-256 Fingerprint'])
-
-    return fingerprints
+    return websites_trusted(mozilla_0, 'mozilla')
 
 
 @set_url('https://ccadb.my.salesforce-sites.com/mozilla/'
          'IncludedRootsDistrustTLSSSLPEMCSV?TrustBitsInclude=Websites')
 def mozilla_1() -> Optional[list]:
-    url = mozilla_1.url
-    r, data = downloads[url]
-    if not r:
-        print(f'{mozilla_1.__name__}: {data}', file=sys.stderr)
+    columns = source(mozilla_1)
+    if columns is None or missing_columns(mozilla_1, columns, ['PEM']):
         return
 
-    reader = csv.DictReader(data.splitlines())
-
-    fingerprints = []
-    for row in reader:
-        pem = row.get('PEM')
-        if pem:
-            fingerprint = pem_cert_fingerprint(pem.encode())
-            if fingerprint is not None:
-                fingerprints.append(fingerprint)
+    pems = [x for x in columns['PEM'] if x]
+    fingerprints = [x for x in pem_fingerprints(pems) if x is not None]
 
     return fingerprints
 
@@ -318,40 +425,18 @@ def mozilla_1() -> Optional[list]:
 @set_url('https://ccadb.my.salesforce-sites.com/ccadb/'
          'AllIncludedRootCertsCSV')
 def microsoft_0() -> Optional[list]:
-    url = microsoft_0.url
-    r, data = downloads[url]
-    if not r:
-        print(f'{microsoft_0.__name__}: {data}', file=sys.stderr)
-        return
-
-    reader = csv.DictReader(data.splitlines())
-
-    fingerprints = []
-    for row in reader:
-        if websites_trusted('microsoft', row):
-            fingerprints.append(row['SHA-256 Fingerprint'])
-
-    return fingerprints
+    return websites_trusted(microsoft_0, 'microsoft')
 
 
 @set_url('https://ccadb.my.salesforce-sites.com/microsoft/'
          'IncludedRootsPEMCSVForMSFT?MicrosoftEKUs=Server Authentication')
 def microsoft_1() -> Optional[list]:
-    url = microsoft_1.url
-    r, data = downloads[url]
-    if not r:
-        print(f'{microsoft_1.__name__}: {data}', file=sys.stderr)
+    columns = source(microsoft_1)
+    if columns is None or missing_columns(microsoft_1, columns, ['PEM']):
         return
 
-    reader = csv.DictReader(data.splitlines())
-
-    fingerprints = []
-    for row in reader:
-        pem = row.get('PEM')
-        if pem:
-            fingerprint = pem_cert_fingerprint(pem.encode())
-            if fingerprint is not None:
-                fingerprints.append(fingerprint)
+    pems = [x for x in columns['PEM'] if x]
+    fingerprints = [x for x in pem_fingerprints(pems) if x is not None]
 
     return fingerprints
 
@@ -359,45 +444,13 @@ def microsoft_1() -> Optional[list]:
 @set_url('https://ccadb.my.salesforce-sites.com/microsoft/'
          'IncludedCACertificateReportForMSFTCSV')
 def microsoft_2() -> Optional[list]:
-    url = microsoft_2.url
-    r, data = downloads[url]
-    if not r:
-        print(f'{microsoft_2.__name__}: {data}', file=sys.stderr)
-        return
-
-    reader = csv.DictReader(data.splitlines())
-
-    fingerprints = []
-    for row in reader:
-        status = row['Microsoft Status']
-        if status != 'Included':
-            continue
-        sha256 = row['SHA-256 Fingerprint']
-        trust_bits = row['Microsoft EKUs'].split(';')
-        if 'Server Authentication' not in trust_bits:
-            continue
-        fingerprints.append(sha256)
-
-    return fingerprints
+    return websites_trusted(microsoft_2, 'microsoft')
 
 
 @set_url('https://ccadb.my.salesforce-sites.com/ccadb/'
          'AllIncludedRootCertsCSV')
 def chrome_0() -> Optional[list]:
-    url = chrome_0.url
-    r, data = downloads[url]
-    if not r:
-        print(f'{chrome_0.__name__}: {data}', file=sys.stderr)
-        return
-
-    reader = csv.DictReader(data.splitlines())
-
-    fingerprints = []
-    for row in reader:
-        if websites_trusted('chrome', row):
-            fingerprints.append(row['SHA-256 Fingerprint'])
-
-    return fingerprints
+    return websites_trusted(chrome_0, 'chrome')
 
 
 @set_url('https://raw.githubusercontent.com/chromium/chromium/'
@@ -419,11 +472,7 @@ def chrome_1() -> Optional[list]:
         for m in matches
     ]
 
-    fingerprints = []
-    for pem in certs:
-        fingerprint = pem_cert_fingerprint(pem.encode())
-        if fingerprint is not None:
-            fingerprints.append(fingerprint)
+    fingerprints = [x for x in pem_fingerprints(certs) if x is not None]
 
     return fingerprints
 
@@ -431,20 +480,7 @@ def chrome_1() -> Optional[list]:
 @set_url('https://ccadb.my.salesforce-sites.com/ccadb/'
          'AllIncludedRootCertsCSV')
 def apple_0() -> Optional[list]:
-    url = apple_0.url
-    r, data = downloads[url]
-    if not r:
-        print(f'{apple_0.__name__}: {data}', file=sys.stderr)
-        return
-
-    reader = csv.DictReader(data.splitlines())
-
-    fingerprints = []
-    for row in reader:
-        if websites_trusted('apple', row):
-            fingerprints.append(row['SHA-256 Fingerprint'])
-
-    return fingerprints
+    return websites_trusted(apple_0, 'apple')
 
 
 vendors = {
@@ -475,6 +511,16 @@ def parse_args():
                         metavar='PATH',
                         type=Path,
                         help='CCADB all certificate information CSV path')
+    parser.add_argument('--cache',
+                        nargs='?',
+                        const=pan_chainguard.util.default_cache_dir(),
+                        metavar='DIR',
+                        type=Path,
+                        help='cache parsed CCADB snapshot and downloads'
+                        ' in directory (default %(const)s)')
+    parser.add_argument('--offline',
+                        action='store_true',
+                        help='use cached downloads only')
     parser.add_argument('--verbose',
                         action='store_true',
                         help='enable verbosity')
@@ -23,11 +23,19 @@
 # All Included Root Certificate Trust Bit Settings:
 # https://ccadb.my.salesforce-sites.com/ccadb/AllIncludedRootCertsCSV
 
+from array import array
+from collections.abc import Mapping
 import csv
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone
 from enum import Flag, auto
+import glob
+import hashlib
+import io
+import json
+import os
 import sys
-from typing import Dict, List, Tuple, Union, Optional
+import tempfile
+from typing import Dict, Iterator, List, Tuple, Union, Optional
 
 
 class CcadbError(Exception):
@@ -42,6 +50,7 @@ __all__ = [
     'derived_trust_bits_list', 'derived_trust_bits',
     'root_trust_bits_list', 'root_trust_bits',
     'RootStatusBits', 'root_status_bits_flag', 'root_status_bits',
+    'ValidityBits', 'validity_message',
 ]
 
 
@@ -86,6 +95,14 @@ RootStatusBitsMap = {
 }
 
 
+class ValidityBits(Flag):
+    NONE = 0
+    REVOKED = auto()
+    NOT_YET_VALID = auto()
+    EXPIRED = auto()
+    INVALID_DATE = auto()
+
+
 def _now():
     now = datetime.now(timezone.utc)
 
@@ -118,17 +135,39 @@ def valid_to(row: Dict[str, str]) -> Tuple[bool, Union[str, None]]:
 
 
 def valid_from_to(row: Dict[str, str]) -> Tuple[bool, Union[str, None]]:
-    return valid_from(row) and valid_to(row)
+    ret, err = valid_from(row)
+    if not ret:
+        return ret, err
+
+    return valid_to(row)
+
+
+_NOT_REVOKED = frozenset(['', 'Not Revoked'])
 
 
 def revoked(row: Dict[str, str]) -> Tuple[bool, Union[str, None]]:
     k = 'Revocation Status'
-    if row[k] not in ['', 'Not Revoked']:
+    if row[k] not in _NOT_REVOKED:
         return True, row[k]
 
     return False, None
 
 
+def validity_message(row: Dict[str, str],
+                     bits: ValidityBits) -> Optional[str]:
+    if ValidityBits.REVOKED in bits:
+        return row['Revocation Status']
+    if ValidityBits.INVALID_DATE in bits:
+        return 'Invalid date (valid from "%s", valid to "%s")' % (
+            row['Valid From (GMT)'], row['Valid To (GMT)'])
+    if ValidityBits.NOT_YET_VALID in bits:
+        return 'Not yet valid (valid from %s)' % row['Valid From (GMT)']
+    if ValidityBits.EXPIRED in bits:
+        return 'Expired (valid to %s)' % row['Valid To (GMT)']
+
+    return None
+
+
 def _trust_bits_list(key: str, row: Dict[str, str]) -> List[str]:
     x = row[key]
     if not x:
@@ -370,3 +409,493 @@ class CcadbRootTrustSettings:
         bits = trust_bits_flag(values)
 
         return bits
+
+
+# AllCertificateRecords columns used by pan-chainguard; other columns
+# are not retained.
+_RECORDS_COLUMNS = (
+    'SHA-256 Fingerprint',
+    'Certificate Name',
+    'Certificate Record Type',
+    'Parent SHA-256 Fingerprint',
+    'Parent Certificate Name',
+    'Salesforce Record ID',
+    'Revocation Status',
+    'Valid From (GMT)',
+    'Valid To (GMT)',
+    'Derived Trust Bits',
+    'Trust Bits for Root Cert',
+    'Status of Root Cert',
+    'Mozilla Status',
+    'Apple Status',
+    'Chrome Status',
+    'Microsoft Status',
+)
+_RECORDS_REQUIRED = (
+    'SHA-256 Fingerprint',
+    'Certificate Record Type',
+)
+_RECORDS_DATES = (
+    'Valid From (GMT)',
+    'Valid To (GMT)',
+)
+_SNAPSHOT_PREFIX = 'AllCertificateRecords-'
+_SNAPSHOT_FORMAT = 'pan-chainguard-ccadb'
+_SNAPSHOT_VERSION = 2
+_MAX_ORDINAL = date.max.toordinal()
+
+
+def _date_to_ordinal(x: str) -> Optional[int]:
+    # YYYY.MM.DD
+    if not x:
+        return None
+    if len(x) != 10 or x[4] != '.' or x[7] != '.':
+        raise ValueError('Invalid date: "%s"' % x)
+    return date(int(x[0:4]), int(x[5:7]), int(x[8:10])).toordinal()
+
+
+def _ordinal_to_date(x: Optional[int]) -> str:
+    if x is None:
+        return ''
+    return date.fromordinal(x).strftime('%Y.%m.%d')
+
+
+class CcadbRecord(Mapping):
+    """Read-only view of one AllCertificateRecords row.
+
+    Values are looked up by CCADB column name, as with a
+    csv.DictReader row, and are read from the shared store; only the
+    projected columns are available.  full_row() returns every column
+    of the CSV row.
+    """
+
+    __slots__ = ('_records', '_index')
+
+    def __init__(self, records: 'CcadbCertificateRecords', index: int):
+        self._records = records
+        self._index = index
+
+    def __getitem__(self, key: str) -> str:
+        records = self._records
+        i = records._column_index[key]
+        x = records._rows[self._index][i]
+        if key in _RECORDS_DATES:
+            if x is None and records._invalid_dates:
+                return records._invalid_dates.get((self._index, i), '')
+            return records._date(x)
+
+        return x
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._records.columns)
+
+    def __len__(self) -> int:
+        return len(self._records.columns)
+
+    def __repr__(self) -> str:
+        return '%s(%r)' % (self.__class__.__name__, self.to_dict())
+
+    def to_dict(self) -> Dict[str, str]:
+        return dict(self.items())
+
+    def full_row(self) -> Dict[str, str]:
+        return self._records.full_row(self._index)
+
+
+class CcadbRecordBits:
+    """Validity, trust and root status bits for all records.
+
+    Computed in a single pass over a CcadbCertificateRecords store
+    using one fixed time; each attribute is indexed as the store:
+
+      validity: ValidityBits
+      trust_bits: TrustBits, from "Trust Bits for Root Cert" for a
+        root and "Derived Trust Bits" for an intermediate
+      root_status_bits: RootStatusBits, NONE for an intermediate
+      valid_from, valid_to: date ordinal, None for a missing or
+        malformed date
+
+    The bits are arrays of int Flag values.
+
+    A record with no Valid From or Valid To date is not limited by
+    the missing date.
+    """
+
+    def __init__(self, records: 'CcadbCertificateRecords', *,
+                 now: Optional[datetime] = None):
+        if now is None:
+            now = _now()
+        now = now.astimezone(timezone.utc)
+        self.now = now
+
+        # fractional day number; compares with date ordinals as
+        # valid_from() and valid_to() compare with midnight
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        days = now.toordinal() + (now - midnight).total_seconds() / 86400
+
+        self.validity = array('B')
+        self.trust_bits = array('H')
+        self.root_status_bits = array('B')
+        self.valid_from = []
+        self.valid_to = []
+
+        columns = records._column_index
+
+        def index(key):
+            return columns.get(key)
+
+        i_type = index('Certificate Record Type')
+        i_revoked = index('Revocation Status')
+        i_from = index('Valid From (GMT)')
+        i_to = index('Valid To (GMT)')
+        i_derived = index('Derived Trust Bits')
+        i_root_bits = index('Trust Bits for Root Cert')
+        vendors = [(index(k), v.value) for k, v in RootStatusBitsMap.items()
+                   if index(k) is not None]
+
+        REVOKED = ValidityBits.REVOKED.value
+        NOT_YET_VALID = ValidityBits.NOT_YET_VALID.value
+        EXPIRED = ValidityBits.EXPIRED.value
+
+        trust_bits = {'': 0}
+
+        def trust(x):
+            try:
+                return trust_bits[x]
+            except KeyError:
+                trust_bits[x] = trust_bits_flag(x.split(';')).value
+                return trust_bits[x]
+
+        for row in records._rows:
+            bits = 0
+            if i_revoked is not None and row[i_revoked] not in _NOT_REVOKED:
+                bits |= REVOKED
+            x = None if i_from is None else row[i_from]
+            if x is not None and days < x:
+                bits |= NOT_YET_VALID
+            self.valid_from.append(x)
+            x = None if i_to is None else row[i_to]
+            if x is not None and x < days:
+                bits |= EXPIRED
+            self.valid_to.append(x)
+            self.validity.append(bits)
+
+            cert_type = row[i_type]
+            if cert_type == 'Root Certificate':
+                self.trust_bits.append(
+                    0 if i_root_bits is None else trust(row[i_root_bits]))
+                bits = 0
+                for i, v in vendors:
+                    if row[i] == 'Included':
+                        bits |= v
+                self.root_status_bits.append(bits)
+            else:
+                if cert_type == 'Intermediate Certificate':
+                    self.trust_bits.append(
+                        0 if i_derived is None else trust(row[i_derived]))
+                else:
+                    self.trust_bits.append(0)
+                self.root_status_bits.append(0)
+
+        for i, _ in records._invalid_dates:
+            self.validity[i] |= ValidityBits.INVALID_DATE.value
+
+
+class CcadbCertificateRecords:
+    """AllCertificateRecords CSV parsed once into a compact store.
+
+    Only the columns in _RECORDS_COLUMNS are kept, repeated values
+    share a single string object and the Valid From/To dates are
+    stored as date ordinals; a malformed date is stored as None, and
+    the row is marked INVALID_DATE by bits().  When cache_dir is
+    specified a JSON snapshot of the store, keyed by the SHA-256 and
+    size of the CSV, is saved there and used by later runs instead of
+    parsing the CSV.  The snapshot is validated when loaded.
+    """
+
+    def __init__(self, *,
+                 path: str,
+                 cache_dir: Optional[str] = None,
+                 debug: bool = False):
+        self._debug = debug
+        self.path = path
+        self.snapshot = None
+        self.columns = ()
+        self._column_index = {}
+        self._rows = []
+        self._invalid_dates = {}
+        self._dates = {}
+        self._full_rows = None
+
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+        except OSError as e:
+            raise CcadbError(str(e))
+
+        self._key = (hashlib.sha256(content).hexdigest(), len(content))
+
+        if cache_dir is not None:
+            self.snapshot = os.path.join(
+                cache_dir, '%s%s.json' % (_SNAPSHOT_PREFIX, self._key[0]))
+            if self._load_snapshot():
+                return
+
+        self._parse(content)
+
+        if cache_dir is not None:
+            self._save_snapshot(cache_dir)
+
+    def _set_columns(self, columns: Tuple[str, ...]):
+        self.columns = columns
+        self._column_index = {k: i for i, k in enumerate(columns)}
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __iter__(self) -> Iterator[CcadbRecord]:
+        for i in range(len(self._rows)):
+            yield CcadbRecord(self, i)
+
+    def row(self, index: int) -> CcadbRecord:
+        if not -len(self._rows) <= index < len(self._rows):
+            raise IndexError('record index out of range')
+
+        return CcadbRecord(self, index % len(self._rows))
+
+    def bits(self, *, now: Optional[datetime] = None) -> CcadbRecordBits:
+        return CcadbRecordBits(self, now=now)
+
+    def _date(self, x: Optional[int]) -> str:
+        try:
+            return self._dates[x]
+        except KeyError:
+            self._dates[x] = _ordinal_to_date(x)
+            return self._dates[x]
+
+    def full_row(self, index: int) -> Dict[str, str]:
+        # All columns are only needed rarely, so the CSV is parsed
+        # again on first use.
+        if self._full_rows is None:
+            self._full_rows = self._read_full_rows()
+
+        return self._full_rows[index]
+
+    def _read_full_rows(self) -> List[Dict[str, str]]:
+        try:
+            with open(self.path, 'rb') as f:
+                content = f.read()
+        except OSError as e:
+            raise CcadbError(str(e))
+
+        if (hashlib.sha256(content).hexdigest(), len(content)) != self._key:
+            raise CcadbError('CSV changed since loaded')
+
+        reader = csv.DictReader(io.TextIOWrapper(io.BytesIO(content),
+                                                 encoding='utf-8',
+                                                 newline=''),
+                                dialect='unix')
+        rows = list(reader)
+        if len(rows) != len(self._rows):
+            raise CcadbError('CSV row count mismatch')
+
+        return rows
+
+    def _parse(self, content: bytes):
+        # decode incrementally; avoids a full copy of the CSV as str
+        reader = csv.reader(io.TextIOWrapper(io.BytesIO(content),
+                                             encoding='utf-8',
+                                             newline=''),
+                            dialect='unix')
+        try:
+            self._parse_rows(reader)
+        except UnicodeDecodeError as e:
+            raise CcadbError(str(e))
+
+    def _parse_rows(self, reader):
+        try:
+            header = next(reader)
+        except StopIteration:
+            raise CcadbError('empty CSV')
+
+        for x in _RECORDS_REQUIRED:
+            if x not in header:
+                raise CcadbError('missing column "%s"' % x)
+
+        self._set_columns(tuple(x for x in _RECORDS_COLUMNS if x in header))
+        indexes = [header.index(x) for x in self.columns]
+        dates = [i for i, x in enumerate(self.columns)
+                 if x in _RECORDS_DATES]
+
+        values = {}
+        rows = []
+        invalid_dates = {}
+        for fields in reader:
+            if not fields:
+                continue
+            row = [values.setdefault(fields[i], fields[i])
+                   for i in indexes]
+            for i in dates:
+                try:
+                    row[i] = _date_to_ordinal(row[i])
+                except ValueError:
+                    invalid_dates[(len(rows), i)] = row[i]
+                    row[i] = None
+            rows.append(tuple(row))
+
+        self._rows = rows
+        self._invalid_dates = invalid_dates
+
+        if self._debug and invalid_dates:
+            print('%s: %d invalid dates' % (self.path, len(invalid_dates)),
+                  file=sys.stderr)
+
+        if self._debug:
+            print('%s: parsed %d rows, %d distinct values' % (
+                self.path, len(rows), len(values)), file=sys.stderr)
+
+    def _load_snapshot(self) -> bool:
+        try:
+            with open(self.snapshot, 'rb') as f:
+                x = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            if self._debug:
+                print('%s: %s' % (self.snapshot, e), file=sys.stderr)
+            return False
+
+        if (not isinstance(x, dict) or
+           x.get('format') != _SNAPSHOT_FORMAT or
+           x.get('version') != _SNAPSHOT_VERSION or
+           x.get('key') != list(self._key)):
+            if self._debug:
+                print('%s: stale snapshot' % self.snapshot, file=sys.stderr)
+            return False
+
+        try:
+            columns, rows, invalid_dates = self._decode_snapshot(x)
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            if self._debug:
+                print('%s: invalid snapshot: %s' % (self.snapshot, e),
+                      file=sys.stderr)
+            return False
+
+        self._set_columns(columns)
+        self._rows = rows
+        self._invalid_dates = invalid_dates
+
+        if self._debug:
+            print('%s: loaded %d rows from %s' % (
+                self.path, len(self._rows), self.snapshot), file=sys.stderr)
+
+        return True
+
+    @staticmethod
+    def _decode_snapshot(x: dict) -> tuple:
+        # column-major: each column is a list of indexes into values,
+        # or of date ordinals and nulls for a date column
+        columns = x['columns']
+        values = x['values']
+        data = x['data']
+        if (not isinstance(columns, list) or
+           not all(isinstance(c, str) for c in columns) or
+           len(set(columns)) != len(columns) or
+           not set(columns) <= set(_RECORDS_COLUMNS) or
+           not set(_RECORDS_REQUIRED) <= set(columns)):
+            raise ValueError('invalid columns')
+        if (not isinstance(values, list) or
+           not set(map(type, values)) <= {str}):
+            raise ValueError('invalid values')
+        if (not isinstance(data, list) or len(data) != len(columns) or
+           not all(isinstance(c, list) for c in data) or
+           len(set(map(len, data))) > 1):
+            raise ValueError('invalid data')
+
+        dates = frozenset(i for i, c in enumerate(columns)
+                          if c in _RECORDS_DATES)
+        decoded = []
+        for i, column in enumerate(data):
+            if i in dates:
+                ordinals = [v for v in column if v is not None]
+                if (not set(map(type, ordinals)) <= {int} or
+                   ordinals and (min(ordinals) < 1 or
+                                 max(ordinals) > _MAX_ORDINAL)):
+                    raise ValueError('invalid date column %d' % i)
+                decoded.append(column)
+            else:
+                if (not set(map(type, column)) <= {int} or
+                   column and min(column) < 0):
+                    raise ValueError('invalid column %d' % i)
+                # IndexError for an index past the end of values
+                decoded.append(list(map(values.__getitem__, column)))
+        rows = list(zip(*decoded))
+
+        invalid_dates = {}
+        for row, column, value in x['invalid_dates']:
+            if (type(row) is not int or not 0 <= row < len(rows) or
+               column not in dates or not isinstance(value, str) or
+               rows[row][column] is not None):
+                raise ValueError('invalid date entry')
+            invalid_dates[(row, column)] = value
+
+        return tuple(columns), rows, invalid_dates
+
+    def _save_snapshot(self, cache_dir: str):
+        index = {}
+        values = []
+
+        def value(v):
+            try:
+                return index[v]
+            except KeyError:
+                index[v] = len(values)
+                values.append(v)
+                return index[v]
+
+        data = []
+        for i, c in enumerate(self.columns):
+            column = [row[i] for row in self._rows]
+            if c not in _RECORDS_DATES:
+                column = list(map(value, column))
+            data.append(column)
+
+        x = {
+            'format': _SNAPSHOT_FORMAT,
+            'version': _SNAPSHOT_VERSION,
+            'key': list(self._key),
+            'columns': list(self.columns),
+            'values': values,
+            'data': data,
+            'invalid_dates': [[row, column, v] for (row, column), v
+                              in sorted(self._invalid_dates.items())],
+        }
+
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(x, f, separators=(',', ':'))
+                os.replace(tmp, self.snapshot)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        except OSError as e:
+            # the snapshot is an optimisation only
+            print('%s: %s' % (self.snapshot, e), file=sys.stderr)
+            return
+
+        # remove snapshots of previous CSV versions
+        pattern = os.path.join(glob.escape(cache_dir),
+                               '%s*' % _SNAPSHOT_PREFIX)
+        for x in glob.glob(pattern):
+            if x != self.snapshot:
+                try:
+                    os.unlink(x)
+                except OSError:
+                    pass
+
+        if self._debug:
+            print('%s: saved snapshot %s' % (
+                self.path, self.snapshot), file=sys.stderr)
@@ -17,6 +17,12 @@
 # crt.sh API interface
 
 import aiohttp
+import asyncio
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import random
+import time
+from typing import Optional
 
 URL = 'https://crt.sh'
 
@@ -25,11 +31,94 @@ class ArgsError(Exception):
     pass
 
 
+class TokenBucket:
+    """Token bucket request rate limiter.
+
+    Tokens are added at rate per second up to burst; acquire()
+    waits for and takes one token.  Waiters are served in order.
+    defer() holds back all requests, for example for the
+    Retry-After delay of a 429 response.  With rate None there is
+    no steady limit and only defer() holds back requests.
+    """
+
+    def __init__(self, *,
+                 rate: Optional[float],
+                 burst: int = 1):
+        if rate is not None and rate <= 0:
+            raise ArgsError('rate must be > 0')
+        if burst < 1:
+            raise ArgsError('burst must be >= 1')
+
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._not_before = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._not_before:
+                    await asyncio.sleep(self._not_before - now)
+                    continue
+                if self.rate is None:
+                    return
+
+                self._tokens = min(self.burst,
+                                   self._tokens +
+                                   (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def defer(self, delay: float):
+        now = time.monotonic()
+        self._not_before = max(self._not_before, now + delay)
+        self._tokens = 0.0
+        self._last = max(self._last, self._not_before)
+
+
+def retry_after(resp) -> Optional[float]:
+    """Retry-After response header as seconds, None if absent/invalid."""
+    x = resp.headers.get('Retry-After')
+    if x is None:
+        return None
+
+    x = x.strip()
+    if x.isdigit():
+        return float(x)
+
+    try:
+        date = parsedate_to_datetime(x)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff(tries: int, *,
+            base: float,
+            cap: float) -> float:
+    """Exponential backoff with full jitter for retry number tries."""
+    x = min(cap, base * 2 ** (tries - 1))
+
+    return random.uniform(0, x)
+
+
 class CrtShApi:
     def __init__(self, *,
                  timeout=None,
-                 headers=None):
+                 headers=None,
+                 limiter: Optional[TokenBucket] = None):
         self.url = URL
+        self.limiter = limiter
 
         if isinstance(timeout, tuple):
             if len(timeout) != 2:
@@ -81,6 +170,9 @@ class CrtShApi:
             'data': data,
         }
 
+        if self.limiter is not None:
+            await self.limiter.acquire()
+
         resp = await self.session.post(**kwargs)
 
         return resp
@@ -0,0 +1,141 @@
+#
+# Copyright (c) 2024 Palo Alto Networks, Inc.
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+# HTTP GET with an on-disk cache keyed by URL.
+#
+# For each URL the cache directory has <key>.body, the response body,
+# and <key>.json, the URL and the ETag and Last-Modified response
+# headers, where key is the SHA-256 of the URL.  Cached URLs are
+# fetched with a conditional request and a 304 (Not Modified)
+# response uses the cached body.
+
+import aiohttp
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+from typing import Optional
+
+CHUNK_SIZE = 64 * 1024
+
+# status for a cached body used without a request
+OFFLINE = 0
+
+
+class FetchError(Exception):
+    pass
+
+
+class HttpCache:
+    def __init__(self, *, path: str):
+        self.path = path
+
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError as e:
+            raise FetchError(str(e))
+
+    def _paths(self, url: str) -> tuple:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        x = os.path.join(self.path, key)
+        return x + '.body', x + '.json'
+
+    def cached(self, url: str) -> Optional[dict]:
+        """Cache metadata for url, or None if not cached."""
+        body, meta = self._paths(url)
+        try:
+            with open(meta, 'r') as f:
+                x = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if x.get('url') != url or not os.path.isfile(body):
+            return None
+        x['path'] = body
+
+        return x
+
+    async def fetch(self, session: aiohttp.ClientSession, url: str, *,
+                    offline: bool = False) -> tuple:
+        """GET url; return (body path, HTTP status or OFFLINE).
+
+        The body is streamed to the cache; status is 304 when the
+        cached body is unchanged.  With offline, only the cache is
+        used.
+        """
+        cached = self.cached(url)
+
+        if offline:
+            if cached is None:
+                raise FetchError('not in cache: %s' % url)
+            return cached['path'], OFFLINE
+
+        headers = {}
+        if cached is not None:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        body, meta = self._paths(url)
+        try:
+            async with session.get(url, headers=headers) as resp:
+                if resp.status == 304 and cached is not None:
+                    return cached['path'], resp.status
+                if resp.status != 200:
+                    raise FetchError('status code %d %s: %s' % (
+                        resp.status, resp.reason, url))
+
+                x = {
+                    'url': url,
+                    'etag': resp.headers.get('ETag'),
+                    'last_modified': resp.headers.get('Last-Modified'),
+                }
+                await self._write(resp, body)
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise FetchError('%s: %s' % (str(e) or type(e).__name__, url))
+        except OSError as e:
+            raise FetchError(str(e))
+
+        try:
+            self._replace(meta, json.dumps(x).encode())
+        except OSError as e:
+            raise FetchError(str(e))
+
+        return body, resp.status
+
+    async def _write(self, resp: aiohttp.ClientResponse, path: str):
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                    f.write(chunk)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def _replace(self, path: str, data: bytes):
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
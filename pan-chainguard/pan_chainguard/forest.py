@@ -0,0 +1,259 @@
+#
+# Copyright (c) 2024 Palo Alto Networks, Inc.
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+# Certificate forest: a tree with the 'Root' node (identifier 0) as
+# the parent of all root certificates, stored as arrays indexed by
+# node number instead of per-node objects.
+#
+# Compact tree format: a header line followed by one line per node
+# (excluding the 'Root' node), parent before child:
+#   ["identifier","parent","tag"]<TAB>data-JSON
+# JSON escapes control characters in strings so the first TAB ends
+# the node fields; the data is only decoded when accessed.
+
+from array import array
+import json
+from typing import (Any, Callable, Iterator, List, Optional, TextIO,
+                    Union)
+
+Identifier = Union[str, int]
+
+ROOT = 0
+
+
+COMPACT_HEADER = '{"format":"pan-chainguard-tree","version":1}'
+
+
+class ForestError(Exception):
+    pass
+
+
+class _Encoded(str):
+    __slots__ = ()
+
+
+class _LazyData(list):
+    """List of node data; _Encoded JSON items decode on first access."""
+
+    def __getitem__(self, i):
+        x = super().__getitem__(i)
+        if isinstance(x, _Encoded):
+            try:
+                x = json.loads(x)
+            except ValueError as e:
+                raise ForestError('Malformed node data: %s' % e)
+            self[i] = x
+        return x
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class Forest:
+    """Certificate tree backed by parallel arrays.
+
+    Nodes are numbered in insertion order; node 0 is the 'Root'
+    node.  identifiers, tags and data are lists and parents is an
+    array of node numbers (-1 for node 0).  Children are kept in
+    insertion order; traversals order them by tag, matching
+    treelib's default ordering.
+    """
+
+    def __init__(self):
+        self.identifiers = [ROOT]
+        self.tags = ['Root']
+        self.data = _LazyData([None])
+        self.parents = array('i', [-1])
+        self.children = [[]]
+        self._index = {ROOT: 0}
+
+    def __len__(self) -> int:
+        return len(self.identifiers)
+
+    def __contains__(self, identifier: Identifier) -> bool:
+        return identifier in self._index
+
+    def index(self, identifier: Identifier) -> int:
+        try:
+            return self._index[identifier]
+        except KeyError:
+            raise ForestError('Node "%s" not in forest' % identifier)
+
+    def add(self, identifier: Identifier, *,
+            tag: str,
+            data: Any = None,
+            parent: Identifier = ROOT) -> int:
+        if identifier in self._index:
+            raise ForestError('Duplicate node "%s"' % identifier)
+        parent_index = self.index(parent)
+
+        i = len(self.identifiers)
+        self._index[identifier] = i
+        self.identifiers.append(identifier)
+        self.tags.append(tag)
+        self.data.append(data)
+        self.parents.append(parent_index)
+        self.children.append([])
+        self.children[parent_index].append(i)
+
+        return i
+
+    def parent(self, i: int) -> Optional[int]:
+        x = self.parents[i]
+        return None if x < 0 else x
+
+    def sorted_children(self, i: int,
+                        key: Optional[Callable[[int], Any]] = None,
+                        ) -> List[int]:
+        if key is None:
+            key = self.tags.__getitem__
+        return sorted(self.children[i], key=key)
+
+    def subtree(self, identifier: Identifier,
+                key: Optional[Callable[[int], Any]] = None,
+                ) -> Iterator[int]:
+        """Yield node numbers of a subtree in depth-first pre-order."""
+        stack = [self.index(identifier)]
+        while stack:
+            i = stack.pop()
+            yield i
+            stack.extend(reversed(self.sorted_children(i, key)))
+
+    def levels(self, identifier: Identifier = ROOT,
+               key: Optional[Callable[[int], Any]] = None,
+               ) -> Iterator[tuple]:
+        """Yield (node number, depth, is last child) in pre-order."""
+        stack = [(self.index(identifier), 0, True)]
+        while stack:
+            i, depth, last = stack.pop()
+            yield i, depth, last
+            children = self.sorted_children(i, key)
+            n = len(children)
+            stack.extend((x, depth + 1, j == n - 1)
+                         for j, x in reversed(list(enumerate(children))))
+
+    def show(self, identifier: Identifier = ROOT,
+             key: Optional[Callable[[int], Any]] = None) -> str:
+        """Text drawing of a subtree in treelib show() format."""
+        lines = []
+        lasts = []
+        for i, depth, last in self.levels(identifier, key):
+            if depth == 0:
+                lines.append(self.tags[i])
+                continue
+            del lasts[depth - 1:]
+            leading = ''.join('    ' if x else '│   '
+                              for x in lasts)
+            corner = '└── ' if last else '├── '
+            lines.append(leading + corner + self.tags[i])
+            lasts.append(last)
+
+        return ''.join(x + '\n' for x in lines)
+
+    def to_dict(self) -> dict:
+        """Same format as pan_chainguard.util.tree_to_dict()."""
+        nodes = []
+
+        for i, identifier in enumerate(self.identifiers):
+            parent = self.parents[i]
+            x = {
+                'identifier': identifier,
+                'tag': self.tags[i],
+                'data': self.data[i],
+                'parent': None if parent < 0 else self.identifiers[parent],
+            }
+            nodes.append(x)
+
+        return {'nodes': nodes}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Forest':
+        root = {
+            'identifier': ROOT,
+            'tag': 'Root',
+            'parent': None,
+            'data': None,
+        }
+
+        if (not isinstance(data, dict) or
+           'nodes' not in data or
+           not data['nodes'] or
+           data['nodes'][0] != root):
+            raise ForestError('Malformed tree dict')
+
+        forest = cls()
+        try:
+            for x in data['nodes'][1:]:
+                forest.add(x['identifier'],
+                           tag=x['tag'],
+                           data=x['data'],
+                           parent=x['parent'])
+        except (KeyError, TypeError) as e:
+            raise ForestError('Malformed tree dict: %s' % e)
+
+        return forest
+
+    def dump_compact(self, f: TextIO, *,
+                     default: Optional[Callable[[Any], Any]] = None):
+        f.write(COMPACT_HEADER + '\n')
+        for i in range(1, len(self.identifiers)):
+            head = json.dumps([self.identifiers[i],
+                               self.identifiers[self.parents[i]],
+                               self.tags[i]],
+                              separators=(',', ':'))
+            data = json.dumps(self.data[i], separators=(',', ':'),
+                              default=default)
+            f.write(head + '\t' + data + '\n')
+
+    @classmethod
+    def load_compact(cls, f: TextIO) -> 'Forest':
+        if f.readline().rstrip('\n') != COMPACT_HEADER:
+            raise ForestError('Not a compact tree')
+
+        return cls._load_compact_nodes(f)
+
+    @classmethod
+    def _load_compact_nodes(cls, f: TextIO) -> 'Forest':
+        forest = cls()
+        for n, line in enumerate(f, start=2):
+            head, tab, data = line.rstrip('\n').partition('\t')
+            try:
+                identifier, parent, tag = json.loads(head)
+                if not tab:
+                    raise ValueError('missing data')
+                forest.add(identifier, tag=tag,
+                           data=_Encoded(data),
+                           parent=parent)
+            except (ValueError, TypeError, ForestError) as e:
+                raise ForestError('Malformed compact tree line %d: %s' % (
+                    n, e))
+
+        return forest
+
+    @classmethod
+    def load(cls, f: TextIO) -> 'Forest':
+        """Load a tree in compact or tree dict JSON format."""
+        first = f.readline()
+        if first.rstrip('\n') == COMPACT_HEADER:
+            return cls._load_compact_nodes(f)
+
+        try:
+            data = json.loads(first + f.read())
+        except ValueError as e:
+            raise ForestError(str(e))
+
+        return cls.from_dict(data)
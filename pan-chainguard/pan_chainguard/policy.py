@@ -0,0 +1,330 @@
+#
+# Copyright (c) 2024 Palo Alto Networks, Inc.
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+# Root store policy expressions.
+#
+#   expr    := term ('or' term)*
+#   term    := factor ('and' factor)*
+#   factor  := 'not' factor | '(' expr ')' | source | compare
+#   source  := SOURCE ['[' TRUST_BIT (',' TRUST_BIT)* ']']
+#   compare := FIELD ('<' | '<=' | '>' | '>=' | '==' | '!=') INTEGER
+#
+# SOURCE is a vendor root store name, TRUST_BIT a TrustBits name and
+# FIELD one of:
+#   valid_days: days until Valid To
+#   age_days: days since Valid From
+#
+# An expression is compiled once to a function of PolicyColumns which
+# returns the matching roots as an int bitset, bit i set for root i,
+# so each operator is evaluated for all roots with one int operation.
+
+import operator
+import re
+from typing import Callable, Dict, List, Optional, Sequence
+
+from pan_chainguard.ccadb import RootStatusBits, TrustBitsMap2
+
+SOURCES_MAP = {
+    'mozilla': RootStatusBits.MOZILLA,
+    'chrome': RootStatusBits.CHROME,
+    'google': RootStatusBits.CHROME,  # XXX deprecated
+    'apple': RootStatusBits.APPLE,
+    'microsoft': RootStatusBits.MICROSOFT,
+}
+
+FIELDS = ['valid_days', 'age_days']
+
+_OPERATORS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+_TOKEN = re.compile(r'\s*(?:(<=|>=|==|!=|[<>()\[\],])|(-?\d+)|(\w+))')
+
+
+class PolicyError(Exception):
+    pass
+
+
+def bitset(values: Sequence[bool]) -> int:
+    """Return an int with bit i set for each true values[i]."""
+    x = ''.join('1' if v else '0' for v in reversed(values))
+    return int(x, 2) if x else 0
+
+
+def count(bits: int) -> int:
+    return bin(bits).count('1')
+
+
+def members(bits: int) -> List[int]:
+    """Return the indexes of the bits set, in ascending order."""
+    x = bin(bits)[:1:-1]
+    return [i for i, v in enumerate(x) if v == '1']
+
+
+class PolicyColumns:
+    """Per-root columns a compiled policy is evaluated over.
+
+      sources: RootStatusBits value of the sources including the root
+      valid_from, valid_to: date ordinal or None
+      today: date ordinal
+      trust_bits: {source: TrustBits value} for each source trust
+        bits are used with; from root trust settings
+
+    Each column bitset is computed on first use.
+    """
+
+    def __init__(self, *,
+                 sources: Sequence[int],
+                 valid_from: Sequence[Optional[int]],
+                 valid_to: Sequence[Optional[int]],
+                 today: int,
+                 trust_bits: Optional[Dict[str, Sequence[int]]] = None):
+        if not len(sources) == len(valid_from) == len(valid_to):
+            raise PolicyError('column length mismatch')
+
+        self.sources = sources
+        self.valid_from = valid_from
+        self.valid_to = valid_to
+        self.today = today
+        self.trust_bits = {} if trust_bits is None else trust_bits
+        self.all = (1 << len(sources)) - 1
+        self._bitsets = {}
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
+    def _cached(self, key: tuple, func: Callable[[], int]) -> int:
+        try:
+            return self._bitsets[key]
+        except KeyError:
+            self._bitsets[key] = func()
+            return self._bitsets[key]
+
+    def source(self, bit: int) -> int:
+        return self._cached(('source', bit), lambda: bitset(
+            [x & bit for x in self.sources]))
+
+    def trust(self, source: str, want: int) -> int:
+        if source not in self.trust_bits:
+            raise PolicyError('"%s[...]" requires root trust settings' %
+                              source)
+
+        return self._cached(('trust', source, want), lambda: bitset(
+            [x & want == want for x in self.trust_bits[source]]))
+
+    def compare(self, field: str, op: str, value: int) -> int:
+        if field not in FIELDS:
+            raise PolicyError('Invalid field: %s' % field)
+        func = _OPERATORS[op]
+
+        def compare():
+            if field == 'valid_days':
+                days = [None if x is None else x - self.today
+                        for x in self.valid_to]
+            else:
+                days = [None if x is None else self.today - x
+                        for x in self.valid_from]
+
+            # a missing date never matches
+            return bitset([x is not None and func(x, value) for x in days])
+
+        return self._cached(('compare', field, op, value), compare)
+
+
+def _tokens(expression: str) -> List[str]:
+    tokens = []
+    pos = 0
+    end = len(expression.rstrip())
+    while pos < end:
+        m = _TOKEN.match(expression, pos)
+        if m is None:
+            raise PolicyError('Invalid expression at "%s"' %
+                              expression[pos:].strip())
+        tokens.append(m.group(m.lastindex))
+        pos = m.end()
+
+    return tokens
+
+
+class Policy:
+    """A policy expression compiled to a function of PolicyColumns.
+
+    trust_sources is the set of sources the expression uses trust
+    bits with.
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.trust_sources = set()
+        self._tokens = _tokens(expression)
+        self._pos = 0
+
+        if not self._tokens:
+            raise PolicyError('Empty expression')
+
+        self._func = self._expr()
+        if self._pos < len(self._tokens):
+            self._error('Unexpected')
+        del self._tokens
+
+    def __call__(self, columns: PolicyColumns) -> int:
+        return self._func(columns)
+
+    def __repr__(self) -> str:
+        return 'Policy(%r)' % self.expression
+
+    def _error(self, msg: str):
+        if self._pos < len(self._tokens):
+            x = '"%s"' % self._tokens[self._pos]
+        else:
+            x = 'end'
+        raise PolicyError('%s %s in expression: %s' % (
+            msg, x, self.expression))
+
+    def _peek(self) -> Optional[str]:
+        if self._pos < len(self._tokens):
+            return self._tokens[self._pos]
+
+    def _next(self) -> str:
+        x = self._peek()
+        if x is None:
+            self._error('Unexpected')
+        self._pos += 1
+        return x
+
+    def _expect(self, token: str):
+        if self._peek() != token:
+            self._error('Expected "%s", got' % token)
+        self._pos += 1
+
+    def _expr(self):
+        funcs = [self._term()]
+        while self._peek() == 'or':
+            self._pos += 1
+            funcs.append(self._term())
+
+        if len(funcs) == 1:
+            return funcs[0]
+
+        def func(columns):
+            bits = 0
+            for x in funcs:
+                bits |= x(columns)
+            return bits
+
+        return func
+
+    def _term(self):
+        funcs = [self._factor()]
+        while self._peek() == 'and':
+            self._pos += 1
+            funcs.append(self._factor())
+
+        if len(funcs) == 1:
+            return funcs[0]
+
+        def func(columns):
+            bits = columns.all
+            for x in funcs:
+                bits &= x(columns)
+            return bits
+
+        return func
+
+    def _factor(self):
+        x = self._peek()
+
+        if x == 'not':
+            self._pos += 1
+            f = self._factor()
+            return lambda columns: columns.all & ~f(columns)
+
+        if x == '(':
+            self._pos += 1
+            f = self._expr()
+            self._expect(')')
+            return f
+
+        if x in SOURCES_MAP:
+            return self._source()
+
+        if x in FIELDS:
+            return self._compare()
+
+        self._error('Unexpected')
+
+    def _source(self):
+        name = self._next()
+        bit = SOURCES_MAP[name].value
+        source = 'chrome' if name == 'google' else name
+
+        if self._peek() != '[':
+            return lambda columns: columns.source(bit)
+
+        self._pos += 1
+        want = 0
+        while True:
+            x = self._peek()
+            if x not in TrustBitsMap2:
+                self._error('Invalid trust bit')
+            want |= TrustBitsMap2[x].value
+            self._pos += 1
+            if self._peek() != ',':
+                break
+            self._pos += 1
+        self._expect(']')
+        self.trust_sources.add(source)
+
+        return lambda columns: (columns.source(bit) &
+                                columns.trust(source, want))
+
+    def _compare(self):
+        field = self._next()
+        op = self._peek()
+        if op not in _OPERATORS:
+            self._error('Expected comparison operator, got')
+        self._pos += 1
+        x = self._peek()
+        try:
+            value = int(x)
+        except (TypeError, ValueError):
+            self._error('Expected integer, got')
+        self._pos += 1
+
+        return lambda columns: columns.compare(field, op, value)
+
+
+def sources_expression(sources: List[str], operation: str,
+                       trust_bits: Sequence[str] = ()) -> str:
+    """Return the expression for a list of sources and set operation.
+
+    With trust_bits each source only includes the roots with the
+    trust bits in the root trust settings of that source.
+    """
+    if trust_bits:
+        sources = ['%s[%s]' % (x, ', '.join(trust_bits)) for x in sources]
+
+    if operation == 'union':
+        return ' or '.join(sources)
+    elif operation == 'intersection':
+        return ' and '.join(sources)
+    else:
+        raise PolicyError('Invalid operation: %s' % operation)
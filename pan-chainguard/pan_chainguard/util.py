@@ -14,15 +14,24 @@
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 #
 
+import base64
+import binascii
+import bisect
 from collections import defaultdict
+from collections.abc import Mapping
 import csv
+import gzip
+import hashlib
 import io
 import os
 import re
 import tarfile
-import time
+import tempfile
+import zipfile
 import treelib
-from typing import Dict, List, Tuple, Union
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from pan_chainguard.forest import Forest
 
 NAME_PREFIX = 'LINK-'
 NAME_RE = r'^%s%s$' % (NAME_PREFIX, '[A-F0-9]{26,26}')
@@ -54,48 +63,312 @@ def is_writable(path: str) -> bool:
         return os.access(parent_dir, os.W_OK)
 
 
-def read_cert_archive(*, path: str) -> Dict[str, Tuple[str, str]]:
-    def parse_name(name):
-        pat = (r'^(intermediate|root)/'
-               r'[0-9A-F]{64,64}\.pem$')
-        if not re.search(pat, name):
-            e = 'malformed path in archive: %s' % name
-            raise UtilError(e)
-        type_, pem = os.path.split(name)
-        sha256 = pem[:64]
-
-        return type_, sha256
-
-    data = {}
+def default_cache_dir() -> str:
+    x = os.environ.get('XDG_CACHE_HOME')
+    if not x:
+        x = os.path.join(os.path.expanduser('~'), '.cache')
+
+    return os.path.join(x, 'pan-chainguard')
+
+
+_PEM_RE = re.compile(rb'-----BEGIN CERTIFICATE-----(.+?)'
+                     rb'-----END CERTIFICATE-----', re.DOTALL)
+
+
+def _der_sequence(der: bytes) -> bool:
+    """True if der is a single DER SEQUENCE (tag and length only)."""
+    if len(der) < 2 or der[0] != 0x30:
+        return False
+
+    if der[1] < 0x80:
+        header, length = 2, der[1]
+    elif 0x81 <= der[1] <= 0x84:
+        header = 2 + (der[1] & 0x7f)
+        length = int.from_bytes(der[2:header], 'big')
+    else:
+        return False
+
+    return header + length == len(der)
+
+
+def pem_sha256(pem: Union[str, bytes]) -> Optional[str]:
+    """SHA-256 fingerprint of the DER certificate in a PEM.
+
+    The certificate is not parsed; the DER is only checked to be a
+    SEQUENCE of the decoded length.
+    """
+    if isinstance(pem, str):
+        pem = pem.encode()
+
+    m = _PEM_RE.search(pem)
+    if m is None:
+        return None
     try:
-        with tarfile.open(name=path, mode='r') as tar:
-            for member in tar:
-                if member.name in ['root', 'intermediate']:
-                    continue
-                cert_type, sha256 = parse_name(member.name)
-                f = tar.extractfile(member)
-                content = f.read()
-                data[sha256] = (cert_type, content)
-
-    except (tarfile.TarError, OSError) as e:
-        raise UtilError(str(e))
+        der = base64.b64decode(b''.join(m.group(1).split()),
+                               validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    if not _der_sequence(der):
+        return None
+
+    return hashlib.sha256(der).hexdigest().upper()
+
+
+def _umask() -> int:
+    x = os.umask(0)
+    os.umask(x)
+    return x
+
+
+class CertificateCache:
+    """Content-addressed PEM certificate cache.
+
+    Certificates are stored as <path>/<SHA-256>.pem and are only
+    returned, or stored, when the SHA-256 fingerprint of the
+    certificate matches.  The directory can be shared between runs
+    and systems.
+    """
+
+    def __init__(self, *, path: str):
+        self.path = path
+
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError as e:
+            raise UtilError(str(e))
+
+    def _path(self, sha256: str) -> str:
+        if not re.search(r'^[0-9A-F]{64,64}$', sha256):
+            raise UtilError('invalid SHA-256 fingerprint: %s' % sha256)
+
+        return os.path.join(self.path, sha256 + '.pem')
+
+    def get(self, *, sha256: str) -> Optional[str]:
+        path = self._path(sha256)
+        try:
+            with open(path, 'r') as f:
+                pem = f.read()
+        except FileNotFoundError:
+            return None
+        except (OSError, UnicodeDecodeError) as e:
+            raise UtilError(str(e))
+
+        if pem_sha256(pem) != sha256:
+            # corrupt or wrong content; remove
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            return None
+
+        return pem
+
+    def put(self, *, sha256: str, pem: Union[str, bytes]) -> bool:
+        path = self._path(sha256)
+        if pem_sha256(pem) != sha256:
+            return False
+        if isinstance(pem, str):
+            pem = pem.encode()
+
+        # an existing entry is kept only when it has the same content;
+        # a corrupt or different one is replaced
+        try:
+            with open(path, 'rb') as f:
+                if f.read() == pem:
+                    return True
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            raise UtilError(str(e))
+
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(pem)
+                # mkstemp() creates the file 0600; make the shared
+                # cache readable as for a file created with open()
+                os.chmod(tmp, 0o644 & ~_umask())
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        except OSError as e:
+            raise UtilError(str(e))
+
+        return True
+
+
+def _parse_archive_name(name: str) -> Tuple[str, str]:
+    pat = (r'^(intermediate|root)/'
+           r'[0-9A-F]{64,64}\.pem$')
+    if not re.search(pat, name):
+        e = 'malformed path in archive: %s' % name
+        raise UtilError(e)
+    type_, pem = os.path.split(name)
+    sha256 = pem[:64]
+
+    return type_, sha256
+
+
+class CertArchive(Mapping):
+    """Certificate archive: SHA-256 -> (certificate type, PEM bytes).
+
+    A zip archive is indexed by its central directory and
+    certificates are read when accessed.  A tar archive cannot be
+    accessed randomly and is read when opened.
+    """
+
+    def __init__(self, *, path: str):
+        self.path = path
+        self._zip = None
+        self._types = {}
+        self._content = {}
+
+        try:
+            if zipfile.is_zipfile(path):
+                self._zip = zipfile.ZipFile(path, mode='r')
+                for name in self._zip.namelist():
+                    if name.endswith('/'):
+                        continue
+                    cert_type, sha256 = _parse_archive_name(name)
+                    self._types[sha256] = cert_type
+            else:
+                with tarfile.open(name=path, mode='r') as tar:
+                    for member in tar:
+                        if member.name in ['root', 'intermediate']:
+                            continue
+                        cert_type, sha256 = _parse_archive_name(
+                            member.name)
+                        f = tar.extractfile(member)
+                        self._types[sha256] = cert_type
+                        self._content[sha256] = f.read()
+        except (tarfile.TarError, zipfile.BadZipFile, OSError) as e:
+            self.close()
+            raise UtilError(str(e))
+        except UtilError:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+
+    def __len__(self) -> int:
+        return len(self._types)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._types)
+
+    def __contains__(self, sha256) -> bool:
+        return sha256 in self._types
+
+    def __getitem__(self, sha256: str) -> Tuple[str, bytes]:
+        cert_type = self._types[sha256]
+        return cert_type, self.content(sha256=sha256)
+
+    def cert_type(self, *, sha256: str) -> str:
+        return self._types[sha256]
+
+    def fingerprints(self, *,
+                     cert_type: Optional[Iterable[str]] = None,
+                     ) -> List[str]:
+        if cert_type is None:
+            return list(self._types)
+        return [k for k, v in self._types.items() if v in cert_type]
+
+    def content(self, *, sha256: str) -> bytes:
+        if sha256 in self._content:
+            return self._content[sha256]
+        if self._zip is None:
+            raise UtilError('%s: archive closed' % self.path)
+
+        name = '%s/%s.pem' % (self._types[sha256], sha256)
+        try:
+            return self._zip.read(name)
+        except (zipfile.BadZipFile, OSError) as e:
+            raise UtilError('%s: %s' % (name, e))
+
+
+def read_cert_archive(*, path: str) -> Dict[str, Tuple[str, str]]:
+    with CertArchive(path=path) as archive:
+        return dict(archive.items())
+
+
+# fixed member timestamp so identical certificates produce
+# byte-identical archives; zip cannot represent dates before 1980
+ARCHIVE_MTIME = 315532800  # 1980-01-01T00:00:00Z
+_ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
 
-    return data
+def cert_archive_manifest(data: Mapping) -> str:
+    """SHA-256 digest of the sorted archive member names.
+
+    Member names contain the certificate SHA-256 fingerprint, so the
+    names identify the archive content.
+    """
+    h = hashlib.sha256()
+    for sha256 in sorted(data):
+        cert_type = (data.cert_type(sha256=sha256)
+                     if isinstance(data, CertArchive) else data[sha256][0])
+        h.update(('%s/%s.pem\n' % (cert_type, sha256)).encode())
+
+    return h.hexdigest().upper()
+
+
+def cert_archive_diff(old: Mapping, new: Mapping) -> Tuple[List[str],
+                                                            List[str]]:
+    """Sorted fingerprints (added, removed) from old to new."""
+    return sorted(set(new) - set(old)), sorted(set(old) - set(new))
 
 
 def write_cert_archive(*, path: str, data: Dict[str, Tuple[str, str]]):
+    """Write a zip archive if path ends in .zip, else tar.gz.
+
+    Members are sorted and have fixed metadata, so the archive
+    content only depends on the certificates.
+    """
+    def members():
+        for k in sorted(data, key=lambda x: (data[x][0], x)):
+            cert_type, content = data[k]
+            if isinstance(content, str):
+                content = content.encode()
+            yield '%s/%s.pem' % (cert_type, k), content
+
     try:
-        with tarfile.open(name=path, mode='w:gz') as tar:
-            for k, v in data.items():
-                name = os.path.join(v[0], k + '.pem')
+        if path.endswith('.zip'):
+            with zipfile.ZipFile(path, mode='w',
+                                 compression=zipfile.ZIP_DEFLATED) as z:
+                for name, content in members():
+                    member = zipfile.ZipInfo(filename=name,
+                                             date_time=_ZIP_DATE_TIME)
+                    member.compress_type = zipfile.ZIP_DEFLATED
+                    member.external_attr = 0o644 << 16
+                    member.create_system = 3  # Unix
+                    z.writestr(member, content)
+            return
+
+        with open(path, 'wb') as f, \
+                gzip.GzipFile(filename='', mode='wb', fileobj=f,
+                              mtime=0) as gz, \
+                tarfile.open(fileobj=gz, mode='w',
+                             format=tarfile.PAX_FORMAT) as tar:
+            for name, content in members():
                 member = tarfile.TarInfo(name=name)
-                member.size = len(v[1])
-                member.mtime = time.time()
-                content = (v[1].encode() if isinstance(v[1], str)
-                           else v[1])
-                f = io.BytesIO(content)
-                tar.addfile(member, fileobj=f)
-    except (tarfile.TarError, OSError) as e:
+                member.size = len(content)
+                member.mtime = ARCHIVE_MTIME
+                member.mode = 0o644
+                member.uid = member.gid = 0
+                member.uname = member.gname = ''
+                tar.addfile(member, fileobj=io.BytesIO(content))
+    except (tarfile.TarError, zipfile.BadZipFile, OSError) as e:
         raise UtilError(str(e))
 
 
@@ -107,6 +380,57 @@ def hash_to_name(*, sha256: str) -> str:
     return x[0:31]
 
 
+class FingerprintIndex:
+    """Sorted SHA-256 fingerprints for prefix and certificate name queries.
+
+    Each query is a binary search over the sorted fingerprints.
+    """
+
+    def __init__(self, fingerprints: Iterable[str]):
+        self._keys = sorted(set(x for x in fingerprints
+                                if isinstance(x, str)))
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, sha256: str) -> bool:
+        i = bisect.bisect_left(self._keys, sha256)
+        return i < len(self._keys) and self._keys[i] == sha256
+
+    def prefix(self, prefix: str) -> List[str]:
+        prefix = prefix.upper()
+        r = []
+        i = bisect.bisect_left(self._keys, prefix)
+        while i < len(self._keys) and self._keys[i].startswith(prefix):
+            r.append(self._keys[i])
+            i += 1
+
+        return r
+
+    def search(self, s: str) -> List[str]:
+        """Prefix query; substring scan when there is no prefix match."""
+        r = self.prefix(s)
+        if r:
+            return r
+
+        s = s.upper()
+        return [x for x in self._keys if s in x]
+
+    def collisions(self) -> Dict[str, List[str]]:
+        """Certificate names (see hash_to_name()) used by >1 fingerprints."""
+        # names are a fingerprint prefix; equal names are adjacent
+        names = [hash_to_name(sha256=x) for x in self._keys]
+        collisions = {}
+
+        for i in range(1, len(names)):
+            if names[i - 1] == names[i]:
+                if names[i] not in collisions:
+                    collisions[names[i]] = [self._keys[i - 1]]
+                collisions[names[i]].append(self._keys[i])
+
+        return collisions
+
+
 def read_fingerprints(*, path: str) -> List[Dict[str, str]]:
     try:
         with open(path, 'r', newline='') as csvfile:
@@ -186,36 +510,79 @@ def dict_to_tree(*, data: dict) -> treelib.Tree:
 
 
 def stats_from_tree(*, tree: treelib.Tree) -> Dict[str, Union[float, int]]:
-    all_nodes = tree.all_nodes()
-    root_nodes = [node for node in all_nodes
-                  if tree.parent(node.identifier) is not None and
-                  tree.parent(node.identifier).identifier == 0]
-    roots_with_no_children = [node for node in root_nodes
-                              if not len(tree.children(node.identifier))]
-    children_counts = [len(tree.children(node.identifier))
-                       for node in all_nodes]
-    node_depths = [tree.depth(node.identifier) for node in all_nodes]
+    return stats_from_dict(data=tree_to_dict(tree=tree))
+
+
+def stats_from_dict(*, data: dict) -> Dict[str, Union[float, int]]:
+    children = defaultdict(list)
+    for x in data['nodes']:
+        if x['parent'] is not None:
+            children[x['parent']].append(x['identifier'])
+
+    return _stats(children, 0 if data['nodes'] else None)
+
+
+def stats_from_forest(*, forest: Forest) -> Dict[str, Union[float, int]]:
+    # node number 0 is the 'Root' node
+    children = {i: x for i, x in enumerate(forest.children) if x}
+
+    return _stats(children, 0)
+
+
+def _stats(children: Dict, root) -> Dict[str, Union[float, int]]:
+    total_nodes = 0
+    total_depth = 0
     level_counts = defaultdict(int)
-    for x in node_depths:
-        level_counts[x] += 1
+    total_children = 0
+    maximum_children = 0
+    children_10 = children_50 = children_100 = 0
+    leaf_nodes = 0
+
+    # breadth-first from the root node, one level at a time
+    level = [] if root is None else [root]
+    depth = 0
+    while level:
+        next_level = []
+        level_counts[depth] = len(level)
+        total_nodes += len(level)
+        total_depth += depth * len(level)
+        for x in level:
+            c = children.get(x, ())
+            n = len(c)
+            total_children += n
+            if n > maximum_children:
+                maximum_children = n
+            if n >= 10:
+                children_10 += 1
+                if n >= 50:
+                    children_50 += 1
+                    if n >= 100:
+                        children_100 += 1
+            elif n == 0:
+                leaf_nodes += 1
+            next_level.extend(c)
+        level = next_level
+        depth += 1
+
+    roots = children.get(0, ())
+    total_roots = len(roots)
+    roots_with_no_children = sum(1 for x in roots if x not in children)
 
     stats = {
-        'total_nodes': len(all_nodes),  # includes root node
-        'total_roots': len(root_nodes),
-        'roots_with_no_children': len(roots_with_no_children),
-        'total_intermediates': len(all_nodes) - 1 - len(root_nodes),
-        'maximum_depth': max(node_depths, default=0),
-        'average_depth':
-        sum(node_depths) / len(node_depths) if node_depths else 0,
+        'total_nodes': total_nodes,  # includes root node
+        'total_roots': total_roots,
+        'roots_with_no_children': roots_with_no_children,
+        'total_intermediates': total_nodes - 1 - total_roots,
+        'maximum_depth': max(level_counts, default=0),
+        'average_depth': total_depth / total_nodes if total_nodes else 0,
         'maximum_breadth': max(level_counts.values(), default=0),
-        'maximum_children': max(children_counts, default=0),
+        'maximum_children': maximum_children,
         'average_children':
-        sum(children_counts) / len(children_counts) if children_counts else 0,
-        'nodes_with_10+_children': sum(1 for c in children_counts if c >= 10),
-        'nodes_with_50+_children': sum(1 for c in children_counts if c >= 50),
-        'nodes_with_100+_children':
-        sum(1 for c in children_counts if c >= 100),
-        'leaf_nodes': sum(1 for c in children_counts if c == 0),
+        total_children / total_nodes if total_nodes else 0,
+        'nodes_with_10+_children': children_10,
+        'nodes_with_50+_children': children_50,
+        'nodes_with_100+_children': children_100,
+        'leaf_nodes': leaf_nodes,
     }
 
     return stats
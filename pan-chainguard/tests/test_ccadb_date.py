@@ -80,3 +80,13 @@ class CcadbTest(unittest.TestCase):
         self.assertFalse(r, "%s: %s" % (t, err))
         self.assertIsNotNone(err)
         self.assertIn('Expired', err)
+
+    def test_09(self):
+        t = {
+            VALID_FROM: tomorrow,
+            VALID_TO: tomorrow,
+        }
+        r, err = valid_from_to(t)
+        self.assertFalse(r, "%s: %s" % (t, err))
+        self.assertIsNotNone(err)
+        self.assertIn('Not yet valid', err)
@@ -0,0 +1,299 @@
+import csv
+from datetime import datetime, timezone
+import json
+import os
+import tempfile
+import unittest
+
+from pan_chainguard.ccadb import *
+from pan_chainguard.ccadb import (CcadbCertificateRecords, CcadbError,
+                                  CcadbRecord)
+
+HEADER = [
+    'CA Owner',
+    'Salesforce Record ID',
+    'Certificate Name',
+    'Parent Certificate Name',
+    'Certificate Record Type',
+    'Revocation Status',
+    'SHA-256 Fingerprint',
+    'Parent SHA-256 Fingerprint',
+    'Valid From (GMT)',
+    'Valid To (GMT)',
+    'Derived Trust Bits',
+    'Trust Bits for Root Cert',
+    'Status of Root Cert',
+    'Mozilla Status',
+    'Microsoft Status',
+    'Chrome Status',
+    'Apple Status',
+    'Full CRL Issued By This CA',
+]
+
+ROOT = 'A' * 64
+INT1 = 'B' * 64
+INT2 = 'C' * 64
+
+ROWS = [
+    ['Owner', '001', 'Root CA', 'Owner', 'Root Certificate', '',
+     ROOT, '', '2000.01.01', '2099.12.31', '',
+     'Server Authentication;Secure Email',
+     'Mozilla: Included; Microsoft: Included',
+     'Included', 'Included', 'Not Included', 'Included', ''],
+    ['Owner', '002', 'Intermediate 1', 'Root CA',
+     'Intermediate Certificate', 'Not Revoked',
+     INT1, ROOT, '2001.02.03', '2098.01.01',
+     'Server Authentication', '', '', '', '', '', '',
+     'http://example.com/crl'],
+    ['Owner', '003', 'Intermediate 2', 'Root CA',
+     'Intermediate Certificate', 'Revoked',
+     INT2, ROOT, '2001.02.03', '2002.01.01',
+     'Client Authentication', '', '', '', '', '', '', ''],
+]
+
+
+class CcadbRecordsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'ccadb.csv')
+        self.cache = os.path.join(self.tmpdir.name, 'cache')
+        self.write(ROWS)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, rows, header=HEADER):
+        with open(self.path, 'w', newline='') as f:
+            writer = csv.writer(f, dialect='unix')
+            writer.writerow(header)
+            writer.writerows(rows)
+
+    def snapshots(self):
+        if not os.path.isdir(self.cache):
+            return []
+        return sorted(os.listdir(self.cache))
+
+    def test_01(self):
+        records = CcadbCertificateRecords(path=self.path)
+        self.assertEqual(len(records), 3)
+        self.assertIsNone(records.snapshot)
+
+        rows = list(records)
+        self.assertEqual(rows[0]['SHA-256 Fingerprint'], ROOT)
+        self.assertEqual(rows[1]['Parent SHA-256 Fingerprint'], ROOT)
+        self.assertEqual(rows[1]['Valid From (GMT)'], '2001.02.03')
+        self.assertEqual(rows[0]['Valid To (GMT)'], '2099.12.31')
+        # unused columns are not retained
+        self.assertNotIn('CA Owner', rows[0])
+        self.assertNotIn('Full CRL Issued By This CA', rows[1])
+
+    def test_02(self):
+        records = CcadbCertificateRecords(path=self.path)
+        rows = list(records)
+
+        self.assertEqual(revoked(rows[0]), (False, None))
+        self.assertTrue(revoked(rows[2])[0])
+        self.assertTrue(valid_from_to(rows[1])[0])
+        self.assertFalse(valid_to(rows[2])[0])
+        self.assertEqual(root_status_bits_flag(rows[0]),
+                         RootStatusBits.MOZILLA | RootStatusBits.MICROSOFT |
+                         RootStatusBits.APPLE)
+        self.assertEqual(derived_trust_bits(rows[1]),
+                         TrustBits.SERVER_AUTHENTICATION)
+
+    def test_03(self):
+        records = CcadbCertificateRecords(path=self.path,
+                                          cache_dir=self.cache)
+        self.assertEqual(len(self.snapshots()), 1)
+        self.assertTrue(os.path.isfile(records.snapshot))
+
+        records2 = CcadbCertificateRecords(path=self.path,
+                                           cache_dir=self.cache)
+        self.assertEqual(records2.snapshot, records.snapshot)
+        self.assertEqual(list(records2), list(records))
+
+    def test_04(self):
+        records = CcadbCertificateRecords(path=self.path,
+                                          cache_dir=self.cache)
+        snapshot = records.snapshot
+
+        # changed CSV: new snapshot, old one removed
+        self.write(ROWS[:2])
+        records = CcadbCertificateRecords(path=self.path,
+                                          cache_dir=self.cache)
+        self.assertEqual(len(records), 2)
+        self.assertNotEqual(records.snapshot, snapshot)
+        self.assertEqual(self.snapshots(),
+                         [os.path.basename(records.snapshot)])
+
+    def test_05(self):
+        records = CcadbCertificateRecords(path=self.path,
+                                          cache_dir=self.cache)
+        with open(records.snapshot, 'wb') as f:
+            f.write(b'garbage')
+
+        records = CcadbCertificateRecords(path=self.path,
+                                          cache_dir=self.cache)
+        self.assertEqual(len(records), 3)
+
+    def test_06(self):
+        with self.assertRaises(CcadbError):
+            CcadbCertificateRecords(
+                path=os.path.join(self.tmpdir.name, 'missing.csv'))
+
+        self.write([], header=['Certificate Name'])
+        with self.assertRaises(CcadbError) as e:
+            CcadbCertificateRecords(path=self.path)
+        self.assertIn('missing column', str(e.exception))
+
+    def test_07(self):
+        records = CcadbCertificateRecords(path=self.path)
+        record = records.row(1)
+        self.assertIsInstance(record, CcadbRecord)
+        self.assertFalse(hasattr(record, '__dict__'))
+
+        self.assertEqual(list(record.keys()), list(records.columns))
+        self.assertEqual(record.get('Certificate Name'), 'Intermediate 1')
+        self.assertIsNone(record.get('CA Owner'))
+        with self.assertRaises(KeyError):
+            record['CA Owner']
+
+        x = record.to_dict()
+        self.assertEqual(x['Valid To (GMT)'], '2098.01.01')
+        self.assertEqual(record, x)
+        self.assertEqual(json.loads(json.dumps(x)), x)
+
+        self.assertEqual(records.row(-1)['SHA-256 Fingerprint'], INT2)
+        with self.assertRaises(IndexError):
+            records.row(3)
+
+    def test_08(self):
+        records = CcadbCertificateRecords(path=self.path,
+                                          cache_dir=self.cache)
+        records = CcadbCertificateRecords(path=self.path,
+                                          cache_dir=self.cache)
+        row = records.row(1).full_row()
+        self.assertEqual(list(row.keys()), HEADER)
+        self.assertEqual(row['Full CRL Issued By This CA'],
+                         'http://example.com/crl')
+
+        # full row from a CSV changed after loading
+        records = CcadbCertificateRecords(path=self.path)
+        self.write(ROWS[:2])
+        with self.assertRaises(CcadbError):
+            records.row(0).full_row()
+
+    def test_09(self):
+        records = CcadbCertificateRecords(path=self.path)
+        now = datetime(2001, 6, 1, 12, tzinfo=timezone.utc)
+        bits = records.bits(now=now)
+        self.assertEqual(bits.now, now)
+
+        self.assertEqual(list(bits.validity), [
+            ValidityBits.NONE.value,
+            ValidityBits.NONE.value,
+            ValidityBits.REVOKED.value,
+        ])
+        self.assertEqual(TrustBits(bits.trust_bits[0]),
+                         TrustBits.SERVER_AUTHENTICATION |
+                         TrustBits.SECURE_EMAIL)
+        self.assertEqual(TrustBits(bits.trust_bits[2]),
+                         TrustBits.CLIENT_AUTHENTICATION)
+        self.assertEqual(RootStatusBits(bits.root_status_bits[0]),
+                         root_status_bits_flag(records.row(0)))
+        self.assertEqual(bits.root_status_bits[1], 0)
+        self.assertEqual(bits.valid_from[1],
+                         datetime(2001, 2, 3).toordinal())
+        self.assertEqual(bits.valid_to[0],
+                         datetime(2099, 12, 31).toordinal())
+
+        # same result as the per-row functions
+        for i, row in enumerate(records):
+            x = ValidityBits(bits.validity[i])
+            self.assertEqual(revoked(row)[0], ValidityBits.REVOKED in x)
+
+        bits = records.bits(now=datetime(2001, 2, 3, tzinfo=timezone.utc))
+        self.assertEqual(bits.validity[1], ValidityBits.NONE.value)
+        bits = records.bits(now=datetime(2001, 2, 2, 23, 59,
+                                         tzinfo=timezone.utc))
+        x = ValidityBits(bits.validity[1])
+        self.assertEqual(x, ValidityBits.NOT_YET_VALID)
+        self.assertEqual(validity_message(records.row(1), x),
+                         'Not yet valid (valid from 2001.02.03)')
+
+        bits = records.bits(now=datetime(2002, 1, 1, tzinfo=timezone.utc))
+        self.assertEqual(bits.validity[2], ValidityBits.REVOKED.value)
+        bits = records.bits(now=datetime(2002, 1, 1, 0, 0, 1,
+                                         tzinfo=timezone.utc))
+        x = ValidityBits(bits.validity[2])
+        self.assertEqual(x, ValidityBits.REVOKED | ValidityBits.EXPIRED)
+        self.assertEqual(validity_message(records.row(2), x), 'Revoked')
+        self.assertEqual(
+            validity_message(records.row(2), ValidityBits.EXPIRED),
+            'Expired (valid to 2002.01.01)')
+
+    def test_10(self):
+        records = CcadbCertificateRecords(path=self.path,
+                                          cache_dir=self.cache)
+        with open(records.snapshot, 'r') as f:
+            snapshot = json.load(f)
+        self.assertEqual(snapshot['format'], 'pan-chainguard-ccadb')
+
+        # invalid snapshots are ignored and the CSV parsed again
+        bad = []
+        x = json.loads(json.dumps(snapshot))
+        x['data'][0][0] = len(x['values'])
+        bad.append(x)
+        x = json.loads(json.dumps(snapshot))
+        x['data'][0][0] = -1
+        bad.append(x)
+        x = json.loads(json.dumps(snapshot))
+        x['data'][1] = x['data'][1][:-1]
+        bad.append(x)
+        x = json.loads(json.dumps(snapshot))
+        x['columns'][0] = 'CA Owner'
+        bad.append(x)
+        x = json.loads(json.dumps(snapshot))
+        i = x['columns'].index('Valid To (GMT)')
+        x['data'][i][0] = 'x'
+        bad.append(x)
+        x = json.loads(json.dumps(snapshot))
+        x['invalid_dates'] = [[0, 0, 'x']]
+        bad.append(x)
+
+        for x in bad:
+            with open(records.snapshot, 'w') as f:
+                json.dump(x, f)
+            records2 = CcadbCertificateRecords(path=self.path,
+                                               cache_dir=self.cache)
+            self.assertEqual(list(records2), list(records))
+            with open(records.snapshot, 'r') as f:
+                self.assertEqual(json.load(f), snapshot)
+
+    def test_11(self):
+        rows = [list(x) for x in ROWS]
+        rows[1][8] = '2001.02.30'
+        rows[2][9] = 'never'
+        self.write(rows)
+
+        for _ in range(2):
+            # parsed, then loaded from the snapshot
+            records = CcadbCertificateRecords(path=self.path,
+                                              cache_dir=self.cache)
+            self.assertEqual(len(records), 3)
+            self.assertEqual(records.row(1)['Valid From (GMT)'],
+                             '2001.02.30')
+            self.assertEqual(records.row(2)['Valid To (GMT)'], 'never')
+
+            bits = records.bits()
+            self.assertEqual(bits.validity[0], ValidityBits.NONE.value)
+            x = ValidityBits(bits.validity[1])
+            self.assertEqual(x, ValidityBits.INVALID_DATE)
+            self.assertEqual(
+                validity_message(records.row(1), x),
+                'Invalid date (valid from "2001.02.30", '
+                'valid to "2098.01.01")')
+            self.assertIn(ValidityBits.INVALID_DATE,
+                          ValidityBits(bits.validity[2]))
+            self.assertIsNone(bits.valid_from[1])
+            self.assertIsNone(bits.valid_to[2])
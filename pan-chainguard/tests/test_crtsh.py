@@ -0,0 +1,70 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+import time
+import unittest
+
+from pan_chainguard.crtsh import ArgsError, TokenBucket, backoff, retry_after
+
+
+class Resp:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+def http_date(seconds):
+    x = datetime.now(timezone.utc) + timedelta(seconds=seconds)
+    return format_datetime(x, usegmt=True)
+
+
+class CrtShTest(unittest.IsolatedAsyncioTestCase):
+    async def test_01(self):
+        bucket = TokenBucket(rate=20, burst=2)
+        start = time.monotonic()
+        for _ in range(6):
+            await bucket.acquire()
+        elapsed = time.monotonic() - start
+        # 2 burst tokens, then 4 at 20/s
+        self.assertGreaterEqual(elapsed, 4 / 20 - 0.01)
+        self.assertLess(elapsed, 1)
+
+    async def test_02(self):
+        bucket = TokenBucket(rate=100, burst=5)
+        bucket.defer(0.2)
+        start = time.monotonic()
+        await asyncio.gather(*[bucket.acquire() for _ in range(3)])
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    async def test_06(self):
+        bucket = TokenBucket(rate=None, burst=1)
+        start = time.monotonic()
+        for _ in range(20):
+            await bucket.acquire()
+        self.assertLess(time.monotonic() - start, 0.1)
+
+        bucket.defer(0.2)
+        start = time.monotonic()
+        await bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    def test_03(self):
+        with self.assertRaises(ArgsError):
+            TokenBucket(rate=0)
+        with self.assertRaises(ArgsError):
+            TokenBucket(rate=1, burst=0)
+
+    def test_04(self):
+        self.assertIsNone(retry_after(Resp({})))
+        self.assertEqual(retry_after(Resp({'Retry-After': '30'})), 30)
+        self.assertIsNone(retry_after(Resp({'Retry-After': 'soon'})))
+
+        x = retry_after(Resp({'Retry-After': http_date(60)}))
+        self.assertTrue(50 < x <= 60, x)
+        x = retry_after(Resp({'Retry-After': http_date(-60)}))
+        self.assertEqual(x, 0)
+
+    def test_05(self):
+        for tries in range(1, 10):
+            x = backoff(tries, base=2, cap=60)
+            self.assertGreaterEqual(x, 0)
+            self.assertLessEqual(x, min(60, 2 * 2 ** (tries - 1)))
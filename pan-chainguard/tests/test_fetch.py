@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from pan_chainguard.fetch import HttpCache, FetchError, OFFLINE
+
+BODY = b'x' * 200000
+ETAG = '"v1"'
+
+
+class FetchTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.requests = []
+
+        async def handler(request):
+            self.requests.append(dict(request.headers))
+            if request.headers.get('If-None-Match') == ETAG:
+                return web.Response(status=304)
+            return web.Response(body=BODY, headers={'ETag': ETAG})
+
+        async def missing(request):
+            return web.Response(status=404)
+
+        app = web.Application()
+        app.router.add_get('/data', handler)
+        app.router.add_get('/missing', missing)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        self.session = aiohttp.ClientSession()
+        self.tmp = tempfile.TemporaryDirectory()
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        await self.server.close()
+        self.tmp.cleanup()
+
+    async def test_01(self):
+        cache = HttpCache(path=os.path.join(self.tmp.name, 'http'))
+        url = str(self.server.make_url('/data'))
+
+        path, status = await cache.fetch(self.session, url)
+        self.assertEqual(status, 200)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), BODY)
+        self.assertEqual(cache.cached(url)['etag'], ETAG)
+
+        path2, status = await cache.fetch(self.session, url)
+        self.assertEqual(status, 304)
+        self.assertEqual(path2, path)
+        self.assertEqual(self.requests[1].get('If-None-Match'), ETAG)
+
+        await self.server.close()
+        path2, status = await cache.fetch(self.session, url, offline=True)
+        self.assertEqual(status, OFFLINE)
+        self.assertEqual(path2, path)
+        self.assertEqual(len(self.requests), 2)
+
+    async def test_02(self):
+        cache = HttpCache(path=self.tmp.name)
+
+        with self.assertRaises(FetchError):
+            await cache.fetch(self.session,
+                              str(self.server.make_url('/missing')))
+        self.assertIsNone(cache.cached(
+            str(self.server.make_url('/missing'))))
+
+        with self.assertRaises(FetchError):
+            await cache.fetch(self.session,
+                              str(self.server.make_url('/data')),
+                              offline=True)
+        self.assertEqual(self.requests, [])
+        self.assertEqual([x for x in os.listdir(self.tmp.name)
+                          if x.endswith('.tmp')], [])
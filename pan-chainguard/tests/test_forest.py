@@ -0,0 +1,122 @@
+import io
+import json
+import unittest
+
+import treelib
+
+from pan_chainguard.forest import Forest, ForestError, ROOT, COMPACT_HEADER
+import pan_chainguard.util
+
+# (identifier, parent), parent before child
+NODES = [
+    ('R2', ROOT),
+    ('R1', ROOT),
+    ('I3', 'R1'),
+    ('I1', 'R1'),
+    ('I2', 'I1'),
+    ('I4', 'R2'),
+    ('I5', 'I1'),
+]
+
+
+def forest():
+    x = Forest()
+    for identifier, parent in NODES:
+        x.add(identifier, tag='tag %s' % identifier,
+              data={'id': identifier}, parent=parent)
+    return x
+
+
+def tree():
+    x = treelib.Tree()
+    x.create_node(tag='Root', identifier=ROOT)
+    for identifier, parent in NODES:
+        x.create_node(tag='tag %s' % identifier, identifier=identifier,
+                      data={'id': identifier}, parent=parent)
+    return x
+
+
+class ForestTest(unittest.TestCase):
+    def test_01(self):
+        f = forest()
+        self.assertEqual(len(f), len(NODES) + 1)
+        self.assertIn('I2', f)
+        self.assertNotIn('I9', f)
+        i = f.index('I2')
+        self.assertEqual(f.identifiers[f.parent(i)], 'I1')
+        self.assertIsNone(f.parent(0))
+
+        with self.assertRaises(ForestError):
+            f.add('I1', tag='x', parent='R1')
+        with self.assertRaises(ForestError):
+            f.add('I9', tag='x', parent='I8')
+
+    def test_02(self):
+        f = forest()
+        t = tree()
+
+        x = [f.identifiers[i] for i in f.subtree('R1')]
+        self.assertEqual(x, list(t.expand_tree('R1')))
+        self.assertEqual(x, ['R1', 'I1', 'I2', 'I5', 'I3'])
+
+        self.assertEqual(f.show(), t.show(stdout=False))
+        self.assertEqual(f.show('I1'), t.subtree('I1').show(stdout=False))
+
+    def test_03(self):
+        f = forest()
+        t = tree()
+
+        x = f.to_dict()
+        self.assertEqual(x, pan_chainguard.util.tree_to_dict(tree=t))
+
+        f2 = Forest.from_dict(x)
+        self.assertEqual(f2.to_dict(), x)
+
+        with self.assertRaises(ForestError):
+            Forest.from_dict({'nodes': x['nodes'][1:]})
+        with self.assertRaises(ForestError):
+            Forest.from_dict({'nodes': [x['nodes'][0], {'tag': 'x'}]})
+
+    def test_04(self):
+        f = forest()
+        f.data[f.index('I2')]['tab'] = 'a\tb'
+
+        out = io.StringIO()
+        f.dump_compact(out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], COMPACT_HEADER)
+        self.assertEqual(len(lines), len(NODES) + 1)
+
+        f2 = Forest.load_compact(io.StringIO(out.getvalue()))
+        # data is decoded on access
+        i = f2.index('I2')
+        self.assertIsInstance(list.__getitem__(f2.data, i), str)
+        self.assertEqual(f2.data[i], {'id': 'I2', 'tab': 'a\tb'})
+        self.assertIsInstance(list.__getitem__(f2.data, i), dict)
+
+        self.assertEqual(f2.to_dict(), f.to_dict())
+        self.assertEqual(f2.show(), f.show())
+
+    def test_05(self):
+        f = forest()
+
+        out = io.StringIO()
+        f.dump_compact(out)
+        f2 = Forest.load(io.StringIO(out.getvalue()))
+        self.assertEqual(f2.to_dict(), f.to_dict())
+
+        x = json.dumps(f.to_dict(), indent=4)
+        f2 = Forest.load(io.StringIO(x))
+        self.assertEqual(f2.to_dict(), f.to_dict())
+
+        with self.assertRaises(ForestError):
+            Forest.load(io.StringIO('{'))
+        with self.assertRaises(ForestError):
+            Forest.load_compact(io.StringIO(x))
+        for x in ['["I1",0,"x"]', '["I1","R1","x"]\t{}', '"I1"\t{}']:
+            with self.assertRaises(ForestError):
+                Forest.load(io.StringIO(COMPACT_HEADER + '\n' + x + '\n'))
+
+        f2 = Forest.load(io.StringIO(COMPACT_HEADER + '\n["I1",0,"x"]\t{'))
+        with self.assertRaises(ForestError):
+            f2.data[1]
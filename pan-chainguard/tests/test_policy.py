@@ -0,0 +1,134 @@
+import unittest
+
+from pan_chainguard.ccadb import RootStatusBits, TrustBits
+from pan_chainguard.policy import (Policy, PolicyColumns, PolicyError,
+                                   bitset, count, members,
+                                   sources_expression)
+
+MOZILLA = RootStatusBits.MOZILLA.value
+CHROME = RootStatusBits.CHROME.value
+APPLE = RootStatusBits.APPLE.value
+MICROSOFT = RootStatusBits.MICROSOFT.value
+SERVER = TrustBits.SERVER_AUTHENTICATION.value
+EMAIL = TrustBits.SECURE_EMAIL.value
+
+TODAY = 739000
+
+
+def columns(trust_bits=None):
+    return PolicyColumns(
+        sources=[MOZILLA, MOZILLA | CHROME, 0, MICROSOFT,
+                 MOZILLA | APPLE],
+        valid_from=[TODAY - 8000, None, TODAY - 100, TODAY - 50,
+                    TODAY - 3000],
+        valid_to=[TODAY + 1000, TODAY + 5000, None, TODAY + 50,
+                  TODAY + 4000],
+        today=TODAY,
+        trust_bits=trust_bits)
+
+
+def match(expression, trust_bits=None):
+    x = columns(trust_bits)
+    return members(Policy(expression)(x))
+
+
+class PolicyTest(unittest.TestCase):
+    def test_01(self):
+        self.assertEqual(bitset([]), 0)
+        self.assertEqual(bitset([True, False, True]), 0b101)
+        self.assertEqual(count(0b1011), 3)
+        self.assertEqual(members(0), [])
+        self.assertEqual(members(0b10110), [1, 2, 4])
+
+    def test_02(self):
+        self.assertEqual(match('mozilla'), [0, 1, 4])
+        self.assertEqual(match('google'), [1])
+        self.assertEqual(match('mozilla or microsoft'), [0, 1, 3, 4])
+        self.assertEqual(match('mozilla and not (chrome or apple)'), [0])
+        self.assertEqual(match('not mozilla'), [2, 3])
+        self.assertEqual(match('not not mozilla'), [0, 1, 4])
+        # and binds tighter than or
+        self.assertEqual(match('microsoft or mozilla and chrome'), [1, 3])
+        self.assertEqual(match('(microsoft or mozilla) and chrome'), [1])
+
+        x = sources_expression(['mozilla', 'chrome'], 'union')
+        self.assertEqual(x, 'mozilla or chrome')
+        self.assertEqual(match(x), [0, 1, 4])
+        x = sources_expression(['mozilla', 'apple'], 'intersection')
+        self.assertEqual(x, 'mozilla and apple')
+        self.assertEqual(match(x), [4])
+
+        with self.assertRaises(PolicyError):
+            sources_expression(['mozilla'], 'difference')
+
+    def test_03(self):
+        self.assertEqual(match('valid_days >= 1000'), [0, 1, 4])
+        self.assertEqual(match('valid_days<100'), [3])
+        self.assertEqual(match('age_days > 7300'), [0])
+        self.assertEqual(match('age_days == 100'), [2])
+        # a missing date never matches
+        self.assertEqual(match('age_days != 100'), [0, 3, 4])
+        self.assertEqual(match('not valid_days > 0'), [2])
+        self.assertEqual(match('mozilla and age_days < 5000'), [4])
+
+    def test_04(self):
+        trust_bits = {'mozilla': [SERVER, SERVER | EMAIL, 0, 0, EMAIL]}
+        self.assertEqual(
+            match('mozilla[SERVER_AUTHENTICATION]', trust_bits), [0, 1])
+        self.assertEqual(
+            match('mozilla[SERVER_AUTHENTICATION, SECURE_EMAIL]',
+                  trust_bits), [1])
+        self.assertEqual(
+            match('mozilla[SECURE_EMAIL] or microsoft', trust_bits),
+            [1, 3, 4])
+
+        x = Policy('apple or mozilla[SECURE_EMAIL] and chrome')
+        self.assertEqual(x.trust_sources, {'mozilla'})
+        with self.assertRaises(PolicyError):
+            x(columns())
+
+    def test_05(self):
+        for x in ['', ' ', 'mozilla and', 'and mozilla', 'firefox',
+                  '(mozilla', 'mozilla)', 'mozilla chrome',
+                  'mozilla[]', 'mozilla[SERVER_AUTHENTICATION',
+                  'mozilla[FOO]', 'valid_days', 'valid_days >= x',
+                  'valid_days = 5', 'age_days > 1.5', 'mozilla $']:
+            with self.assertRaises(PolicyError, msg=x):
+                Policy(x)
+
+        with self.assertRaises(PolicyError):
+            PolicyColumns(sources=[0], valid_from=[], valid_to=[None],
+                          today=TODAY)
+
+    def test_06(self):
+        x = sources_expression(['mozilla', 'chrome'], 'union',
+                               ['SERVER_AUTHENTICATION'])
+        self.assertEqual(x, 'mozilla[SERVER_AUTHENTICATION] or '
+                         'chrome[SERVER_AUTHENTICATION]')
+        x = sources_expression(['mozilla', 'apple'], 'intersection',
+                               ['SERVER_AUTHENTICATION', 'SECURE_EMAIL'])
+        self.assertEqual(
+            x, 'mozilla[SERVER_AUTHENTICATION, SECURE_EMAIL] and '
+            'apple[SERVER_AUTHENTICATION, SECURE_EMAIL]')
+
+        trust_bits = {
+            'mozilla': [SERVER, 0, 0, 0, SERVER],
+            'chrome': [0, SERVER, 0, 0, 0],
+            'apple': [0, 0, 0, 0, 0],
+        }
+        # sources with trust bits only include the roots with the
+        # trust bits in that source; a plain source includes all
+        x = sources_expression(['mozilla', 'chrome'], 'union',
+                               ['SERVER_AUTHENTICATION'])
+        self.assertEqual(match(x, trust_bits), [0, 1, 4])
+        x = sources_expression(['mozilla', 'chrome'], 'intersection',
+                               ['SERVER_AUTHENTICATION'])
+        self.assertEqual(match(x, trust_bits), [])
+        self.assertEqual(match('mozilla and chrome', trust_bits), [1])
+        x = sources_expression(['mozilla'], 'union',
+                               ['SERVER_AUTHENTICATION'])
+        self.assertEqual(match(x, trust_bits), [0, 4])
+        self.assertEqual(match('mozilla', trust_bits), [0, 1, 4])
+        x = sources_expression(['apple'], 'union', ['SERVER_AUTHENTICATION'])
+        self.assertEqual(match(x, trust_bits), [])
+        self.assertEqual(match('apple', trust_bits), [4])
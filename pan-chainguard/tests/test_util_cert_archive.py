@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+import zipfile
+
+from pan_chainguard.util import (CertArchive, UtilError,
+                                 cert_archive_diff, cert_archive_manifest,
+                                 read_cert_archive, write_cert_archive)
+
+DATA = {
+    'A' * 64: ('root', b'root A\n'),
+    'B' * 64: ('intermediate', b'intermediate B\n'),
+    'C' * 64: ('intermediate', b'intermediate C\n'),
+}
+
+
+class UtilCertArchiveTest(unittest.TestCase):
+    def test_01(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for x in ['certs.tgz', 'certs.zip']:
+                path = os.path.join(tmp, x)
+                write_cert_archive(path=path, data=DATA)
+                self.assertEqual(read_cert_archive(path=path), DATA)
+
+                with CertArchive(path=path) as archive:
+                    self.assertEqual(len(archive), 3)
+                    self.assertIn('B' * 64, archive)
+                    self.assertEqual(archive.fingerprints(cert_type=['root']),
+                                     ['A' * 64])
+                    self.assertEqual(
+                        sorted(archive.fingerprints(
+                            cert_type=['intermediate'])),
+                        ['B' * 64, 'C' * 64])
+                    self.assertEqual(archive.content(sha256='C' * 64),
+                                     DATA['C' * 64][1])
+
+            self.assertTrue(zipfile.is_zipfile(path))
+
+    def test_02(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'certs.zip')
+            write_cert_archive(path=path, data=DATA)
+            archive = CertArchive(path=path)
+            self.assertEqual(archive['A' * 64], DATA['A' * 64])
+            archive.close()
+            with self.assertRaises(UtilError):
+                archive.content(sha256='B' * 64)
+
+            with zipfile.ZipFile(path, mode='w') as z:
+                z.writestr('other/x.pem', b'')
+            with self.assertRaises(UtilError):
+                CertArchive(path=path)
+
+            with self.assertRaises(UtilError):
+                CertArchive(path=os.path.join(tmp, 'missing.tgz'))
+
+    def test_03(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for x in ['certs.tgz', 'certs.zip']:
+                path1 = os.path.join(tmp, '1' + x)
+                path2 = os.path.join(tmp, '2' + x)
+                write_cert_archive(path=path1, data=DATA)
+                # different insertion order, str content
+                data = {k: (v[0], v[1].decode())
+                        for k, v in reversed(DATA.items())}
+                write_cert_archive(path=path2, data=data)
+                with open(path1, 'rb') as f1, open(path2, 'rb') as f2:
+                    self.assertEqual(f1.read(), f2.read())
+
+                with CertArchive(path=path1) as archive:
+                    self.assertEqual(list(archive),
+                                     ['B' * 64, 'C' * 64, 'A' * 64])
+                    self.assertEqual(cert_archive_manifest(archive),
+                                     cert_archive_manifest(DATA))
+
+    def test_04(self):
+        new = dict(DATA)
+        del new['A' * 64]
+        new['D' * 64] = ('root', b'root D\n')
+        self.assertEqual(cert_archive_diff(DATA, new),
+                         (['D' * 64], ['A' * 64]))
+        self.assertNotEqual(cert_archive_manifest(DATA),
+                            cert_archive_manifest(new))
+        self.assertEqual(cert_archive_manifest(DATA),
+                         cert_archive_manifest(dict(DATA)))
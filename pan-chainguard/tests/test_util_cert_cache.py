@@ -0,0 +1,82 @@
+import base64
+import hashlib
+import os
+import tempfile
+import unittest
+
+from pan_chainguard.util import CertificateCache, UtilError, pem_sha256
+
+# not a real certificate; only the DER SEQUENCE header is checked
+BODY = bytes(range(256)) * 3
+DER = b'\x30\x82' + len(BODY).to_bytes(2, 'big') + BODY
+SHA256 = hashlib.sha256(DER).hexdigest().upper()
+
+
+def pem(der):
+    x = base64.b64encode(der).decode()
+    lines = [x[i:i+64] for i in range(0, len(x), 64)]
+    return ('-----BEGIN CERTIFICATE-----\n' +
+            '\n'.join(lines) +
+            '\n-----END CERTIFICATE-----\n')
+
+
+class UtilCertCacheTest(unittest.TestCase):
+    def test_01(self):
+        self.assertEqual(pem_sha256(pem(DER)), SHA256)
+        self.assertEqual(pem_sha256(pem(DER).encode()), SHA256)
+        self.assertIsNone(pem_sha256('xxx'))
+        self.assertIsNone(pem_sha256(pem(DER).replace('A', '!', 1)))
+        # not a DER SEQUENCE, or the length does not match
+        self.assertIsNone(pem_sha256(pem(BODY)))
+        self.assertIsNone(pem_sha256(pem(DER[:-1])))
+        self.assertIsNone(pem_sha256(pem(DER + b'\0')))
+        self.assertIsNone(pem_sha256(pem(b'\x30\x80' + BODY)))
+        x = b'\x30\x10' + bytes(16)
+        self.assertEqual(pem_sha256(pem(x)),
+                         hashlib.sha256(x).hexdigest().upper())
+
+    def test_02(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'certs')
+            cache = CertificateCache(path=path)
+            self.assertIsNone(cache.get(sha256=SHA256))
+
+            self.assertTrue(cache.put(sha256=SHA256, pem=pem(DER)))
+            self.assertEqual(cache.get(sha256=SHA256), pem(DER))
+            self.assertEqual(os.listdir(path), [SHA256 + '.pem'])
+
+            other = hashlib.sha256(b'x').hexdigest().upper()
+            self.assertFalse(cache.put(sha256=other, pem=pem(DER)))
+            self.assertIsNone(cache.get(sha256=other))
+
+            with self.assertRaises(UtilError):
+                cache.get(sha256='../x')
+
+    def test_03(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = CertificateCache(path=tmp)
+            x = os.path.join(tmp, SHA256 + '.pem')
+            with open(x, 'w') as f:
+                f.write(pem(DER[1:]))
+            # mismatched entry is removed
+            self.assertIsNone(cache.get(sha256=SHA256))
+            self.assertFalse(os.path.exists(x))
+
+    def test_04(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = CertificateCache(path=tmp)
+            x = os.path.join(tmp, SHA256 + '.pem')
+            with open(x, 'w') as f:
+                f.write('corrupt')
+            # corrupt entry is replaced
+            self.assertTrue(cache.put(sha256=SHA256, pem=pem(DER)))
+            with open(x, 'r') as f:
+                self.assertEqual(f.read(), pem(DER))
+
+            umask = os.umask(0o022)
+            try:
+                os.unlink(x)
+                self.assertTrue(cache.put(sha256=SHA256, pem=pem(DER)))
+            finally:
+                os.umask(umask)
+            self.assertEqual(os.stat(x).st_mode & 0o777, 0o644)
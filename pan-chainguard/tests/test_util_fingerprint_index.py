@@ -0,0 +1,36 @@
+import unittest
+
+from pan_chainguard.util import FingerprintIndex, hash_to_name
+
+A = 'A' * 64
+B = 'AB' + 'C' * 62
+# same certificate name as B
+B2 = 'AB' + 'C' * 24 + 'D' * 38
+D = 'D' * 30 + 'AB' + 'D' * 32
+
+
+class FingerprintIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = FingerprintIndex([0, D, B2, A, B])
+
+    def test_01(self):
+        self.assertEqual(len(self.index), 4)
+        self.assertIn(A, self.index)
+        self.assertNotIn('A' * 63, self.index)
+        self.assertNotIn(0, list(self.index.prefix('')))
+
+    def test_02(self):
+        self.assertEqual(self.index.prefix('a'), [A, B, B2])
+        self.assertEqual(self.index.prefix('AB'), [B, B2])
+        self.assertEqual(self.index.prefix('E'), [])
+
+        # prefix match preferred over substring
+        self.assertEqual(self.index.search('ab'), [B, B2])
+        # substring when no prefix match
+        self.assertEqual(self.index.search('DAB'), [D])
+        self.assertEqual(self.index.search('F'), [])
+
+    def test_03(self):
+        self.assertEqual(self.index.collisions(),
+                         {hash_to_name(sha256=B): [B, B2]})
+        self.assertEqual(FingerprintIndex([A, B, D]).collisions(), {})
@@ -0,0 +1,62 @@
+import unittest
+
+import treelib
+
+import pan_chainguard.util
+
+# (identifier, parent), parent before child
+NODES = [
+    ('R1', 0),
+    ('R2', 0),
+    ('R3', 0),
+] + [
+    ('I%d' % i, 'R1') for i in range(12)
+] + [
+    ('J1', 'I0'),
+    ('J2', 'J1'),
+]
+
+
+def tree():
+    x = treelib.Tree()
+    x.create_node(tag='Root', identifier=0)
+    for identifier, parent in NODES:
+        x.create_node(tag=identifier, identifier=identifier, parent=parent)
+    return x
+
+
+class UtilStatsTest(unittest.TestCase):
+    def test_01(self):
+        data = pan_chainguard.util.tree_to_dict(tree=tree())
+        stats = pan_chainguard.util.stats_from_dict(data=data)
+
+        total = len(NODES) + 1
+        self.assertEqual(stats['total_nodes'], total)
+        self.assertEqual(stats['total_roots'], 3)
+        self.assertEqual(stats['roots_with_no_children'], 2)
+        self.assertEqual(stats['total_intermediates'], 14)
+        self.assertEqual(stats['maximum_depth'], 4)
+        self.assertEqual(stats['average_depth'],
+                         (1 * 3 + 2 * 12 + 3 + 4) / total)
+        self.assertEqual(stats['maximum_breadth'], 12)
+        self.assertEqual(stats['maximum_children'], 12)
+        self.assertEqual(stats['average_children'], (total - 1) / total)
+        self.assertEqual(stats['nodes_with_10+_children'], 1)
+        self.assertEqual(stats['nodes_with_50+_children'], 0)
+        self.assertEqual(stats['nodes_with_100+_children'], 0)
+        self.assertEqual(stats['leaf_nodes'], 2 + 11 + 1)
+
+    def test_02(self):
+        t = tree()
+        data = pan_chainguard.util.tree_to_dict(tree=t)
+        self.assertEqual(pan_chainguard.util.stats_from_tree(tree=t),
+                         pan_chainguard.util.stats_from_dict(data=data))
+
+    def test_03(self):
+        t = treelib.Tree()
+        t.create_node(tag='Root', identifier=0)
+        stats = pan_chainguard.util.stats_from_tree(tree=t)
+        self.assertEqual(stats['total_nodes'], 1)
+        self.assertEqual(stats['total_roots'], 0)
+        self.assertEqual(stats['maximum_depth'], 0)
+        self.assertEqual(stats['leaf_nodes'], 1)